@@ -0,0 +1,54 @@
+import threading
+import cachetools
+
+from app import config, models
+
+
+class UserCache:
+    """
+    Bounded, time-limited cache of users keyed by username. Entries expire after `ttl` seconds and the
+    least recently used entries are evicted once `maxsize` is reached.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> models.UserInDB | None:
+        with self._lock:
+            user = self._cache.get(username)
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Callers get their own copy, so changing it can't change the cached user
+        return user.copy(deep=True)
+
+    def set(self, user: models.UserInDB) -> None:
+        user = user.copy(deep=True)
+        with self._lock:
+            self._cache[user.username] = user
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._cache.pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+            }
+
+
+user_cache = UserCache(
+    maxsize=config.USER_CACHE_MAXSIZE, ttl=config.USER_CACHE_TTL_SECONDS
+)
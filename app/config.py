@@ -0,0 +1,113 @@
+import os
+import tempfile
+import dotenv
+
+dotenv.load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+CPAPI_BASE_URL = os.getenv("CPAPI_BASE_URL")
+
+# Storage backend, either "firestore" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+# Optional JSON file used to seed the in-memory backend, keyed by collection name
+STORAGE_SEED_PATH = os.getenv("STORAGE_SEED_PATH")
+
+# Authenticated user lookups
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Access tokens carry the user's id, disabled state and portfolios, and are trusted without reading
+# the user as long as their versions match the in-memory table of recently seen users
+AUTH_STATELESS_TOKENS = os.getenv("AUTH_STATELESS_TOKENS", "true").lower() == "true"
+TOKEN_VERSIONS_MAXSIZE = int(os.getenv("TOKEN_VERSIONS_MAXSIZE", "100000"))
+TOKEN_VERSIONS_TTL_SECONDS = float(os.getenv("TOKEN_VERSIONS_TTL_SECONDS", "60"))
+# How often each worker checks storage for tokens revoked by the others
+TOKEN_REVOCATIONS_POLL_SECONDS = float(os.getenv("TOKEN_REVOCATIONS_POLL_SECONDS", "1"))
+# How far each poll looks back before the previous one, to allow for clocks differing between hosts
+TOKEN_REVOCATIONS_CLOCK_SKEW_SECONDS = float(os.getenv("TOKEN_REVOCATIONS_CLOCK_SKEW_SECONDS", "30"))
+
+# Password hashing pool, either "thread" or "process"
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUED = int(os.getenv("PASSWORD_HASH_MAX_QUEUED", "64"))
+
+# CPAPI gateway connection pool
+CPAPI_TIMEOUT_SECONDS = float(os.getenv("CPAPI_TIMEOUT_SECONDS", "5"))
+CPAPI_MAX_CONNECTIONS = int(os.getenv("CPAPI_MAX_CONNECTIONS", "100"))
+CPAPI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CPAPI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+CPAPI_VERIFY_SSL = os.getenv("CPAPI_VERIFY_SSL", "false").lower() == "true"
+
+# Market snapshot cache
+QUOTE_CACHE_TTL_SECONDS = float(os.getenv("QUOTE_CACHE_TTL_SECONDS", "1"))
+QUOTE_BATCH_WINDOW_SECONDS = float(os.getenv("QUOTE_BATCH_WINDOW_SECONDS", "0.005"))
+QUOTE_BATCH_MAX_CONIDS = int(os.getenv("QUOTE_BATCH_MAX_CONIDS", "200"))
+
+# Historical market data store
+HMDS_CACHE_MAXSIZE = int(os.getenv("HMDS_CACHE_MAXSIZE", "256"))
+HMDS_REFRESH_SECONDS = float(os.getenv("HMDS_REFRESH_SECONDS", "60"))
+HMDS_MAX_BARS = int(os.getenv("HMDS_MAX_BARS", "5000"))
+
+# Symbols snapshot
+SYMBOLS_REFRESH_SECONDS = float(os.getenv("SYMBOLS_REFRESH_SECONDS", "3600"))
+# Symbol writes reported by the storage backend are batched for this long before being applied
+SYMBOLS_FLUSH_SECONDS = float(os.getenv("SYMBOLS_FLUSH_SECONDS", "0.5"))
+
+# Portfolio write-behind buffer
+PORTFOLIO_FLUSH_SECONDS = float(os.getenv("PORTFOLIO_FLUSH_SECONDS", "1"))
+
+# Number of most recent orders kept in the portfolio document
+PORTFOLIO_RECENT_ORDERS = int(os.getenv("PORTFOLIO_RECENT_ORDERS", "10"))
+
+# Maximum number of orders accepted by POST /orders/batch. They are stored in one batched write, and
+# Firestore allows at most 500 writes per batch (FIRESTORE_BATCH_LIMIT)
+ORDER_BATCH_MAX = min(int(os.getenv("ORDER_BATCH_MAX", "500")), 500)
+
+# Number of orders removed per batched delete when a portfolio is deleted
+PORTFOLIO_DELETE_CHUNK_SIZE = int(os.getenv("PORTFOLIO_DELETE_CHUNK_SIZE", "500"))
+# Seconds a worker holds a deletion job for without making progress before another may take it over
+PORTFOLIO_DELETE_LEASE_SECONDS = float(os.getenv("PORTFOLIO_DELETE_LEASE_SECONDS", "60"))
+
+# Portfolio equity curves. A point is recorded at most every EQUITY_SNAPSHOT_SECONDS per portfolio
+# when the portfolio is valued, and new points are written to storage every EQUITY_FLUSH_SECONDS
+EQUITY_SNAPSHOT_SECONDS = float(os.getenv("EQUITY_SNAPSHOT_SECONDS", "60"))
+EQUITY_FLUSH_SECONDS = float(os.getenv("EQUITY_FLUSH_SECONDS", "30"))
+EQUITY_CACHE_MAXSIZE = int(os.getenv("EQUITY_CACHE_MAXSIZE", "1000"))
+EQUITY_CACHE_TTL_SECONDS = float(os.getenv("EQUITY_CACHE_TTL_SECONDS", "60"))
+# Maximum number of points returned by GET /portfolio/history
+EQUITY_HISTORY_MAX_POINTS = int(os.getenv("EQUITY_HISTORY_MAX_POINTS", "2000"))
+
+# Order matching
+MATCHING_ENABLED = os.getenv("MATCHING_ENABLED", "true").lower() == "true"
+MATCHING_INTERVAL_SECONDS = float(os.getenv("MATCHING_INTERVAL_SECONDS", "1"))
+# How often new orders placed through other worker processes are picked up
+MATCHING_SYNC_SECONDS = float(os.getenv("MATCHING_SYNC_SECONDS", "5"))
+# Lock file that makes sure only one worker process on the host matches orders
+MATCHING_LOCK_PATH = os.getenv(
+    "MATCHING_LOCK_PATH", os.path.join(tempfile.gettempdir(), "paperhands-matching.lock")
+)
+
+# Prometheus metrics at /metrics, including timing of every storage call
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# With several server workers, each writes its metrics to files in this directory so that /metrics
+# reports every worker; a temporary directory is used when it is unset
+METRICS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# On-demand profiling, off unless PROFILING_DIR is set. Requests with an X-Profile header matching
+# PROFILING_TOKEN, and a PROFILING_SAMPLE_RATE fraction of all requests, are profiled
+PROFILING_DIR = os.getenv("PROFILING_DIR")
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+
+# Server launched by `python main.py`. SERVER_WORKERS=0 starts one worker per CPU
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+SERVER_KEEPALIVE_SECONDS = int(os.getenv("SERVER_KEEPALIVE_SECONDS", "5"))
+# Seconds each worker keeps serving, failing its readiness checks, after SIGTERM
+SERVER_DRAIN_SECONDS = float(os.getenv("SERVER_DRAIN_SECONDS", "5"))
+
+# Portfolio streaming
+STREAM_QUOTE_INTERVAL_SECONDS = float(os.getenv("STREAM_QUOTE_INTERVAL_SECONDS", "1"))
+STREAM_PORTFOLIO_REFRESH_SECONDS = float(os.getenv("STREAM_PORTFOLIO_REFRESH_SECONDS", "5"))
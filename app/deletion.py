@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+
+from app import config, models, storage
+from app.matching import matching_engine
+
+logger = logging.getLogger(__name__)
+
+
+class PortfolioDeleter:
+    """
+    Deletes portfolios in the background.
+
+    A deleted portfolio is only marked as such by the request that deletes it; its orders are then
+    removed here in chunks of `chunk_size` with one batched delete per chunk, and the portfolio
+    document goes last. Progress is recorded on a deletion job stored alongside the portfolio, so a
+    deletion interrupted by a restart is picked up again on the next start.
+
+    A worker claims a job before running it, for `lease` seconds that are extended each time it
+    records progress, so that workers starting at the same time don't all resume the same jobs. A job
+    whose claim has lapsed, because its worker died, is resumed by the next worker to start.
+    """
+
+    def __init__(self, chunk_size: int, lease: float):
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.worker_id = uuid.uuid4().hex
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    async def schedule(self, db: storage.Storage, portfolio: dict) -> models.PortfolioDeletion:
+        job = models.PortfolioDeletion(
+            portfolio_id=portfolio["id"],
+            owner_id=portfolio["owner_id"],
+            claimed_by=self.worker_id,
+            claimed_until=time.time() + self.lease,
+        )
+        await asyncio.to_thread(db.set_deletion_job, job.dict())
+        self._start_job(job.dict())
+        return job
+
+    def _progress(self, db: storage.Storage, portfolio_id: str, fields: dict) -> None:
+        db.update_deletion_job(
+            portfolio_id,
+            {
+                **fields,
+                "claimed_until": time.time() + self.lease,
+                "updated_at": str(datetime.datetime.utcnow()),
+            },
+        )
+
+    def _start_job(self, job: dict) -> None:
+        portfolio_id = job["portfolio_id"]
+        if portfolio_id in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks[portfolio_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(portfolio_id, None))
+
+    async def _run(self, job: dict) -> None:
+        db = storage.get_storage()
+        try:
+            await asyncio.to_thread(self.delete, db, job)
+        except Exception as exc:
+            logger.exception("Failed to delete portfolio %s", job["portfolio_id"])
+            await asyncio.to_thread(
+                db.update_deletion_job,
+                job["portfolio_id"],
+                {"status": "FAILED", "error": str(exc), "updated_at": str(datetime.datetime.utcnow())},
+            )
+
+    def delete(self, db: storage.Storage, job: dict) -> None:
+        portfolio_id = job["portfolio_id"]
+        deleted_orders = job["deleted_orders"]
+        self._progress(db, portfolio_id, {"status": "RUNNING", "error": None})
+        while True:
+            orders = db.list_orders(portfolio_id, limit=self.chunk_size)
+            if not orders:
+                break
+            order_ids = [order["id"] for order in orders]
+            for order_id in order_ids:
+                matching_engine.cancel(order_id)
+            db.delete_orders(order_ids)
+            deleted_orders += len(order_ids)
+            self._progress(db, portfolio_id, {"deleted_orders": deleted_orders})
+        db.delete_equity_points(portfolio_id)
+        db.delete_portfolio(portfolio_id)
+        self._progress(db, portfolio_id, {"status": "DONE"})
+
+    def _claim_unfinished(self, db: storage.Storage) -> list[dict]:
+        claimed = []
+        for job in db.get_unfinished_deletion_jobs():
+            now = time.time()
+            job = db.claim_deletion_job(job["portfolio_id"], self.worker_id, now + self.lease, now)
+            if job is not None:
+                claimed.append(job)
+        return claimed
+
+    async def start(self) -> None:
+        jobs = await asyncio.to_thread(self._claim_unfinished, storage.get_storage())
+        for job in jobs:
+            self._start_job(job)
+
+    async def stop(self) -> None:
+        # Interrupted jobs stay unfinished in storage and are resumed on the next start
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+portfolio_deleter = PortfolioDeleter(
+    chunk_size=config.PORTFOLIO_DELETE_CHUNK_SIZE, lease=config.PORTFOLIO_DELETE_LEASE_SECONDS
+)
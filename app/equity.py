@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import threading
+import time
+import cachetools
+import numpy as np
+
+from app import config, storage
+
+logger = logging.getLogger(__name__)
+
+
+class EquityLog:
+    """
+    Equity curve of one portfolio, kept as three numpy columns that grow by doubling: timestamps in
+    epoch milliseconds, total value and PnL. Points are kept in timestamp order, one per timestamp.
+    The log holds every point from `start` onwards.
+    """
+
+    def __init__(self, capacity: int = 64, start: int = 0):
+        self._t = np.empty(capacity, dtype=np.int64)
+        self._value = np.empty(capacity, dtype=np.float64)
+        self._pnl = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.start = start
+
+    @classmethod
+    def from_points(cls, points: list[dict], start: int = 0) -> "EquityLog":
+        log = cls(capacity=max(64, len(points)), start=start)
+        log.extend(points)
+        return log
+
+    @property
+    def t(self) -> np.ndarray:
+        return self._t[: self.size]
+
+    @property
+    def value(self) -> np.ndarray:
+        return self._value[: self.size]
+
+    @property
+    def pnl(self) -> np.ndarray:
+        return self._pnl[: self.size]
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._t)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("_t", "_value", "_pnl"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[: self.size] = column[: self.size]
+            setattr(self, name, grown)
+
+    def append(self, t: int, value: float, pnl: float) -> None:
+        if self.size and t <= self._t[self.size - 1]:
+            self.extend([{"t": t, "value": value, "pnl": pnl}])
+            return
+        self._reserve(self.size + 1)
+        self._t[self.size] = t
+        self._value[self.size] = value
+        self._pnl[self.size] = pnl
+        self.size += 1
+
+    def extend(self, points: list[dict]) -> None:
+        """
+        Add points in any order. A point with the same timestamp as an existing one replaces it.
+        """
+        if not points:
+            return
+        count = len(points)
+        t = np.concatenate([self.t, np.fromiter((p["t"] for p in points), np.int64, count)])
+        value = np.concatenate(
+            [self.value, np.fromiter((p["value"] for p in points), np.float64, count)]
+        )
+        pnl = np.concatenate([self.pnl, np.fromiter((p["pnl"] for p in points), np.float64, count)])
+        # Keep the last point given for each timestamp, by searching the reversed columns
+        order = np.argsort(t[::-1], kind="stable")
+        t, keep = np.unique(t[::-1][order], return_index=True)
+        keep = order[keep]
+        self._reserve(len(t))
+        self.size = len(t)
+        self._t[: self.size] = t
+        self._value[: self.size] = value[::-1][keep]
+        self._pnl[: self.size] = pnl[::-1][keep]
+
+    def downsample(self, start: int, end: int, points: int) -> list[dict]:
+        """
+        The points between `start` and `end` inclusive, reduced to at most `points` by splitting the
+        range into equal time buckets. Each bucket is represented by its last point, along with the
+        lowest and highest value within it so that charts keep the peaks and troughs.
+        """
+        low_index = np.searchsorted(self.t, start, side="left")
+        high_index = np.searchsorted(self.t, end, side="right")
+        t = self.t[low_index:high_index]
+        value = self.value[low_index:high_index]
+        pnl = self.pnl[low_index:high_index]
+        if len(t) <= points:
+            last = np.arange(len(t))
+            low = high = value
+        else:
+            width = (int(t[-1]) - int(t[0])) / points
+            buckets = np.minimum(((t - t[0]) / width).astype(np.int64), points - 1)
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            last = np.r_[starts[1:] - 1, len(t) - 1]
+            low = np.minimum.reduceat(value, starts)
+            high = np.maximum.reduceat(value, starts)
+        columns = (t[last], value[last], pnl[last], low, high)
+        return [
+            dict(zip(("t", "value", "pnl", "low", "high"), point))
+            for point in zip(*(column.tolist() for column in columns))
+        ]
+
+
+class EquityCurves:
+    """
+    Equity curves of portfolios: their total value and PnL over time.
+
+    A point is recorded whenever a portfolio is valued, at most once every `interval` seconds per
+    portfolio. New points are buffered and appended to storage every `flush_interval` seconds and on
+    shutdown. Curves are read from storage from the start of the first range asked for, and kept in
+    memory as `EquityLog`s for `ttl` seconds with points recorded by this process added as they come;
+    a range starting earlier reads the curve again. Points recorded by other worker processes show
+    up once the cached curve expires.
+    """
+
+    def __init__(self, interval: float, flush_interval: float, maxsize: int, ttl: float):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._logs = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        self._last_recorded = cachetools.LRUCache(maxsize=maxsize)
+        self._pending: dict[str, list[dict]] = {}
+        # Points taken by a flush that is still writing them
+        self._flushing: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self.recorded = 0
+        self.writes = 0
+
+    def record(self, portfolio_id: str, value: float, pnl: float) -> None:
+        now = time.time()
+        with self._lock:
+            last = self._last_recorded.get(portfolio_id)
+            if last is not None and now - last < self.interval:
+                return
+            self._last_recorded[portfolio_id] = now
+            point = {"t": int(now * 1000), "value": value, "pnl": pnl}
+            self._pending.setdefault(portfolio_id, []).append(point)
+            log = self._logs.get(portfolio_id)
+            if log is not None:
+                log.append(point["t"], value, pnl)
+            self.recorded += 1
+
+    def _log(self, db: storage.Storage, portfolio_id: str, start: int) -> EquityLog:
+        with self._lock:
+            log = self._logs.get(portfolio_id)
+        if log is not None and log.start <= start:
+            return log
+        stored = db.get_equity_points(portfolio_id, start=start)
+        with self._lock:
+            log = EquityLog.from_points(stored, start=start)
+            # Points not yet written, or being written right now, aren't in storage yet
+            log.extend(self._flushing.get(portfolio_id, []) + self._pending.get(portfolio_id, []))
+            self._logs[portfolio_id] = log
+        return log
+
+    def history(
+        self, db: storage.Storage, portfolio_id: str, start: int, end: int, points: int
+    ) -> list[dict]:
+        """
+        The equity curve of a portfolio between `start` and `end`, in epoch milliseconds, downsampled
+        to at most `points` points.
+        """
+        log = self._log(db, portfolio_id, start)
+        with self._lock:
+            return log.downsample(start, end, points)
+
+    def discard(self, portfolio_id: str) -> None:
+        """
+        Forget a portfolio, for example because it has been deleted.
+        """
+        with self._lock:
+            self._pending.pop(portfolio_id, None)
+            self._logs.pop(portfolio_id, None)
+            self._last_recorded.pop(portfolio_id, None)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            if not self._flushing:
+                return
+            try:
+                await asyncio.to_thread(storage.get_storage().append_equity_points, self._flushing)
+            except Exception:
+                # Put the points back in front of any newer ones and retry next flush
+                with self._lock:
+                    for portfolio_id, points in self._flushing.items():
+                        self._pending[portfolio_id] = points + self._pending.get(portfolio_id, [])
+                raise
+            finally:
+                with self._lock:
+                    written, self._flushing = self._flushing, {}
+            self.writes += sum(len(points) for points in written.values())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush equity curve points")
+
+    async def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "writes": self.writes,
+                "pending": sum(len(points) for points in self._pending.values()),
+                "cached": len(self._logs),
+            }
+
+
+equity_curves = EquityCurves(
+    interval=config.EQUITY_SNAPSHOT_SECONDS,
+    flush_interval=config.EQUITY_FLUSH_SECONDS,
+    maxsize=config.EQUITY_CACHE_MAXSIZE,
+    ttl=config.EQUITY_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,86 @@
+import time
+import httpx
+
+from app import config, metrics
+
+
+class GatewayClient:
+    """
+    Shared async client for the CPAPI gateway. Connections are pooled and kept alive between calls,
+    and every call has a timeout. The underlying httpx client is created on first use and must be
+    closed with `close` when the application shuts down.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float,
+        max_connections: int,
+        max_keepalive_connections: int,
+        verify: bool = False,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.verify = verify
+        self.transport = transport
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                verify=self.verify,
+                transport=self.transport,
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(
+        self, path: str, params: dict | None = None, timeout: float | None = None
+    ) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            return await self.client.get(
+                path,
+                params=params,
+                timeout=timeout if timeout is not None else self.timeout,
+            )
+        finally:
+            metrics.record_dependency_call("gateway", path, time.perf_counter() - start)
+
+    async def snapshot(self, conids: list[int]) -> list[dict]:
+        """
+        Get market snapshots for a list of conids.
+        """
+        response = await self.get(
+            "/snapshot", params={"conids": ",".join(str(conid) for conid in conids)}
+        )
+        response.raise_for_status()
+        return response.json() or []
+
+    async def hmds(self, symbol: str, **params) -> httpx.Response:
+        """
+        Get historical market data bars for a symbol.
+        """
+        return await self.get("/hmds", params={"symbol": symbol, **params})
+
+
+gateway = GatewayClient(
+    base_url=config.CPAPI_BASE_URL or "",
+    timeout=config.CPAPI_TIMEOUT_SECONDS,
+    max_connections=config.CPAPI_MAX_CONNECTIONS,
+    max_keepalive_connections=config.CPAPI_MAX_KEEPALIVE_CONNECTIONS,
+    verify=config.CPAPI_VERIFY_SSL,
+)
@@ -0,0 +1,77 @@
+import asyncio
+import concurrent.futures
+from passlib.context import CryptContext
+
+from app import config
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Raised when more password hashing jobs are waiting than the configured queue allows.
+    """
+
+
+def verify_password(plain_password: str, hashed_password: str):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str):
+    return pwd_context.hash(password)
+
+
+def _create_executor() -> concurrent.futures.Executor:
+    if config.PASSWORD_HASH_EXECUTOR == "process":
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=config.PASSWORD_HASH_WORKERS
+        )
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+    )
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification in a dedicated worker pool so that it doesn't block the event
+    loop. At most `workers` jobs run at once, and at most `max_queued` further jobs wait for a worker;
+    anything beyond that is rejected with PasswordHashingBusy instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.pending = 0
+        self._executor: concurrent.futures.Executor | None = None
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            self._executor = _create_executor()
+        return self._executor
+
+    async def _run(self, function, *args):
+        if self.pending >= self.workers + self.max_queued:
+            raise PasswordHashingBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=config.PASSWORD_HASH_WORKERS, max_queued=config.PASSWORD_HASH_MAX_QUEUED
+)
@@ -0,0 +1,71 @@
+import logging
+import threading
+import prometheus_client
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+COLD_START_SECONDS = prometheus_client.Gauge(
+    "app_cold_start_seconds",
+    "Time taken to start this worker process",
+    ["phase"],
+    # With several workers, report each live worker's own value
+    multiprocess_mode="liveall",
+)
+
+
+class Readiness:
+    """
+    Whether this worker process should receive traffic. A worker is ready once its startup has
+    finished, and stops being ready when it is asked to exit, while it keeps serving for a grace
+    period so that load balancers see it fail its readiness checks before it closes its socket.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.cold_start: dict[str, float] = {}
+
+    def mark_ready(self, imports: float, startup: float) -> None:
+        self.cold_start = {
+            "imports": round(imports, 4),
+            "startup": round(startup, 4),
+            "total": round(imports + startup, 4),
+        }
+        for phase, seconds in self.cold_start.items():
+            COLD_START_SECONDS.labels(phase).set(seconds)
+        self.ready = True
+        logger.info(
+            "Worker ready in %.3fs (imports %.3fs, startup %.3fs)",
+            imports + startup,
+            imports,
+            startup,
+        )
+
+    def mark_draining(self) -> None:
+        self.ready = False
+        self.draining = True
+
+
+readiness = Readiness()
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    A uvicorn server that, when asked to exit, marks the worker as draining and carries on serving
+    for `drain_seconds` before it stops accepting connections. A second signal exits straight away.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain_seconds: float):
+        super().__init__(config)
+        self.drain_seconds = drain_seconds
+
+    def handle_exit(self, sig, frame) -> None:
+        if readiness.draining or self.drain_seconds <= 0:
+            super().handle_exit(sig, frame)
+            return
+        readiness.mark_draining()
+        logger.info("Draining for %.1fs before shutting down", self.drain_seconds)
+        timer = threading.Timer(self.drain_seconds, super().handle_exit, (sig, frame))
+        timer.daemon = True
+        timer.start()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import threading
+import time
+import cachetools
+import httpx
+
+from app import config, storage
+from app.gateway import GatewayClient, gateway
+
+logger = logging.getLogger(__name__)
+
+
+class HistoricalDataNotFound(Exception):
+    """
+    Raised when neither the store nor the gateway has historical market data for a symbol.
+    """
+
+
+def _bars(payload) -> list[dict] | None:
+    """
+    The bars in a gateway payload, oldest first, or None if it doesn't hold a list of bars. The bars
+    are either the payload itself or, as the CPAPI history endpoint sends them, under its "data" key.
+    """
+    if isinstance(payload, dict):
+        payload = payload.get("data")
+    if not isinstance(payload, list) or not all(
+        isinstance(bar, dict) and isinstance(bar.get("t"), int) for bar in payload
+    ):
+        return None
+    return sorted(payload, key=lambda bar: bar["t"])
+
+
+class HistoricalDataStore:
+    """
+    Read-through store for historical market data bars.
+
+    Bars are looked up in an in-process LRU tier first, then in the hmds collection, and only then
+    in the gateway. Stored bars are considered fresh for `refresh_interval` seconds; after that only
+    the bars from the last stored bar onwards are requested from the gateway and merged in. Bars are
+    identified by their "t" timestamp, and at most `max_bars` of the most recent bars are kept.
+
+    The gateway is expected to answer with a JSON list of bars, each with an integer "t", either as
+    is or under a "data" key, and to return only the bars from its `start` parameter onwards. A
+    gateway that ignores `start` and returns the whole history still works, just without the
+    saving. Other JSON is passed through as the gateway sent it, without being stored, when there
+    are no stored bars to serve instead. Concurrent requests for a symbol share a single load.
+    """
+
+    def __init__(
+        self,
+        gateway: GatewayClient,
+        maxsize: int,
+        refresh_interval: float,
+        max_bars: int,
+    ):
+        self.gateway = gateway
+        self.refresh_interval = refresh_interval
+        self.max_bars = max_bars
+        self._memory = cachetools.LRUCache(maxsize=maxsize)
+        self._memory_lock = threading.Lock()
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.gateway_fetches = 0
+
+    def _fresh(self, data: dict | None) -> bool:
+        return (
+            data is not None
+            and time.time() - data["updated_at"] < self.refresh_interval
+        )
+
+    def _remember(self, symbol: str, data: dict) -> None:
+        with self._memory_lock:
+            self._memory[symbol] = data
+
+    def _recall(self, symbol: str) -> dict | None:
+        with self._memory_lock:
+            return self._memory.get(symbol)
+
+    async def get(self, db: storage.Storage, symbol: str) -> list[dict] | dict:
+        data = self._recall(symbol)
+        if self._fresh(data):
+            self.memory_hits += 1
+            return data["bars"]
+        task = self._in_flight.get(symbol)
+        if task is None:
+            task = asyncio.create_task(self._load(db, symbol, data))
+            self._in_flight[symbol] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(symbol, None))
+        # A request that goes away doesn't cancel the load for the others waiting on it
+        data = await asyncio.shield(task)
+        return data["bars"]
+
+    async def _load(self, db: storage.Storage, symbol: str, data: dict | None) -> dict:
+        if data is None:
+            data = await asyncio.to_thread(db.get_hmds, symbol)
+            if self._fresh(data):
+                self.store_hits += 1
+                self._remember(symbol, data)
+                return data
+        return await self._refresh(db, symbol, data)
+
+    async def _refresh(self, db: storage.Storage, symbol: str, data: dict | None) -> dict:
+        bars = data["bars"] if data else []
+        params = {"start": bars[-1]["t"]} if bars else {}
+        self.gateway_fetches += 1
+        try:
+            response = await self.gateway.hmds(symbol, **params)
+        except httpx.HTTPError:
+            if not bars:
+                raise
+            # Serve what we have rather than fail the request
+            return data
+        if response.status_code != 200:
+            if not bars:
+                raise HistoricalDataNotFound(symbol)
+            return data
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        new_bars = _bars(payload)
+        if new_bars is None:
+            logger.warning("Unexpected historical data for %s from the gateway", symbol)
+            if bars:
+                return data
+            if not isinstance(payload, (list, dict)):
+                raise HistoricalDataNotFound(symbol)
+            # Nothing else to serve, so pass the response through, but don't keep it
+            return {"symbol": symbol, "bars": payload, "updated_at": 0}
+        if new_bars:
+            # The last stored bar may have been incomplete, so let the gateway's version win
+            first_new = new_bars[0]["t"]
+            bars = [bar for bar in bars if bar["t"] < first_new] + new_bars
+        elif not bars:
+            raise HistoricalDataNotFound(symbol)
+        data = {
+            "symbol": symbol,
+            "bars": bars[-self.max_bars :],
+            "updated_at": time.time(),
+        }
+        await asyncio.to_thread(db.set_hmds, symbol, data)
+        self._remember(symbol, data)
+        return data
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "gateway_fetches": self.gateway_fetches,
+            "size": len(self._memory),
+        }
+
+
+hmds_store = HistoricalDataStore(
+    gateway=gateway,
+    maxsize=config.HMDS_CACHE_MAXSIZE,
+    refresh_interval=config.HMDS_REFRESH_SECONDS,
+    max_bars=config.HMDS_MAX_BARS,
+)
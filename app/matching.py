@@ -0,0 +1,400 @@
+import asyncio
+import collections
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import threading
+import typing
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app import config, storage
+from app.quotes import snapshot_cache
+from app.symbols import symbol_directory
+
+logger = logging.getLogger(__name__)
+
+
+# Number of filled order ids a portfolio remembers, so that fills are applied to it only once
+APPLIED_FILLS_KEPT = 1000
+
+
+class Fill(typing.NamedTuple):
+    order: dict
+    price: float
+
+
+class OrderBook:
+    """
+    Resting orders for one symbol. Limit orders are kept in heaps with the best price on top: BUY
+    orders by highest limit price and SELL orders by lowest, ties in arrival order. Market orders wait
+    in a queue for the next quote.
+    """
+
+    def __init__(self):
+        self.buys: list[tuple[float, int, str]] = []
+        self.sells: list[tuple[float, int, str]] = []
+        self.market: collections.deque[str] = collections.deque()
+        # Entries of cancelled orders still in the heaps and queue
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self.buys) + len(self.sells) + len(self.market)
+
+
+class MatchingEngine:
+    """
+    Matches resting orders against quotes.
+
+    Each quote only touches the top of its symbol's books, so a tick costs O(fills log n) however many
+    orders are resting. Cancelled orders are removed lazily: they are dropped from `orders` straight
+    away and skipped when they reach the top of a book, and a book is compacted once more than
+    `compact_ratio` of its entries belong to cancelled orders.
+    """
+
+    def __init__(self, compact_ratio: float = 0.5, compact_min: int = 64):
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.books: dict[str, OrderBook] = {}
+        self.orders: dict[str, dict] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, order: dict) -> None:
+        if order["order_type"] != "MKT" and order.get("limit_price") is None:
+            logger.warning("Ignoring limit order %s without a limit price", order["id"])
+            return
+        with self._lock:
+            if order["id"] in self.orders:
+                return
+            book = self.books.setdefault(order["symbol"], OrderBook())
+            self.orders[order["id"]] = order
+            if order["order_type"] == "MKT":
+                book.market.append(order["id"])
+            elif order["side"] == "BUY":
+                heapq.heappush(
+                    book.buys, (-order["limit_price"], next(self._sequence), order["id"])
+                )
+            else:
+                heapq.heappush(
+                    book.sells, (order["limit_price"], next(self._sequence), order["id"])
+                )
+
+    def cancel(self, order_id: str) -> None:
+        with self._lock:
+            order = self.orders.pop(order_id, None)
+            if order is None:
+                return
+            book = self.books[order["symbol"]]
+            book.dead += 1
+            if book.dead > self.compact_min and book.dead > self.compact_ratio * len(book):
+                self._compact(book)
+
+    def _compact(self, book: OrderBook) -> None:
+        book.buys = [entry for entry in book.buys if entry[2] in self.orders]
+        book.sells = [entry for entry in book.sells if entry[2] in self.orders]
+        heapq.heapify(book.buys)
+        heapq.heapify(book.sells)
+        book.market = collections.deque(
+            order_id for order_id in book.market if order_id in self.orders
+        )
+        book.dead = 0
+
+    def restore(self, orders: list[dict]) -> None:
+        """
+        Put orders taken by `match` back, for example because their fills couldn't be recorded. They
+        go behind orders at the same price that are already resting.
+        """
+        for order in orders:
+            self.add(order)
+
+    def symbols(self) -> list[str]:
+        """
+        Symbols that have resting orders.
+        """
+        with self._lock:
+            return [
+                symbol
+                for symbol, book in self.books.items()
+                if book.buys or book.sells or book.market
+            ]
+
+    def match(self, quotes: dict[str, tuple[float, float]]) -> list[Fill]:
+        """
+        Match resting orders against a batch of (bid, ask) quotes keyed by symbol. BUY orders fill at
+        the ask and SELL orders at the bid.
+        """
+        fills = []
+        with self._lock:
+            for symbol, (bid, ask) in quotes.items():
+                book = self.books.get(symbol)
+                if book is None:
+                    continue
+                while book.market:
+                    order = self._take(book, book.market.popleft())
+                    if order is not None:
+                        fills.append(Fill(order, ask if order["side"] == "BUY" else bid))
+                while book.buys and -book.buys[0][0] >= ask:
+                    order = self._take(book, heapq.heappop(book.buys)[2])
+                    if order is not None:
+                        fills.append(Fill(order, ask))
+                while book.sells and book.sells[0][0] <= bid:
+                    order = self._take(book, heapq.heappop(book.sells)[2])
+                    if order is not None:
+                        fills.append(Fill(order, bid))
+        return fills
+
+    def _take(self, book: OrderBook, order_id: str) -> dict | None:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            book.dead -= 1
+        return order
+
+
+def apply_fill(positions: list[dict], order: dict, conid: int, price: float) -> None:
+    """
+    Apply a fill to a portfolio's positions. Fills on the same side add to the position, and fills on
+    the opposite side reduce it, flipping it if the fill is larger than the position.
+    """
+    quantity = order["quantity"]
+    side = order["side"]
+    sign = 1 if side == "BUY" else -1
+    position = next((p for p in positions if p["conid"] == conid), None)
+    if position is None:
+        positions.append(
+            {
+                "symbol": order["symbol"],
+                "quantity": quantity,
+                "side": side,
+                "value": sign * price * quantity,
+                "conid": conid,
+                "pnl": 0.0,
+                "id": str(uuid.uuid4()),
+            }
+        )
+        return
+    if position["quantity"] == 0 or position["side"] == side:
+        if position["quantity"] == 0:
+            position["side"] = side
+            position["value"] = 0.0
+        position["quantity"] += quantity
+        position["value"] += sign * price * quantity
+    elif quantity <= position["quantity"]:
+        remaining = position["quantity"] - quantity
+        position["value"] *= remaining / position["quantity"]
+        position["quantity"] = remaining
+    else:
+        remaining = quantity - position["quantity"]
+        position["side"] = side
+        position["quantity"] = remaining
+        position["value"] = sign * price * remaining
+
+
+class MatchingService:
+    """
+    Runs the matching engine in the background: every `interval` seconds it fetches quotes for the
+    symbols that have resting orders, matches them, and records the fills on the orders and on the
+    portfolios' positions.
+
+    When the app runs several worker processes only one of them may match, or orders would fill once
+    per worker. The worker holding an exclusive lock on `lock_path` is the one that matches; the others
+    keep trying to take the lock over in case it exits. Orders placed through other workers are picked
+    up from storage every `sync_interval` seconds, and fills for orders that were cancelled elsewhere
+    in the meantime are dropped when they are recorded. The lock only covers one host, so an order
+    is only marked FILLED if it is still OPEN; a matcher on another host can't fill it twice.
+    """
+
+    def __init__(
+        self, engine: MatchingEngine, interval: float, sync_interval: float, lock_path: str
+    ):
+        self.engine = engine
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.lock_path = lock_path
+        self.active = False
+        self._lock_file = None
+        self._synced_at: str | None = None
+        self._task: asyncio.Task | None = None
+        # (fill, conid, order update) of filled orders not yet applied to their portfolio
+        self._unapplied: list[tuple[Fill, int, dict]] = []
+        self.fills = 0
+
+    def _acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held for the life of the process; the OS releases it if the process dies
+        self._lock_file = lock_file
+        return True
+
+    def submit(self, order: dict) -> None:
+        """
+        Hand a new order to the engine if this process is the one matching orders.
+        """
+        if self.active:
+            self.engine.add(order)
+
+    def load(self, db: storage.Storage) -> None:
+        """
+        Add open orders from storage to the engine. After the first load only orders created since the
+        previous one are read, with one sync interval of overlap for orders that were being written.
+        """
+        started = datetime.datetime.utcnow()
+        since = self._synced_at
+        for order in db.get_open_orders(since=since):
+            self.engine.add(order)
+        self._synced_at = str(started - datetime.timedelta(seconds=self.sync_interval))
+
+    async def tick(self) -> None:
+        if self._unapplied:
+            await asyncio.to_thread(self.apply_fills, storage.get_storage())
+        symbols = self.engine.symbols()
+        if not symbols:
+            return
+        conids = {}
+        for symbol in symbols:
+            info = symbol_directory.resolve(symbol)
+            if info is not None:
+                conids[info.conid] = symbol
+        if not conids:
+            return
+        snapshots = await snapshot_cache.get(list(conids))
+        quotes = {
+            conids[snapshot["conid"]]: (snapshot["bid_price"], snapshot["ask_price"])
+            for snapshot in snapshots
+        }
+        fills = self.engine.match(quotes)
+        if fills:
+            conids_by_symbol = {symbol: conid for conid, symbol in conids.items()}
+            await asyncio.to_thread(
+                self.record_fills, storage.get_storage(), fills, conids_by_symbol
+            )
+
+    def record_fills(
+        self, db: storage.Storage, fills: list[Fill], conids: dict[str, int]
+    ) -> None:
+        """
+        Mark the filled orders as FILLED and apply the fills to their portfolios' positions. If the
+        orders can't be updated they go back into the engine to be matched again; fills whose orders
+        were updated but whose positions couldn't be are kept and retried on the next tick.
+        """
+        filled_at = str(datetime.datetime.utcnow())
+        order_updates = {
+            fill.order["id"]: {
+                "status": "FILLED",
+                "filled_price": fill.price,
+                "filled_at": filled_at,
+            }
+            for fill in fills
+        }
+        try:
+            # Orders that were cancelled, or filled by another matcher, since they were loaded are
+            # no longer OPEN and must not move positions
+            updated = set(db.update_orders(order_updates, if_status="OPEN"))
+        except Exception:
+            self.engine.restore([fill.order for fill in fills])
+            raise
+        for fill in fills:
+            if fill.order["id"] in updated:
+                self._unapplied.append(
+                    (fill, conids[fill.order["symbol"]], order_updates[fill.order["id"]])
+                )
+        self.apply_fills(db)
+
+    def apply_fills(self, db: storage.Storage) -> None:
+        """
+        Apply recorded fills to positions, one atomic change per portfolio. Each portfolio remembers
+        the orders whose fills it has applied, so a retried change never applies a fill twice.
+        """
+        fills_by_portfolio = collections.defaultdict(list)
+        for unapplied in self._unapplied:
+            fills_by_portfolio[unapplied[0].order["portfolio_id"]].append(unapplied)
+        for portfolio_id, portfolio_fills in fills_by_portfolio.items():
+
+            def modify(portfolio: dict) -> dict | None:
+                if portfolio.get("deleted"):
+                    return None
+                applied = portfolio.get("applied_fills", [])
+                fills = [fill for fill in portfolio_fills if fill[0].order["id"] not in applied]
+                if not fills:
+                    return None
+                for fill, conid, _ in fills:
+                    apply_fill(portfolio["positions"], fill.order, conid, fill.price)
+                order_updates = {fill.order["id"]: update for fill, _, update in fills}
+                return {
+                    "positions": portfolio["positions"],
+                    "orders": [
+                        {**order, **order_updates.get(order["id"], {})}
+                        for order in portfolio["orders"]
+                    ],
+                    "applied_fills": (applied + list(order_updates))[-APPLIED_FILLS_KEPT:],
+                }
+
+            try:
+                db.modify_portfolio(portfolio_id, modify)
+            except Exception:
+                logger.exception("Failed to apply fills to portfolio %s", portfolio_id)
+                continue
+            applied_ids = {fill.order["id"] for fill, _, _ in portfolio_fills}
+            self._unapplied = [
+                unapplied
+                for unapplied in self._unapplied
+                if unapplied[0].order["id"] not in applied_ids
+            ]
+            self.fills += len(portfolio_fills)
+
+    async def _activate(self) -> bool:
+        if not self.active and self._acquire():
+            await asyncio.to_thread(self.load, storage.get_storage())
+            self.active = True
+            logger.info("Matching orders in process %s", os.getpid())
+        return self.active
+
+    async def _run(self) -> None:
+        next_sync = asyncio.get_running_loop().time() + self.sync_interval
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if not await self._activate():
+                    continue
+                if asyncio.get_running_loop().time() >= next_sync:
+                    await asyncio.to_thread(self.load, storage.get_storage())
+                    next_sync = asyncio.get_running_loop().time() + self.sync_interval
+                await self.tick()
+            except Exception:
+                logger.exception("Order matching failed")
+
+    async def start(self) -> None:
+        if not config.MATCHING_ENABLED:
+            return
+        await self._activate()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.active = False
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+matching_engine = MatchingEngine()
+matching_service = MatchingService(
+    matching_engine,
+    interval=config.MATCHING_INTERVAL_SECONDS,
+    sync_interval=config.MATCHING_SYNC_SECONDS,
+    lock_path=config.MATCHING_LOCK_PATH,
+)
@@ -0,0 +1,196 @@
+import contextvars
+import functools
+import os
+import tempfile
+import time
+import prometheus_client
+from prometheus_client import multiprocess
+
+REQUEST_LATENCY = prometheus_client.Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route", "status"],
+)
+DEPENDENCY_LATENCY = prometheus_client.Histogram(
+    "dependency_call_duration_seconds",
+    "Time spent in individual storage operations and gateway calls",
+    ["dependency", "operation", "route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+REQUEST_DEPENDENCY_TIME = prometheus_client.Histogram(
+    "http_request_dependency_seconds",
+    "Total time each HTTP request spent waiting on a dependency",
+    ["dependency", "route"],
+)
+REQUEST_DEPENDENCY_CALLS = prometheus_client.Histogram(
+    "http_request_dependency_calls",
+    "Number of dependency calls made by each HTTP request",
+    ["dependency", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+# Labelled children, cached because looking them up through `labels` takes a lock every time
+_children: dict[tuple, prometheus_client.Histogram] = {}
+
+
+def _child(histogram: prometheus_client.Histogram, *labels: str) -> prometheus_client.Histogram:
+    child = _children.get((histogram, labels))
+    if child is None:
+        child = _children[(histogram, labels)] = histogram.labels(*labels)
+    return child
+
+
+# Route label for work that isn't part of a request, such as the write-behind flush
+BACKGROUND = "background"
+DEPENDENCIES = ("storage", "gateway")
+
+
+class RequestMetrics:
+    """
+    Dependency calls made on behalf of one request. Threads and tasks started by the request inherit
+    it through the context, so calls they make are attributed to the request too.
+    """
+
+    __slots__ = ("scope", "calls", "seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.calls = dict.fromkeys(DEPENDENCIES, 0)
+        self.seconds = dict.fromkeys(DEPENDENCIES, 0.0)
+
+    @property
+    def route(self) -> str:
+        # The router adds the matched route to the scope; label by its template to bound cardinality
+        route = self.scope.get("route")
+        return route.path if route is not None else "unmatched"
+
+    def server_timing(self) -> bytes:
+        timings = [
+            f"{dependency};dur={self.seconds[dependency] * 1000:.2f}"
+            f';desc="{self.calls[dependency]} calls"'
+            for dependency in DEPENDENCIES
+        ]
+        return ", ".join(timings).encode()
+
+
+current_request: contextvars.ContextVar[RequestMetrics | None] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def record_dependency_call(dependency: str, operation: str, seconds: float) -> None:
+    request = current_request.get()
+    if request is None:
+        route = BACKGROUND
+    else:
+        route = request.route
+        request.calls[dependency] += 1
+        request.seconds[dependency] += seconds
+    _child(DEPENDENCY_LATENCY, dependency, operation, route).observe(seconds)
+
+
+class InstrumentedStorage:
+    """
+    Proxy for a storage backend that times every method call. Wrapped methods are cached on the
+    proxy, so after the first call a method costs one extra function call and two clock reads.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._backend, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                record_dependency_call("storage", name, time.perf_counter() - start)
+
+        setattr(self, name, timed)
+        return timed
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency of each HTTP request by route template and status code,
+    along with the time and number of calls it spent on storage and the gateway. The same breakdown is
+    returned to the client in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = RequestMetrics(scope)
+        token = current_request.set(request)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", request.server_timing()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            route = request.route
+            _child(REQUEST_LATENCY, scope["method"], route, str(status)).observe(
+                time.perf_counter() - start
+            )
+            for dependency in DEPENDENCIES:
+                _child(REQUEST_DEPENDENCY_TIME, dependency, route).observe(
+                    request.seconds[dependency]
+                )
+                _child(REQUEST_DEPENDENCY_CALLS, dependency, route).observe(
+                    request.calls[dependency]
+                )
+
+
+def prepare_multiprocess(directory: str | None) -> str:
+    """
+    Set up the directory through which several worker processes share their metrics, emptied of
+    any left by an earlier run, or a new temporary directory. It must be called before the workers
+    start, since prometheus_client decides where to keep values when it is imported.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="paperhands-metrics-")
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    return directory
+
+
+def mark_process_dead() -> None:
+    """
+    Drop this worker's live gauges from the shared metrics once it shuts down.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render() -> tuple[bytes, str]:
+    """
+    The current metrics in the Prometheus text format, with their content type. With several worker
+    processes, these are the metrics of every worker combined, whichever worker serves the scrape.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -36,6 +36,51 @@ class Order(pydantic.BaseModel):
     limit_price: float = None
     created_at: str = pydantic.Field(default_factory=lambda: str(datetime.datetime.utcnow()))
     id: str = pydantic.Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "OPEN"
+    filled_price: float = None
+    filled_at: str = None
+    conid: int = None
+
+class OrderRequest(pydantic.BaseModel):
+    symbol: str
+    quantity: float
+    side: str
+    order_type: str
+    limit_price: float = None
+
+    @pydantic.validator("quantity")
+    def quantity_must_be_positive(cls, quantity):
+        if quantity <= 0:
+            raise ValueError("quantity must be positive")
+        return quantity
+
+    @pydantic.validator("side")
+    def side_must_be_known(cls, side):
+        if side not in ("BUY", "SELL"):
+            raise ValueError("side must be BUY or SELL")
+        return side
+
+    @pydantic.validator("order_type")
+    def order_type_must_be_known(cls, order_type):
+        if order_type not in ("MKT", "LMT"):
+            raise ValueError("order_type must be MKT or LMT")
+        return order_type
+
+    @pydantic.validator("limit_price", always=True)
+    def limit_orders_need_a_price(cls, limit_price, values):
+        if values.get("order_type") == "LMT" and limit_price is None:
+            raise ValueError("limit_price is required for LMT orders")
+        return limit_price
+
+class BatchOrderResult(pydantic.BaseModel):
+    index: int
+    accepted: bool
+    order: Order | None = None
+    error: str | None = None
+
+class OrderPage(pydantic.BaseModel):
+    orders: list[Order]
+    next_cursor: str | None = None
 
 class Portfolio(pydantic.BaseModel):
     name: str
@@ -46,6 +91,27 @@ class Portfolio(pydantic.BaseModel):
     orders: list[Order] = []
 
 
+class EquityPoint(pydantic.BaseModel):
+    t: int
+    value: float
+    pnl: float
+    low: float
+    high: float
+
+
+class PortfolioDeletion(pydantic.BaseModel):
+    portfolio_id: str
+    owner_id: str
+    status: str = "PENDING"
+    deleted_orders: int = 0
+    created_at: str = pydantic.Field(default_factory=lambda: str(datetime.datetime.utcnow()))
+    updated_at: str = pydantic.Field(default_factory=lambda: str(datetime.datetime.utcnow()))
+    error: str = None
+    # The worker running the job, and until when in epoch seconds
+    claimed_by: str = None
+    claimed_until: float = 0
+
+
 class User(pydantic.BaseModel):
     username: str
     email: str
@@ -56,3 +122,5 @@ class User(pydantic.BaseModel):
 
 class UserInDB(User):
     hashed_password: str
+    token_version: int = 0
+    portfolios_version: int = 0
@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import cProfile
+import datetime
+import functools
+import hmac
+import logging
+import os
+import random
+import re
+import uuid
+import fastapi
+from fastapi.dependencies.utils import (
+    is_async_gen_callable,
+    is_coroutine_callable,
+    is_gen_callable,
+)
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+current_profile: contextvars.ContextVar[cProfile.Profile | None] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class _ProfiledCoroutine:
+    """
+    Drive a coroutine with the profiler enabled only while the coroutine itself is running, so work
+    done by other tasks while it is suspended doesn't end up in its profile.
+    """
+
+    def __init__(self, profile: cProfile.Profile, coroutine):
+        self.profile = profile
+        self.coroutine = coroutine
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                if error is not None:
+                    yielded = self.coroutine.throw(error)
+                else:
+                    yielded = self.coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as exc:
+                value, error = None, exc
+
+
+def _profiled(call):
+    """
+    Wrap an endpoint or dependency so that it is profiled when its request is being profiled.
+    """
+    # Classify callables the way FastAPI does, so it still awaits exactly the calls it did before
+    if is_coroutine_callable(call):
+
+        @functools.wraps(call)
+        async def profiled_coroutine(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return await call(*args, **kwargs)
+            return await _ProfiledCoroutine(profile, call(*args, **kwargs))
+
+        return profiled_coroutine
+
+    @functools.wraps(call)
+    def profiled_function(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        # Sync endpoints and dependencies run in the thread pool, so enable it in whichever thread
+        profile.enable()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    return profiled_function
+
+
+def instrument_routes(app: fastapi.FastAPI) -> None:
+    """
+    Wrap the endpoint and every dependency of each HTTP route for profiling. Call this once, after all
+    routes have been added.
+    """
+    wrappers = {}
+
+    def instrument(dependant) -> None:
+        call = dependant.call
+        if call is not None and not (is_gen_callable(call) or is_async_gen_callable(call)):
+            if call not in wrappers:
+                wrappers[call] = _profiled(call)
+            dependant.call = wrappers[call]
+        for sub_dependant in dependant.dependencies:
+            instrument(sub_dependant)
+
+    for route in app.routes:
+        if isinstance(route, fastapi.routing.APIRoute):
+            instrument(route.dependant)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles the endpoint and dependencies of selected requests with cProfile and
+    writes each profile to `directory` as a .prof file, which snakeviz, tuna or flameprof render as a
+    flame graph. A request is profiled when its X-Profile header matches `token`, or at random with
+    probability `sample_rate`. The file name is returned in the X-Profile-File response header.
+    """
+
+    def __init__(self, app, directory: str, token: str | None, sample_rate: float):
+        self.app = app
+        self.directory = directory
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        os.makedirs(directory, exist_ok=True)
+
+    def _selected(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = cProfile.Profile()
+        timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        filename = f"{timestamp}-{scope['method']}-{path}-{uuid.uuid4().hex[:8]}.prof"
+
+        async def send_with_filename(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-file", filename.encode()),
+                ]
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_filename)
+        finally:
+            current_profile.reset(token)
+            try:
+                await asyncio.to_thread(
+                    profile.dump_stats, os.path.join(self.directory, filename)
+                )
+            except OSError:
+                logger.exception("Failed to write profile %s", filename)
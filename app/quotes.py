@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from app import config
+from app.gateway import GatewayClient, gateway
+
+
+class SnapshotCache:
+    """
+    Process-wide cache of market snapshots keyed by conid.
+
+    Snapshots are served from memory for `ttl` seconds. Concurrent misses for the same conid share a
+    single in-flight upstream request, and conids missed by different callers within `batch_window`
+    seconds are batched into one /snapshot call of at most `max_batch` conids.
+    """
+
+    def __init__(
+        self,
+        gateway: GatewayClient,
+        ttl: float,
+        batch_window: float,
+        max_batch: int,
+    ):
+        self.gateway = gateway
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._quotes: dict[int, tuple[float, dict]] = {}
+        self._in_flight: dict[int, asyncio.Future] = {}
+        self._pending: list[int] = []
+        self._flush_task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.upstream_requests = 0
+
+    async def get(self, conids: list[int]) -> list[dict]:
+        """
+        Get snapshots for a list of conids. Conids the gateway has no snapshot for are left out.
+        """
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        snapshots = []
+        waiting = []
+        for conid in dict.fromkeys(conids):
+            cached = self._quotes.get(conid)
+            if cached is not None and now - cached[0] < self.ttl:
+                self.hits += 1
+                snapshots.append(cached[1])
+                continue
+            self.misses += 1
+            future = self._in_flight.get(conid)
+            if future is None:
+                future = loop.create_future()
+                self._in_flight[conid] = future
+                self._pending.append(conid)
+            waiting.append(future)
+        if self._pending and self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        if waiting:
+            # Shield the shared futures so one cancelled caller doesn't fail the others
+            results = await asyncio.gather(*(asyncio.shield(f) for f in waiting))
+            snapshots.extend(snapshot for snapshot in results if snapshot is not None)
+        return snapshots
+
+    async def _flush(self) -> None:
+        if self.batch_window:
+            await asyncio.sleep(self.batch_window)
+        else:
+            await asyncio.sleep(0)
+        conids, self._pending = self._pending, []
+        self._flush_task = None
+        batches = [
+            conids[i : i + self.max_batch] for i in range(0, len(conids), self.max_batch)
+        ]
+        await asyncio.gather(*(self._fetch(batch) for batch in batches))
+
+    async def _fetch(self, conids: list[int]) -> None:
+        self.upstream_requests += 1
+        try:
+            snapshots = await self.gateway.snapshot(conids)
+        except Exception as e:
+            for conid in conids:
+                future = self._in_flight.pop(conid)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        now = time.monotonic()
+        by_conid = {}
+        for snapshot in snapshots:
+            by_conid[snapshot["conid"]] = snapshot
+            self._quotes[snapshot["conid"]] = (now, snapshot)
+        for conid in conids:
+            future = self._in_flight.pop(conid)
+            if not future.done():
+                future.set_result(by_conid.get(conid))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "upstream_requests": self.upstream_requests,
+            "size": len(self._quotes),
+        }
+
+
+snapshot_cache = SnapshotCache(
+    gateway=gateway,
+    ttl=config.QUOTE_CACHE_TTL_SECONDS,
+    batch_window=config.QUOTE_BATCH_WINDOW_SECONDS,
+    max_batch=config.QUOTE_BATCH_MAX_CONIDS,
+)
@@ -1,21 +1,38 @@
+import asyncio
+import base64
 import datetime
+import json
+import time
 import fastapi
-import dotenv
-import os
-import requests
-import google.cloud.firestore as firestore
+import httpx
+import pydantic
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
-from app import models
+from app import config, models, storage, valuation
+from app.cache import user_cache
+from app.deletion import portfolio_deleter
+from app.equity import equity_curves
+from app.hashing import PasswordHashingBusy, password_hasher
+from app.hmds import HistoricalDataNotFound, hmds_store
+from app.matching import matching_engine, matching_service
+from app.quotes import snapshot_cache
+from app.streaming import PortfolioStream, quote_hub
+from app.symbols import SymbolInfo, symbol_directory, symbol_index, symbols_snapshot
+from app.tokens import (
+    UserVersions,
+    access_token_claims,
+    token_versions,
+    user_from_claims,
+    versions_from_claims,
+)
+from app.writebehind import portfolio_writes
 
-dotenv.load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+SECRET_KEY = config.SECRET_KEY
+ALGORITHM = config.ALGORITHM
+ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 user_router = fastapi.APIRouter(tags=["user"])
@@ -23,48 +40,71 @@ portfolio_router = fastapi.APIRouter(tags=["portfolio"])
 orders_router = fastapi.APIRouter(tags=["order"])
 symbols_router = fastapi.APIRouter(tags=["symbol"])
 
-firestore_client = firestore.Client()
-
-orders_collection = firestore_client.collection("orders")
-users_collection = firestore_client.collection("users")
-portfolios_collection = firestore_client.collection("portfolios")
-password_reset_requests_collection = firestore_client.collection(
-    "password_reset_requests"
-)
-symbols_collection = firestore_client.collection("symbols")
-hmds_collection = firestore_client.collection("hmds")
-
-# cpapi_client = session.GatewaySession()
-
 
 def send_password_reset_email(email_to: str, username: str, token: str):
     # TODO Implement this
     pass
 
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+def get_user(db: storage.Storage, username: str):
+    user = db.get_user_by_username(username)
+    if user:
+        return models.UserInDB(**user)
 
 
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
+def load_user(db: storage.Storage, username: str) -> models.UserInDB | None:
+    """
+    Get a user from the user cache, or from the database on a miss.
+    """
+    user = user_cache.get(username)
+    if user is None:
+        user = get_user(db, username)
+        if user is not None:
+            user_cache.set(user)
+    return user
 
 
-def get_user(users: firestore.CollectionReference, username: str):
-    user = users.where("username", "==", username).get()
-    if user:
-        return models.UserInDB(**user[0].to_dict())
+def set_user_portfolios(db: storage.Storage, user: dict, portfolios: list[dict]) -> None:
+    """
+    Replace a user's list of portfolios. Its version is bumped and a revocation recorded so that
+    tokens listing the old portfolios are no longer trusted for ownership checks by any worker.
+    """
+    portfolios_version = user.get("portfolios_version", 0) + 1
+    db.update_user(
+        user["id"], {"portfolios": portfolios, "portfolios_version": portfolios_version}
+    )
+    token_versions.revoke(
+        db,
+        user["id"],
+        user["username"],
+        UserVersions.of({**user, "portfolios_version": portfolios_version}),
+    )
 
 
-def authenticate_user(db, username: str, password: str) -> models.UserInDB | None:
-    user = get_user(db, username)
+async def authenticate_user(
+    db: storage.Storage, username: str, password: str
+) -> models.UserInDB | None:
+    user = await asyncio.to_thread(get_user, db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
 
+async def hash_password(password: str) -> str:
+    """
+    Hash a password in the password hashing pool. If the pool is saturated, then raise an exception.
+    """
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHashingBusy:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many requests, try again later",
+        )
+
+
 def create_access_token(
     data: dict, expires_delta: datetime.timedelta | None = None
 ) -> str:
@@ -80,9 +120,14 @@ def create_access_token(
 
 async def get_current_user(
     token: str = fastapi.Depends(oauth2_scheme),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ) -> models.UserInDB | None:
     """
-    Get the current user from the database. If the user is not found in the database, or if the user is disabled,
+    Get the user an access token was issued to. If the token is invalid or expired, if the user is not
+    found in the database, or if the token has been revoked since it was issued, then raise an
+    exception. Tokens whose claims match the latest versions of their user are trusted without
+    reading the user at all; otherwise the user is served from the in-process user cache when
+    possible.
     """
     credentials_exception = fastapi.HTTPException(
         status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
@@ -97,9 +142,22 @@ async def get_current_user(
         token_data = models.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(users_collection, username=token_data.username)
+    claimed = versions_from_claims(payload)
+    if claimed is not None and config.AUTH_STATELESS_TOKENS:
+        current = token_versions.get(payload["uid"])
+        if current == claimed:
+            return user_from_claims(payload)
+        if current is not None and current.token_version != claimed.token_version:
+            raise credentials_exception
+    # The claims are out of date, or the user hasn't been seen recently
+    user = await asyncio.to_thread(load_user, db, token_data.username)
     if user is None:
         raise credentials_exception
+    token_versions.set(user.id, UserVersions.of(user))
+    # Tokens issued without claims are revoked by the first password reset too
+    token_version = claimed.token_version if claimed is not None else 0
+    if token_version != user.token_version:
+        raise credentials_exception
     return user
 
 
@@ -118,12 +176,19 @@ async def get_current_active_user(
 @user_router.post("/token", response_model=models.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = fastapi.Depends(),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
     Get an access token for a user. If the user is not found in the database, or if the user is disabled,
     then raise an exception.
     """
-    user = authenticate_user(users_collection, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHashingBusy:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many requests, try again later",
+        )
     if not user:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
@@ -134,8 +199,9 @@ async def login_for_access_token(
     access_token_expires_timestamp = (
         datetime.datetime.utcnow() + access_token_expires
     ).timestamp()
+    token_versions.set(user.id, UserVersions.of(user))
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=access_token_claims(user), expires_delta=access_token_expires
     )
     return {
         "access_token": access_token,
@@ -146,17 +212,25 @@ async def login_for_access_token(
 
 @user_router.post("/token/refresh", response_model=models.Token)
 async def refresh_access_token(
-    user: models.User = fastapi.Depends(get_current_user),
+    current_user: models.User = fastapi.Depends(get_current_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
-    Refresh the access token for a user.
+    Refresh the access token for a user. The new token carries the user's current claims.
     """
+    user = await asyncio.to_thread(load_user, db, current_user.username)
+    if user is None:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token_expires_timestamp = (
         datetime.datetime.utcnow() + access_token_expires
     ).timestamp()
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=access_token_claims(user), expires_delta=access_token_expires
     )
     return {
         "access_token": access_token,
@@ -170,24 +244,25 @@ async def create_user(
     email: str = fastapi.Form(...),
     username: str = fastapi.Form(...),
     password: str = fastapi.Form(...),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
     Create a new user in the database. If the user already exists, then raise an exception.
     """
-    user_in_db = get_user(users_collection, username)
+    user_in_db = await asyncio.to_thread(get_user, db, username)
     if user_in_db:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
             detail="Username already exists",
         )
-    hashed_password = get_password_hash(password)
+    hashed_password = await hash_password(password)
     user_in_db = models.UserInDB(
         username=username,
         email=email,
         disabled=False,
         hashed_password=hashed_password,
     )
-    users_collection.document(user_in_db.id).set(user_in_db.dict())
+    await asyncio.to_thread(db.set_user, user_in_db.dict())
 
 
 @user_router.post(
@@ -195,12 +270,13 @@ async def create_user(
 )
 async def request_password_reset(
     username: str = fastapi.Form(...),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
     Reset the password for a user. If the user is not found in the database, then raise an exception.
     """
     RESET_TOKEN_EXPIRE_MINUTES = 2 * 24 * 60
-    user = get_user(users_collection, username)
+    user = await asyncio.to_thread(get_user, db, username)
     if not user:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -212,8 +288,8 @@ async def request_password_reset(
         data={"sub": user.username}, expires_delta=reset_request_expires
     )
     # Store the reset token in the database
-    password_reset_requests_collection.document().set(
-        {"token": reset_token, "username": user.username}
+    await asyncio.to_thread(
+        db.create_password_reset_request, token=reset_token, username=user.username
     )
     # Send the email
     send_password_reset_email(
@@ -226,15 +302,14 @@ async def request_password_reset(
 async def reset_password(
     token: str = fastapi.Form(...),
     password: str = fastapi.Form(...),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
     Reset the password for a user. If the user is not found in the database, then raise an exception.
     """
     # Check if the token is valid
-    reset_requests = password_reset_requests_collection.where(
-        "token", "==", token
-    ).get()
-    if not reset_requests:
+    reset_request = await asyncio.to_thread(db.get_password_reset_request, token)
+    if not reset_request:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
             detail="Invalid token",
@@ -256,19 +331,30 @@ async def reset_password(
             detail="Token expired",
         )
     # Check if the user exists
-    user_in_db = get_user(users_collection, username)
+    user_in_db = await asyncio.to_thread(get_user, db, username)
     if not user_in_db:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
             detail="User not found",
         )
     # Update the user's password
-    hashed_password = get_password_hash(password)
-    users_collection.document(user_in_db.id).update(
-        {"hashed_password": hashed_password}
+    hashed_password = await hash_password(password)
+    # Revoke every access token issued with the old password
+    token_version = user_in_db.token_version + 1
+    await asyncio.to_thread(
+        db.update_user,
+        user_in_db.id,
+        {"hashed_password": hashed_password, "token_version": token_version},
+    )
+    await asyncio.to_thread(
+        token_versions.revoke,
+        db,
+        user_in_db.id,
+        user_in_db.username,
+        UserVersions(token_version, user_in_db.portfolios_version, user_in_db.disabled),
     )
     # Remove the token from the database
-    password_reset_requests_collection.document(reset_requests[0].id).delete()
+    await asyncio.to_thread(db.delete_password_reset_request, reset_request["id"])
     return fastapi.Response(status_code=fastapi.status.HTTP_202_ACCEPTED)
 
 
@@ -284,61 +370,151 @@ async def read_users_me(
 
 
 async def get_user_portfolio(
-    id: str, user: models.User = fastapi.Depends(get_current_active_user)
+    id: str,
+    user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ) -> models.Portfolio:
     """
     Get the current user's portfolio from the database. If the user is not found in the database, or if the user is disabled,
     then raise an exception.
     """
-    portfolio = portfolios_collection.document(id).get()
-    if portfolio is None:
+    portfolio = await asyncio.to_thread(db.get_portfolio, id)
+    if portfolio is None or portfolio.get("deleted"):
         raise fastapi.HTTPException(status_code=404, detail="Portfolio not found")
+    portfolio_writes.overlay(portfolio)
+    # Portfolios written before orders moved to the orders store may still embed every order
+    portfolio["orders"] = portfolio["orders"][-config.PORTFOLIO_RECENT_ORDERS :]
     # Check if the user is the owner of the portfolio
     if portfolio.get("owner_id") != user.id:
         raise fastapi.HTTPException(
             status_code=403, detail="You don't have access to this portfolio"
         )
-    return portfolio.to_dict()
+    return portfolio
+
+
+def portfolio_response(portfolio: dict) -> ORJSONResponse:
+    """
+    Serialise a portfolio with orjson, without validating it against models.Portfolio again. Positions
+    are only ever written by the matching engine and the valuation, so they are passed through as they
+    are; the few recent orders may predate fields added to models.Order, so they still go through it.
+    """
+    return ORJSONResponse(
+        {
+            "name": portfolio["name"],
+            "owner_id": portfolio["owner_id"],
+            "id": portfolio["id"],
+            "is_public": portfolio.get("is_public", False),
+            "positions": portfolio["positions"],
+            "orders": [models.Order(**order).dict() for order in portfolio["orders"]],
+        }
+    )
 
 
 @portfolio_router.get("/portfolio", response_model=models.Portfolio)
-def get_portfolio(portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio)):
+async def get_portfolio(
+    portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Get a portfolio with its positions valued at the latest market prices. The response model only
+    documents the response; see `portfolio_response`.
+    """
     non_zero_quantity_positions = [
         position for position in portfolio["positions"] if position["quantity"] != 0
     ]
     position_conids = [position["conid"] for position in non_zero_quantity_positions]
     if not position_conids:
-        return portfolio
+        return portfolio_response(portfolio)
     # Only snapshots where quantity is not 0
-    position_conids_string = ",".join(str(conid) for conid in position_conids)
-    snapshots_response = requests.get(
-        f"{os.getenv('CPAPI_BASE_URL')}/snapshot",
-        params={"conids": position_conids_string},
-        verify=False,
-    )
-    snapshots = snapshots_response.json()
+    try:
+        snapshots = await snapshot_cache.get(position_conids)
+    except httpx.HTTPError:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_502_BAD_GATEWAY,
+            detail="Market data unavailable",
+        )
     if not snapshots:
-        return portfolio
-    # Get the corresponding snapshot for each position
-    for position in portfolio["positions"]:
-        for snapshot in snapshots:
-            if not position["conid"] == snapshot["conid"]:
-                continue
-            side = position["side"]
-            value = position["value"]
-            if side == "BUY":
-                current_value = snapshot["ask_price"] * position["quantity"]
-                position["pnl"] = current_value - value
-            elif side == "SELL":
-                current_value = snapshot["bid_price"] * position["quantity"]
-                position["pnl"] = abs(value) - current_value
-            else:
-                continue
-    # Update the portfolio in the database
-    portfolios_collection.document(portfolio["id"]).update(
-        {"positions": portfolio["positions"]}
+        return portfolio_response(portfolio)
+    # Value every position against its snapshot
+    portfolio_valuation = valuation.apply_pnl(portfolio["positions"], snapshots)
+    # Update the portfolio in the database, but only the PnL of positions where it has changed
+    if portfolio_valuation.changed.any():
+        changed_pnl = {
+            position["id"]: position["pnl"]
+            for position, changed in zip(
+                portfolio["positions"], portfolio_valuation.changed.tolist()
+            )
+            if changed
+        }
+        portfolio_writes.update(portfolio["id"], changed_pnl)
+    equity_curves.record(
+        portfolio["id"], portfolio_valuation.total_value, portfolio_valuation.total_pnl
     )
-    return portfolio
+    return portfolio_response(portfolio)
+
+
+@portfolio_router.get("/portfolio/history", response_model=list[models.EquityPoint])
+def get_portfolio_history(
+    from_: int = fastapi.Query(0, alias="from"),
+    to: int | None = None,
+    points: int = fastapi.Query(500, ge=1, le=config.EQUITY_HISTORY_MAX_POINTS),
+    portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Get the total value and PnL of a portfolio over time, between `from` and `to` in epoch
+    milliseconds. The range is split into at most `points` equal buckets, each represented by its
+    last point along with the lowest and highest value within it.
+    """
+    if to is None:
+        to = int(time.time() * 1000)
+    history = equity_curves.history(db, portfolio["id"], from_, to, points)
+    return ORJSONResponse(history)
+
+
+@portfolio_router.websocket("/portfolio/stream")
+async def stream_portfolio(
+    websocket: fastapi.WebSocket,
+    id: str,
+    token: str | None = None,
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Stream live position values and PnL for a portfolio. The access token is passed either as a
+    Bearer Authorization header or, for browsers, as the token query parameter.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if token is None and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer ") :]
+
+    async def authenticate() -> models.User | None:
+        try:
+            user = await get_current_user(token=token or "", db=db)
+        except fastapi.HTTPException:
+            return None
+        return None if user.disabled else user
+
+    async def authorize() -> bool:
+        # The token is checked again while streaming, since it may expire or be revoked meanwhile
+        return await authenticate() is not None
+
+    user = await authenticate()
+    if user is None:
+        await websocket.close(code=fastapi.status.WS_1008_POLICY_VIOLATION)
+        return
+    portfolio = await asyncio.to_thread(db.get_portfolio, id)
+    if portfolio is None or portfolio.get("deleted") or portfolio.get("owner_id") != user.id:
+        await websocket.close(code=fastapi.status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    stream = PortfolioStream(
+        websocket,
+        id,
+        quote_hub,
+        refresh_interval=config.STREAM_PORTFOLIO_REFRESH_SECONDS,
+        authorize=authorize,
+    )
+    await stream.run(db)
 
 
 @portfolio_router.post("/portfolio", response_model=models.Portfolio)
@@ -346,18 +522,21 @@ def create_portfolio(
     portfolio_name: str = fastapi.Form(...),
     is_public: bool = fastapi.Form(False),
     user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     portfolio = models.Portfolio(
         name=portfolio_name, owner_id=user.id, is_public=is_public
     )
-    portfolios_collection.document(portfolio.id).set(portfolio.dict())
-    user.portfolios.append(
+    db.set_portfolio(portfolio.dict())
+    # Read the user again, since the portfolios in its token may be out of date
+    user_in_db = db.get_user(user.id)
+    user_portfolios = user_in_db["portfolios"] + [
         {
             "id": portfolio.id,
             "name": portfolio.name,
         }
-    )
-    users_collection.document(user.id).update({"portfolios": user.portfolios})
+    ]
+    set_user_portfolios(db, user_in_db, user_portfolios)
     return portfolio
 
 
@@ -366,6 +545,7 @@ def update_portfolio(
     portfolio_name: str = fastapi.Form(...),
     is_public: bool = fastapi.Form(False),
     portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     portfolio_id = portfolio["id"]
     updated_portfolio = models.Portfolio(
@@ -376,51 +556,83 @@ def update_portfolio(
         positions=portfolio["positions"],
         orders=portfolio["orders"],
     )
-    portfolios_collection.document(portfolio_id).update(updated_portfolio.dict())
-    user = users_collection.document(portfolio["owner_id"]).get()
-    user_portfolios = user.to_dict()["portfolios"]
+    db.update_portfolio(portfolio_id, {"name": portfolio_name, "is_public": is_public})
+    user = db.get_user(portfolio["owner_id"])
+    user_portfolios = user["portfolios"]
     user_portfolios = [
         portfolio
         if portfolio["id"] != portfolio_id
         else {"id": portfolio_id, "name": portfolio_name}
         for portfolio in user_portfolios
     ]
-    users_collection.document(portfolio["owner_id"]).update(
-        {"portfolios": user_portfolios}
-    )
+    set_user_portfolios(db, user, user_portfolios)
     return updated_portfolio
 
 
 @portfolio_router.delete("/portfolio")
-def delete_portfolio(portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio)):
+async def delete_portfolio(
+    portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
     """
-    Delete a portfolio. If the portfolio is not found, then raise an exception.
+    Delete a portfolio. If the portfolio is not found, then raise an exception. The portfolio is hidden
+    straight away and its orders are removed in the background; use GET /portfolio/deletion to follow
+    the progress.
     """
     portfolio_id = portfolio["id"]
-    portfolios_collection.document(portfolio_id).delete()
-    portfolio_orders = orders_collection.where("portfolio_id", "==", portfolio_id).get()
-    for order in portfolio_orders:
-        orders_collection.document(order.id).delete()
-    user = users_collection.document(portfolio["owner_id"]).get()
-    user_portfolios = user.to_dict()["portfolios"]
-    user_portfolios = [
-        portfolio for portfolio in user_portfolios if portfolio["id"] != portfolio_id
-    ]
-    users_collection.document(portfolio["owner_id"]).update(
-        {"portfolios": user_portfolios}
-    )
+    portfolio_writes.discard(portfolio_id)
+    equity_curves.discard(portfolio_id)
+    await asyncio.to_thread(db.update_portfolio, portfolio_id, {"deleted": True})
+    await portfolio_deleter.schedule(db, portfolio)
+
+    def remove_from_owner() -> None:
+        user = db.get_user(portfolio["owner_id"])
+        user_portfolios = [
+            user_portfolio
+            for user_portfolio in user["portfolios"]
+            if user_portfolio["id"] != portfolio_id
+        ]
+        set_user_portfolios(db, user, user_portfolios)
+
+    await asyncio.to_thread(remove_from_owner)
     return fastapi.Response(status_code=204)
 
 
+@portfolio_router.get(
+    "/portfolio/deletion",
+    response_model=models.PortfolioDeletion,
+    response_model_exclude={"claimed_by", "claimed_until"},
+)
+def get_portfolio_deletion(
+    id: str,
+    user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Get the progress of a portfolio deletion.
+    """
+    job = db.get_deletion_job(id)
+    if job is None:
+        raise fastapi.HTTPException(status_code=404, detail="Portfolio deletion not found")
+    if job["owner_id"] != user.id:
+        raise fastapi.HTTPException(
+            status_code=403, detail="You don't have access to this portfolio"
+        )
+    return job
+
+
 @orders_router.get("/order", response_model=models.Order)
-def get_order(id: str, user: models.User = fastapi.Depends(get_current_active_user)):
+def get_order(
+    id: str,
+    user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
     """
     Retrieve details about a specific order. If the order is not found, then raise an exception.
     """
-    order = orders_collection.document(id).get()
-    if not order.exists:
+    order_data = db.get_order(id)
+    if order_data is None:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND)
-    order_data = order.to_dict()
     user_portfolio_ids = [p.get("id") for p in user.portfolios]
     order_portfolio_id = order_data.get("portfolio_id")
     if order_portfolio_id in user_portfolio_ids:
@@ -428,6 +640,104 @@ def get_order(id: str, user: models.User = fastapi.Depends(get_current_active_us
     raise fastapi.HTTPException(status_code=fastapi.status.HTTP_403_FORBIDDEN)
 
 
+def encode_order_cursor(order: dict) -> str:
+    cursor = json.dumps([order["created_at"], order["id"]]).encode()
+    return base64.urlsafe_b64encode(cursor).decode()
+
+
+def decode_order_cursor(cursor: str) -> tuple[str, str]:
+    invalid_cursor = fastapi.HTTPException(
+        status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+    )
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise invalid_cursor
+    # Cursors are [created_at, id]; anything else was not issued by encode_order_cursor
+    if (
+        not isinstance(decoded, list)
+        or len(decoded) != 2
+        or not all(isinstance(part, str) for part in decoded)
+    ):
+        raise invalid_cursor
+    created_at, order_id = decoded
+    return created_at, order_id
+
+
+@orders_router.get("/orders", response_model=models.OrderPage)
+def list_orders(
+    portfolio_id: str,
+    symbol: str | None = None,
+    side: str | None = None,
+    since: datetime.datetime | None = None,
+    cursor: str | None = None,
+    limit: int = fastapi.Query(50, ge=1, le=200),
+    user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    List the orders of a portfolio, newest first. Pass the returned next_cursor to get the next page.
+    """
+    user_portfolio_ids = [p.get("id") for p in user.portfolios]
+    if portfolio_id not in user_portfolio_ids:
+        raise fastapi.HTTPException(status_code=fastapi.status.HTTP_403_FORBIDDEN)
+    if since is not None and since.tzinfo is not None:
+        # Orders are timestamped in naive UTC
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    orders = db.list_orders(
+        portfolio_id,
+        limit=limit + 1,
+        symbol=symbol,
+        side=side,
+        since=str(since) if since is not None else None,
+        after=decode_order_cursor(cursor) if cursor else None,
+    )
+    next_cursor = encode_order_cursor(orders[limit - 1]) if len(orders) > limit else None
+    return {"orders": orders[:limit], "next_cursor": next_cursor}
+
+
+def merge_recent_orders(*order_lists: list[dict]) -> list[dict]:
+    """
+    Merge lists of orders by id, later lists winning, and keep the most recent
+    PORTFOLIO_RECENT_ORDERS of them, oldest first.
+    """
+    orders = {order["id"]: order for order_list in order_lists for order in order_list}
+    recent = sorted(orders.values(), key=lambda order: (order["created_at"], order["id"]))
+    return recent[-config.PORTFOLIO_RECENT_ORDERS :]
+
+
+def add_recent_orders(db: storage.Storage, portfolio_id: str, orders: list[dict]) -> None:
+    """
+    Add new orders to the summary of recent orders kept in the portfolio document. The summary is
+    changed in place in storage, so orders added or filled concurrently aren't lost.
+    """
+    db.modify_portfolio(
+        portfolio_id,
+        lambda portfolio: {"orders": merge_recent_orders(portfolio["orders"], orders)},
+    )
+
+
+def resolve_symbol(db: storage.Storage, symbol: str) -> SymbolInfo | None:
+    """
+    Resolve a ticker to its symbol details from the in-memory symbol directory.
+    """
+    symbols_snapshot.get(db)
+    return symbol_directory.resolve(symbol)
+
+
+def new_order(
+    order_request: models.OrderRequest, symbol_info: SymbolInfo, portfolio_id: str
+) -> models.Order:
+    """
+    An order for a portfolio from a validated request, under the symbol's canonical name.
+    """
+    return models.Order(
+        **{**order_request.dict(), "symbol": symbol_info.symbol},
+        conid=symbol_info.conid,
+        portfolio_id=portfolio_id,
+    )
+
+
 @orders_router.post("/order", response_model=models.Order)
 def create_order(
     symbol: str = fastapi.Form(...),
@@ -436,71 +746,199 @@ def create_order(
     order_type: str = fastapi.Form(...),
     limit_price: float = fastapi.Form(None),
     portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     portfolio_id = portfolio["id"]
-    order = models.Order(
-        symbol=symbol,
-        quantity=quantity,
-        side=side,
-        order_type=order_type,
-        limit_price=limit_price,
-        portfolio_id=portfolio_id,
-    )
+    try:
+        order_request = models.OrderRequest(
+            symbol=symbol,
+            quantity=quantity,
+            side=side,
+            order_type=order_type,
+            limit_price=limit_price,
+        )
+    except pydantic.ValidationError as e:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors()
+        )
+    symbol_info = resolve_symbol(db, order_request.symbol)
+    if symbol_info is None:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown symbol {order_request.symbol}",
+        )
+    order = new_order(order_request, symbol_info, portfolio_id)
     order_data = order.dict()
-    orders_collection.document(order.id).set(order_data)
-    portfolio["orders"] = portfolio["orders"] + [order_data]
-    portfolios_collection.document(portfolio_id).update(portfolio)
+    db.set_order(order_data)
+    matching_service.submit(order_data)
+    # The portfolio only keeps a summary of its most recent orders
+    add_recent_orders(db, portfolio_id, [order_data])
     return order
 
 
+@orders_router.post("/orders/batch", response_model=list[models.BatchOrderResult])
+def create_orders_batch(
+    orders: list[dict] = fastapi.Body(...),
+    portfolio: models.Portfolio = fastapi.Depends(get_user_portfolio),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Create several orders for a portfolio at once. Every order is validated, and the valid ones are
+    stored together in a single atomic write. The result for each order says whether it was accepted
+    and, if not, why.
+    """
+    if len(orders) > config.ORDER_BATCH_MAX:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {config.ORDER_BATCH_MAX} orders can be submitted at once",
+        )
+    portfolio_id = portfolio["id"]
+    results = []
+    accepted_orders = []
+    for index, order_details in enumerate(orders):
+        try:
+            order_request = models.OrderRequest.parse_obj(order_details)
+        except pydantic.ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}"
+                for err in e.errors()
+            )
+            results.append({"index": index, "accepted": False, "error": error})
+            continue
+        symbol_info = resolve_symbol(db, order_request.symbol)
+        if symbol_info is None:
+            results.append(
+                {"index": index, "accepted": False, "error": "symbol: unknown symbol"}
+            )
+            continue
+        order = new_order(order_request, symbol_info, portfolio_id)
+        accepted_orders.append(order.dict())
+        results.append({"index": index, "accepted": True, "order": order})
+    if accepted_orders:
+        db.set_orders(accepted_orders)
+        for order_data in accepted_orders:
+            matching_service.submit(order_data)
+        add_recent_orders(db, portfolio_id, accepted_orders)
+    return results
+
+
 @orders_router.delete("/order")
 def cancel_order(
     id: str,
     user: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
-    order = orders_collection.document(id).get()
-    if order is None:
+    order_data = db.get_order(id)
+    if order_data is None:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND)
     user_portfolio_ids = [p.get("id") for p in user.portfolios]
-    order_data = order.to_dict()
     order_portfolio_id = order_data.get("portfolio_id")
     if order_portfolio_id not in user_portfolio_ids:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_403_FORBIDDEN)
-    orders_collection.document(id).delete()
-    portfolio = portfolios_collection.document(order_portfolio_id).get().to_dict()
-    portfolio["orders"] = [o for o in portfolio["orders"] if o["id"] != id]
-    portfolios_collection.document(order_portfolio_id).update(portfolio)
+    if order_data.get("status") == "FILLED":
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            detail="Order has already been filled",
+        )
+    matching_engine.cancel(id)
+    db.delete_order(id)
+    # Refill the recent orders summary from the orders store
+    recent_orders = db.get_recent_orders(order_portfolio_id, config.PORTFOLIO_RECENT_ORDERS)
+
+    def remove_cancelled(portfolio: dict) -> dict | None:
+        if not any(order["id"] == id for order in portfolio["orders"]):
+            return None
+        orders = [order for order in portfolio["orders"] if order["id"] != id]
+        return {"orders": merge_recent_orders(recent_orders, orders)}
+
+    db.modify_portfolio(order_portfolio_id, remove_cancelled)
     return fastapi.Response(status_code=fastapi.status.HTTP_204_NO_CONTENT)
 
 
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header allows a gzip response. Codings with a q-value of 0 are not
+    acceptable, and "*" covers gzip unless gzip is listed itself.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+
 @symbols_router.get("/symbols", response_model=list[models.Symbol])
-async def get_available_symbol():
+async def get_available_symbol(
+    request: fastapi.Request,
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
+    """
+    Retrieve a list of all available symbols. The list is served from an in-memory snapshot, and
+    clients that send a matching If-None-Match header get a 304 instead of the body. The gzip and
+    identity bodies have different ETags, since they are different representations.
+    """
+    body, gzip_body, etag = symbols_snapshot.get(db)
+    gzipped = accepts_gzip(request.headers.get("accept-encoding", ""))
+    if gzipped:
+        body = gzip_body
+        etag = etag[:-1] + '-gzip"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_etags or "*" in client_etags:
+            return fastapi.Response(
+                status_code=fastapi.status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return fastapi.Response(content=body, media_type="application/json", headers=headers)
+
+
+@symbols_router.get("/symbols/search", response_model=list[models.Symbol])
+def search_symbols(
+    q: str,
+    limit: int = fastapi.Query(10, ge=1, le=100),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
+):
     """
-    Retrieve a list of all available symbols.
+    Search symbols by ticker or company name prefix, best matches first.
     """
-    all_symbols = symbols_collection.stream()
-    symbol_data = [symbol.to_dict() for symbol in all_symbols]
+    symbols_snapshot.get(db)
     return [
         models.Symbol(ticker=symbol.get("symbol"), name=symbol.get("company_name"))
-        for symbol in symbol_data
+        for symbol in symbol_index.search(q, limit)
     ]
 
 
 @symbols_router.get("/symbols/hmds")
 async def get_historical_market_data(
-    symbol: str, _: models.User = fastapi.Depends(get_current_active_user)
+    symbol: str,
+    _: models.User = fastapi.Depends(get_current_active_user),
+    db: storage.Storage = fastapi.Depends(storage.get_storage),
 ):
     """
     Get historical market data for a symbol. If the symbol is not found, then raise an exception.
     If the symbol is found in the database, then return the historical market data from the database,
     otherwise, retrieve the historical market data from the API and store it in the database.
+    Stored data that has gone stale is topped up with only the bars that are missing.
     """
     symbol_upper = symbol.upper()
-    hmds_response = requests.get(
-        f"{os.getenv('CPAPI_BASE_URL')}/hmds",
-        params={"symbol": symbol_upper},
-        verify=False,
-    )
-    if hmds_response.status_code == 200:
-        return hmds_response.json()
-    raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND)
+    try:
+        # The bars are plain JSON values, so skip the jsonable_encoder pass over every one of them
+        return ORJSONResponse(await hmds_store.get(db, symbol_upper))
+    except HistoricalDataNotFound:
+        raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND)
+    except httpx.HTTPError:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_502_BAD_GATEWAY,
+            detail="Market data unavailable",
+        )
@@ -0,0 +1,34 @@
+import functools
+import json
+
+from app import config, metrics
+from app.storage.base import Storage
+
+
+@functools.lru_cache(maxsize=None)
+def get_storage() -> Storage:
+    """
+    Get the storage backend selected by the STORAGE_BACKEND setting. The backend is created on first
+    use and shared by every request in the process, and its calls are timed when METRICS_ENABLED is
+    set.
+    """
+    backend = _create_backend()
+    if config.METRICS_ENABLED:
+        return metrics.InstrumentedStorage(backend)
+    return backend
+
+
+def _create_backend() -> Storage:
+    if config.STORAGE_BACKEND == "memory":
+        from app.storage.memory import MemoryStorage
+
+        seed = None
+        if config.STORAGE_SEED_PATH:
+            with open(config.STORAGE_SEED_PATH) as seed_file:
+                seed = json.load(seed_file)
+        return MemoryStorage(seed)
+    if config.STORAGE_BACKEND == "firestore":
+        from app.storage.firestore import FirestoreStorage
+
+        return FirestoreStorage()
+    raise ValueError(f"Unknown storage backend: {config.STORAGE_BACKEND}")
@@ -0,0 +1,264 @@
+import abc
+import typing
+
+
+class Storage(abc.ABC):
+    """
+    Interface for the persistence layer used by the routers. Documents are passed around as plain
+    dicts, the same shape that is stored in the database.
+    """
+
+    # Users
+
+    @abc.abstractmethod
+    def get_user(self, user_id: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def get_user_by_username(self, username: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def set_user(self, user: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def update_user(self, user_id: str, fields: dict) -> None:
+        ...
+
+    # Portfolios
+
+    @abc.abstractmethod
+    def get_portfolio(self, portfolio_id: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def set_portfolio(self, portfolio: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def update_portfolio(self, portfolio_id: str, fields: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def modify_portfolio(
+        self, portfolio_id: str, modify: typing.Callable[[dict], dict | None]
+    ) -> dict | None:
+        """
+        Atomically read a portfolio, pass it to `modify` and write back the fields it returns, so
+        that concurrent changes to the same portfolio aren't lost. `modify` may be called more than
+        once if the portfolio changes in the meantime, and returns None to write nothing. Returns
+        the fields written, or None if the portfolio doesn't exist.
+        """
+        ...
+
+    @abc.abstractmethod
+    def modify_portfolios(
+        self, modifications: dict[str, typing.Callable[[dict], dict | None]]
+    ) -> dict[str, dict]:
+        """
+        Like `modify_portfolio` for many portfolios at once, keyed by portfolio id, in as few
+        round trips as the backend allows. Each portfolio is modified atomically, but not the batch
+        as a whole. Returns the fields written, keyed by portfolio id.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete_portfolio(self, portfolio_id: str) -> None:
+        ...
+
+    # Orders
+
+    @abc.abstractmethod
+    def get_order(self, order_id: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def set_order(self, order: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def set_orders(self, orders: list[dict]) -> None:
+        """
+        Write several orders atomically: either all of them are stored or none are.
+        """
+        ...
+
+    @abc.abstractmethod
+    def update_orders(
+        self, updates: dict[str, dict], if_status: str | None = None
+    ) -> list[str]:
+        """
+        Apply field updates to several orders in one batched write, keyed by order id. Orders that
+        no longer exist are skipped; the ids of the orders that were updated are returned. With
+        `if_status`, only orders whose status is still `if_status` are updated, atomically, so that
+        two writers can't both move an order out of that status.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete_order(self, order_id: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def delete_orders(self, order_ids: list[str]) -> None:
+        """
+        Delete several orders in one batched write.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_open_orders(self, since: str | None = None) -> list[dict]:
+        """
+        Get every open order, or only those created at or after `since`. Orders stored without a
+        status are open.
+        """
+        ...
+
+    # Portfolio deletion jobs, keyed by portfolio id
+
+    @abc.abstractmethod
+    def get_deletion_job(self, portfolio_id: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def set_deletion_job(self, job: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def update_deletion_job(self, portfolio_id: str, fields: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def get_unfinished_deletion_jobs(self) -> list[dict]:
+        ...
+
+    @abc.abstractmethod
+    def claim_deletion_job(
+        self, portfolio_id: str, claimant: str, until: float, now: float
+    ) -> dict | None:
+        """
+        Atomically claim an unfinished deletion job for `claimant` until `until`, unless another
+        claimant holds it past `now`. Return the claimed job, or None if it was not claimed.
+        """
+        ...
+
+    # Portfolio equity curves
+
+    @abc.abstractmethod
+    def append_equity_points(self, points: dict[str, list[dict]]) -> None:
+        """
+        Append points to the equity curves of portfolios, keyed by portfolio id. Each point has a
+        timestamp "t" in epoch milliseconds, a total "value" and a "pnl".
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_equity_points(
+        self, portfolio_id: str, start: int = 0, end: int | None = None
+    ) -> list[dict]:
+        """
+        Return the points of a portfolio's equity curve from `start` to `end` inclusive, in epoch
+        milliseconds, oldest first. Without `end` the curve runs to its latest point.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete_equity_points(self, portfolio_id: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def get_portfolio_orders(self, portfolio_id: str) -> list[dict]:
+        ...
+
+    @abc.abstractmethod
+    def get_recent_orders(self, portfolio_id: str, limit: int) -> list[dict]:
+        """
+        Return the `limit` most recently created orders of a portfolio, oldest first.
+        """
+        ...
+
+    @abc.abstractmethod
+    def list_orders(
+        self,
+        portfolio_id: str,
+        limit: int,
+        symbol: str | None = None,
+        side: str | None = None,
+        since: str | None = None,
+        after: tuple[str, str] | None = None,
+    ) -> list[dict]:
+        """
+        Return up to `limit` orders of a portfolio, newest first, ordered by (created_at, id).
+        Orders can be filtered by symbol, side and a minimum created_at. `after` is the
+        (created_at, id) of the last order of the previous page.
+        """
+        ...
+
+    # Password reset requests
+
+    @abc.abstractmethod
+    def create_password_reset_request(self, token: str, username: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def get_password_reset_request(self, token: str) -> dict | None:
+        """
+        Return the reset request for a token, including its "id", or None if there is no such request.
+        """
+        ...
+
+    @abc.abstractmethod
+    def delete_password_reset_request(self, request_id: str) -> None:
+        ...
+
+    # Access token revocations, keyed by user id
+
+    @abc.abstractmethod
+    def set_token_revocation(self, user_id: str, username: str, revoked_at: float) -> None:
+        """
+        Record that the access tokens issued to a user before `revoked_at`, in epoch seconds, are
+        no longer trusted without reading the user again.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get_token_revocations(self, since: float) -> list[dict]:
+        """
+        Return the revocations recorded after `since`, each with a "user_id", "username" and
+        "revoked_at".
+        """
+        ...
+
+    # Symbols
+
+    @abc.abstractmethod
+    def get_symbols(self) -> list[dict]:
+        ...
+
+    @abc.abstractmethod
+    def set_symbol(self, symbol: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def delete_symbol(self, ticker: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def watch_symbols(self, callback) -> typing.Callable[[], None]:
+        """
+        Call `callback(upserted, removed)` whenever symbols are written, where `upserted` is a list of
+        symbol documents and `removed` a list of tickers. The callback may be called from another
+        thread. Returns a function that stops watching.
+        """
+        ...
+
+    # Historical market data
+
+    @abc.abstractmethod
+    def get_hmds(self, symbol: str) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    def set_hmds(self, symbol: str, data: dict) -> None:
+        ...
@@ -0,0 +1,386 @@
+import datetime
+import typing
+import google.api_core.exceptions
+import google.cloud.firestore as firestore
+
+from app.storage.base import Storage
+
+# Maximum number of writes in a single Firestore batch
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class FirestoreStorage(Storage):
+    """
+    Storage backed by Google Cloud Firestore.
+    """
+
+    def __init__(self, client: firestore.Client | None = None):
+        self.client = client or firestore.Client()
+        self.orders_collection = self.client.collection("orders")
+        self.users_collection = self.client.collection("users")
+        self.portfolios_collection = self.client.collection("portfolios")
+        self.password_reset_requests_collection = self.client.collection(
+            "password_reset_requests"
+        )
+        self.token_revocations_collection = self.client.collection("token_revocations")
+        self.symbols_collection = self.client.collection("symbols")
+        self.hmds_collection = self.client.collection("hmds")
+        self.deletion_jobs_collection = self.client.collection("portfolio_deletions")
+        # One document per portfolio and UTC day, holding that day's equity curve points
+        self.equity_collection = self.client.collection("equity_curves")
+
+    @staticmethod
+    def _get(collection: firestore.CollectionReference, id: str) -> dict | None:
+        document = collection.document(id).get()
+        if not document.exists:
+            return None
+        return document.to_dict()
+
+    def get_user(self, user_id: str) -> dict | None:
+        return self._get(self.users_collection, user_id)
+
+    def get_user_by_username(self, username: str) -> dict | None:
+        users = self.users_collection.where("username", "==", username).limit(1).get()
+        if users:
+            return users[0].to_dict()
+
+    def set_user(self, user: dict) -> None:
+        self.users_collection.document(user["id"]).set(user)
+
+    def update_user(self, user_id: str, fields: dict) -> None:
+        self.users_collection.document(user_id).update(fields)
+
+    def get_portfolio(self, portfolio_id: str) -> dict | None:
+        return self._get(self.portfolios_collection, portfolio_id)
+
+    def set_portfolio(self, portfolio: dict) -> None:
+        self.portfolios_collection.document(portfolio["id"]).set(portfolio)
+
+    def update_portfolio(self, portfolio_id: str, fields: dict) -> None:
+        self.portfolios_collection.document(portfolio_id).update(fields)
+
+    def _update_many(
+        self, collection: firestore.CollectionReference, updates: dict[str, dict]
+    ) -> list[str]:
+        items = list(updates.items())
+        updated = []
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            chunk = items[start : start + FIRESTORE_BATCH_LIMIT]
+            batch = self.client.batch()
+            for id, fields in chunk:
+                batch.update(collection.document(id), fields)
+            try:
+                batch.commit()
+                updated.extend(id for id, _ in chunk)
+            except google.api_core.exceptions.NotFound:
+                # A document in the batch was deleted, so fall back to updating one at a time
+                for id, fields in chunk:
+                    try:
+                        collection.document(id).update(fields)
+                        updated.append(id)
+                    except google.api_core.exceptions.NotFound:
+                        pass
+        return updated
+
+    def modify_portfolio(
+        self, portfolio_id: str, modify: typing.Callable[[dict], dict | None]
+    ) -> dict | None:
+        document = self.portfolios_collection.document(portfolio_id)
+
+        @firestore.transactional
+        def run(transaction: firestore.Transaction) -> dict | None:
+            snapshot = document.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            fields = modify(snapshot.to_dict())
+            if fields:
+                transaction.update(document, fields)
+            return fields
+
+        return run(self.client.transaction())
+
+    def modify_portfolios(
+        self, modifications: dict[str, typing.Callable[[dict], dict | None]]
+    ) -> dict[str, dict]:
+        @firestore.transactional
+        def run(transaction: firestore.Transaction, portfolio_ids: list[str]) -> dict[str, dict]:
+            # Read every portfolio in the transaction, so it is retried if one of them changes
+            documents = [self.portfolios_collection.document(id) for id in portfolio_ids]
+            written = {}
+            for snapshot in self.client.get_all(documents, transaction=transaction):
+                if not snapshot.exists:
+                    continue
+                fields = modifications[snapshot.id](snapshot.to_dict())
+                if fields:
+                    transaction.update(snapshot.reference, fields)
+                    written[snapshot.id] = fields
+            return written
+
+        portfolio_ids = list(modifications)
+        written = {}
+        for start in range(0, len(portfolio_ids), FIRESTORE_BATCH_LIMIT):
+            chunk = portfolio_ids[start : start + FIRESTORE_BATCH_LIMIT]
+            written.update(run(self.client.transaction(), chunk))
+        return written
+
+    def delete_portfolio(self, portfolio_id: str) -> None:
+        self.portfolios_collection.document(portfolio_id).delete()
+
+    def get_order(self, order_id: str) -> dict | None:
+        return self._get(self.orders_collection, order_id)
+
+    def set_order(self, order: dict) -> None:
+        self.orders_collection.document(order["id"]).set(order)
+
+    def set_orders(self, orders: list[dict]) -> None:
+        if len(orders) > FIRESTORE_BATCH_LIMIT:
+            raise ValueError(f"Cannot write more than {FIRESTORE_BATCH_LIMIT} orders at once")
+        batch = self.client.batch()
+        for order in orders:
+            batch.set(self.orders_collection.document(order["id"]), order)
+        batch.commit()
+
+    def update_orders(
+        self, updates: dict[str, dict], if_status: str | None = None
+    ) -> list[str]:
+        if if_status is None:
+            return self._update_many(self.orders_collection, updates)
+
+        @firestore.transactional
+        def run(transaction: firestore.Transaction, chunk: dict[str, dict]) -> list[str]:
+            # Read every order in the transaction, so it is retried if one of them changes
+            documents = [self.orders_collection.document(id) for id in chunk]
+            snapshots = self.client.get_all(documents, transaction=transaction)
+            updated = []
+            for snapshot in snapshots:
+                if snapshot.exists and snapshot.get("status") == if_status:
+                    transaction.update(snapshot.reference, chunk[snapshot.id])
+                    updated.append(snapshot.id)
+            return updated
+
+        items = list(updates.items())
+        updated = []
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            chunk = dict(items[start : start + FIRESTORE_BATCH_LIMIT])
+            updated.extend(run(self.client.transaction(), chunk))
+        return updated
+
+    def delete_orders(self, order_ids: list[str]) -> None:
+        for start in range(0, len(order_ids), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for order_id in order_ids[start : start + FIRESTORE_BATCH_LIMIT]:
+                batch.delete(self.orders_collection.document(order_id))
+            batch.commit()
+
+    def get_deletion_job(self, portfolio_id: str) -> dict | None:
+        return self._get(self.deletion_jobs_collection, portfolio_id)
+
+    def set_deletion_job(self, job: dict) -> None:
+        self.deletion_jobs_collection.document(job["portfolio_id"]).set(job)
+
+    def update_deletion_job(self, portfolio_id: str, fields: dict) -> None:
+        self.deletion_jobs_collection.document(portfolio_id).update(fields)
+
+    def get_unfinished_deletion_jobs(self) -> list[dict]:
+        jobs = self.deletion_jobs_collection.where("status", "!=", "DONE").stream()
+        return [job.to_dict() for job in jobs]
+
+    def claim_deletion_job(
+        self, portfolio_id: str, claimant: str, until: float, now: float
+    ) -> dict | None:
+        document = self.deletion_jobs_collection.document(portfolio_id)
+
+        @firestore.transactional
+        def run(transaction: firestore.Transaction) -> dict | None:
+            snapshot = document.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            if job["status"] == "DONE":
+                return None
+            if job.get("claimed_by") not in (None, claimant) and job.get("claimed_until", 0) > now:
+                return None
+            claim = {"claimed_by": claimant, "claimed_until": until}
+            transaction.update(document, claim)
+            return {**job, **claim}
+
+        return run(self.client.transaction())
+
+    def append_equity_points(self, points: dict[str, list[dict]]) -> None:
+        writes = []
+        for portfolio_id, portfolio_points in points.items():
+            points_by_day: dict[str, list[dict]] = {}
+            for point in portfolio_points:
+                day = datetime.datetime.utcfromtimestamp(point["t"] / 1000).strftime("%Y-%m-%d")
+                points_by_day.setdefault(day, []).append(point)
+            for day, day_points in points_by_day.items():
+                document = self.equity_collection.document(f"{portfolio_id}-{day}")
+                fields = {
+                    "portfolio_id": portfolio_id,
+                    "day": day,
+                    "points": firestore.ArrayUnion(day_points),
+                }
+                writes.append((document, fields))
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for document, fields in writes[start : start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(document, fields, merge=True)
+            batch.commit()
+
+    def get_equity_points(
+        self, portfolio_id: str, start: int = 0, end: int | None = None
+    ) -> list[dict]:
+        # Documents are named after their portfolio and day, so only the days in range are read
+        first_day = datetime.datetime.utcfromtimestamp(start / 1000).strftime("%Y-%m-%d")
+        query = self.equity_collection.where(
+            "__name__", ">=", self.equity_collection.document(f"{portfolio_id}-{first_day}")
+        )
+        # Day names sort before "~", so this bounds the range to the portfolio's own documents
+        last_day = "~"
+        if end is not None:
+            last_day = datetime.datetime.utcfromtimestamp(end / 1000).strftime("%Y-%m-%d")
+        query = query.where(
+            "__name__", "<=", self.equity_collection.document(f"{portfolio_id}-{last_day}")
+        )
+        points = [
+            point
+            for document in query.stream()
+            for point in document.to_dict()["points"]
+            if point["t"] >= start and (end is None or point["t"] <= end)
+        ]
+        points.sort(key=lambda point: point["t"])
+        return points
+
+    def delete_equity_points(self, portfolio_id: str) -> None:
+        documents = list(
+            self.equity_collection.where("portfolio_id", "==", portfolio_id).stream()
+        )
+        for start in range(0, len(documents), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for document in documents[start : start + FIRESTORE_BATCH_LIMIT]:
+                batch.delete(document.reference)
+            batch.commit()
+
+    def get_open_orders(self, since: str | None = None) -> list[dict]:
+        if since is None:
+            self._backfill_order_status()
+        query = self.orders_collection.where("status", "==", "OPEN")
+        if since is not None:
+            query = query.where("created_at", ">=", since)
+        return [order.to_dict() for order in query.stream()]
+
+    def delete_order(self, order_id: str) -> None:
+        self.orders_collection.document(order_id).delete()
+
+    def _backfill_order_status(self) -> None:
+        """
+        Mark orders stored before orders had a status as open, like the memory backend treats them.
+        Firestore can't query for a missing field, so every order is scanned, reading only status.
+        """
+        missing = [
+            order.reference
+            for order in self.orders_collection.select(["status"]).stream()
+            if "status" not in order.to_dict()
+        ]
+        for start in range(0, len(missing), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for reference in missing[start : start + FIRESTORE_BATCH_LIMIT]:
+                batch.update(reference, {"status": "OPEN"})
+            batch.commit()
+
+    def get_portfolio_orders(self, portfolio_id: str) -> list[dict]:
+        orders = self.orders_collection.where("portfolio_id", "==", portfolio_id).get()
+        return [order.to_dict() for order in orders]
+
+    def get_recent_orders(self, portfolio_id: str, limit: int) -> list[dict]:
+        orders = (
+            self.orders_collection.where("portfolio_id", "==", portfolio_id)
+            .order_by("created_at", direction=firestore.Query.DESCENDING)
+            .limit(limit)
+            .get()
+        )
+        return [order.to_dict() for order in reversed(orders)]
+
+    def list_orders(
+        self,
+        portfolio_id: str,
+        limit: int,
+        symbol: str | None = None,
+        side: str | None = None,
+        since: str | None = None,
+        after: tuple[str, str] | None = None,
+    ) -> list[dict]:
+        query = self.orders_collection.where("portfolio_id", "==", portfolio_id)
+        if symbol is not None:
+            query = query.where("symbol", "==", symbol)
+        if side is not None:
+            query = query.where("side", "==", side)
+        if since is not None:
+            query = query.where("created_at", ">=", since)
+        query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
+        query = query.order_by("id", direction=firestore.Query.DESCENDING)
+        if after is not None:
+            query = query.start_after({"created_at": after[0], "id": after[1]})
+        return [order.to_dict() for order in query.limit(limit).get()]
+
+    def create_password_reset_request(self, token: str, username: str) -> None:
+        self.password_reset_requests_collection.document().set(
+            {"token": token, "username": username}
+        )
+
+    def get_password_reset_request(self, token: str) -> dict | None:
+        reset_requests = self.password_reset_requests_collection.where(
+            "token", "==", token
+        ).get()
+        if reset_requests:
+            return {**reset_requests[0].to_dict(), "id": reset_requests[0].id}
+
+    def delete_password_reset_request(self, request_id: str) -> None:
+        self.password_reset_requests_collection.document(request_id).delete()
+
+    def set_token_revocation(self, user_id: str, username: str, revoked_at: float) -> None:
+        self.token_revocations_collection.document(user_id).set(
+            {"user_id": user_id, "username": username, "revoked_at": revoked_at}
+        )
+
+    def get_token_revocations(self, since: float) -> list[dict]:
+        revocations = self.token_revocations_collection.where("revoked_at", ">", since).stream()
+        return [revocation.to_dict() for revocation in revocations]
+
+    def get_symbols(self) -> list[dict]:
+        return [symbol.to_dict() for symbol in self.symbols_collection.stream()]
+
+    def set_symbol(self, symbol: dict) -> None:
+        self.symbols_collection.document(symbol["symbol"]).set(symbol)
+
+    def delete_symbol(self, ticker: str) -> None:
+        for symbol in self.symbols_collection.where("symbol", "==", ticker).get():
+            symbol.reference.delete()
+
+    def watch_symbols(self, callback) -> typing.Callable[[], None]:
+        initial_snapshot = True
+
+        def on_snapshot(documents, changes, read_time):
+            nonlocal initial_snapshot
+            # The first snapshot contains the whole collection, which the caller has already loaded
+            if initial_snapshot:
+                initial_snapshot = False
+                return
+            upserted = []
+            removed = []
+            for change in changes:
+                symbol = change.document.to_dict()
+                if change.type.name == "REMOVED":
+                    removed.append(symbol["symbol"])
+                else:
+                    upserted.append(symbol)
+            callback(upserted, removed)
+
+        watch = self.symbols_collection.on_snapshot(on_snapshot)
+        return watch.unsubscribe
+
+    def get_hmds(self, symbol: str) -> dict | None:
+        return self._get(self.hmds_collection, symbol)
+
+    def set_hmds(self, symbol: str, data: dict) -> None:
+        self.hmds_collection.document(symbol).set(data)
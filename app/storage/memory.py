@@ -0,0 +1,351 @@
+import bisect
+import copy
+import threading
+import typing
+import uuid
+
+from app.storage.base import Storage
+
+
+class MemoryStorage(Storage):
+    """
+    In-process storage that keeps every collection in a dict. Documents are copied on the way in and
+    out so callers can mutate them freely, the same as with documents read from Firestore.
+    """
+
+    def __init__(self, seed: dict[str, list[dict]] | None = None):
+        self._lock = threading.RLock()
+        self.users: dict[str, dict] = {}
+        self.user_ids_by_username: dict[str, str] = {}
+        self.portfolios: dict[str, dict] = {}
+        self.orders: dict[str, dict] = {}
+        # Order keys (created_at, id) per portfolio and per portfolio and symbol, kept sorted
+        self.order_keys_by_portfolio: dict[str, list[tuple[str, str]]] = {}
+        self.order_keys_by_symbol: dict[tuple[str, str], list[tuple[str, str]]] = {}
+        self.password_reset_requests: dict[str, dict] = {}
+        self.token_revocations: dict[str, dict] = {}
+        self.deletion_jobs: dict[str, dict] = {}
+        self.equity_points: dict[str, list[dict]] = {}
+        self.symbols: dict[str, dict] = {}
+        self.symbol_watchers: list = []
+        self.hmds: dict[str, dict] = {}
+        if seed:
+            self.load(seed)
+
+    def load(self, seed: dict[str, list[dict]]) -> None:
+        """
+        Load documents into the store, keyed by collection name.
+        """
+        for user in seed.get("users", []):
+            self.set_user(user)
+        for portfolio in seed.get("portfolios", []):
+            self.set_portfolio(portfolio)
+        for order in seed.get("orders", []):
+            self.set_order(order)
+        for symbol in seed.get("symbols", []):
+            self.set_symbol(symbol)
+        for data in seed.get("hmds", []):
+            self.set_hmds(data["symbol"], data)
+
+    def get_user(self, user_id: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self.users.get(user_id))
+
+    def get_user_by_username(self, username: str) -> dict | None:
+        with self._lock:
+            user_id = self.user_ids_by_username.get(username)
+            if user_id is not None:
+                return copy.deepcopy(self.users[user_id])
+
+    def set_user(self, user: dict) -> None:
+        with self._lock:
+            previous = self.users.get(user["id"])
+            if previous is not None:
+                self.user_ids_by_username.pop(previous["username"], None)
+            self.users[user["id"]] = copy.deepcopy(user)
+            self.user_ids_by_username[user["username"]] = user["id"]
+
+    def update_user(self, user_id: str, fields: dict) -> None:
+        with self._lock:
+            user = self.users[user_id]
+            if "username" in fields:
+                self.user_ids_by_username.pop(user["username"], None)
+                self.user_ids_by_username[fields["username"]] = user_id
+            user.update(copy.deepcopy(fields))
+
+    def get_portfolio(self, portfolio_id: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self.portfolios.get(portfolio_id))
+
+    def set_portfolio(self, portfolio: dict) -> None:
+        with self._lock:
+            self.portfolios[portfolio["id"]] = copy.deepcopy(portfolio)
+
+    def update_portfolio(self, portfolio_id: str, fields: dict) -> None:
+        with self._lock:
+            self.portfolios[portfolio_id].update(copy.deepcopy(fields))
+
+    def modify_portfolio(
+        self, portfolio_id: str, modify: typing.Callable[[dict], dict | None]
+    ) -> dict | None:
+        with self._lock:
+            portfolio = self.portfolios.get(portfolio_id)
+            if portfolio is None:
+                return None
+            fields = modify(copy.deepcopy(portfolio))
+            if fields:
+                portfolio.update(copy.deepcopy(fields))
+            return fields
+
+    def modify_portfolios(
+        self, modifications: dict[str, typing.Callable[[dict], dict | None]]
+    ) -> dict[str, dict]:
+        written = {}
+        with self._lock:
+            for portfolio_id, modify in modifications.items():
+                fields = self.modify_portfolio(portfolio_id, modify)
+                if fields:
+                    written[portfolio_id] = fields
+        return written
+
+    def delete_portfolio(self, portfolio_id: str) -> None:
+        with self._lock:
+            self.portfolios.pop(portfolio_id, None)
+
+    def get_order(self, order_id: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self.orders.get(order_id))
+
+    def _order_indexes(self, order: dict) -> list[list[tuple[str, str]]]:
+        return [
+            self.order_keys_by_portfolio.setdefault(order["portfolio_id"], []),
+            self.order_keys_by_symbol.setdefault(
+                (order["portfolio_id"], order["symbol"]), []
+            ),
+        ]
+
+    def _index_order(self, order: dict) -> None:
+        for keys in self._order_indexes(order):
+            bisect.insort(keys, (order["created_at"], order["id"]))
+
+    def _unindex_order(self, order: dict) -> None:
+        key = (order["created_at"], order["id"])
+        for keys in self._order_indexes(order):
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def set_order(self, order: dict) -> None:
+        with self._lock:
+            previous = self.orders.get(order["id"])
+            if previous is not None:
+                self._unindex_order(previous)
+            self.orders[order["id"]] = copy.deepcopy(order)
+            self._index_order(order)
+
+    def set_orders(self, orders: list[dict]) -> None:
+        with self._lock:
+            for order in orders:
+                self.set_order(order)
+
+    def update_orders(
+        self, updates: dict[str, dict], if_status: str | None = None
+    ) -> list[str]:
+        updated = []
+        with self._lock:
+            for order_id, fields in updates.items():
+                order = self.orders.get(order_id)
+                if order is not None and (if_status is None or order.get("status") == if_status):
+                    self.orders[order_id].update(copy.deepcopy(fields))
+                    updated.append(order_id)
+        return updated
+
+    def delete_orders(self, order_ids: list[str]) -> None:
+        with self._lock:
+            for order_id in order_ids:
+                self.delete_order(order_id)
+
+    def get_deletion_job(self, portfolio_id: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self.deletion_jobs.get(portfolio_id))
+
+    def set_deletion_job(self, job: dict) -> None:
+        with self._lock:
+            self.deletion_jobs[job["portfolio_id"]] = copy.deepcopy(job)
+
+    def update_deletion_job(self, portfolio_id: str, fields: dict) -> None:
+        with self._lock:
+            self.deletion_jobs[portfolio_id].update(copy.deepcopy(fields))
+
+    def get_unfinished_deletion_jobs(self) -> list[dict]:
+        with self._lock:
+            return [
+                copy.deepcopy(job)
+                for job in self.deletion_jobs.values()
+                if job["status"] != "DONE"
+            ]
+
+    def claim_deletion_job(
+        self, portfolio_id: str, claimant: str, until: float, now: float
+    ) -> dict | None:
+        with self._lock:
+            job = self.deletion_jobs.get(portfolio_id)
+            if job is None or job["status"] == "DONE":
+                return None
+            if job.get("claimed_by") not in (None, claimant) and job.get("claimed_until", 0) > now:
+                return None
+            job.update({"claimed_by": claimant, "claimed_until": until})
+            return copy.deepcopy(job)
+
+    def append_equity_points(self, points: dict[str, list[dict]]) -> None:
+        with self._lock:
+            for portfolio_id, portfolio_points in points.items():
+                stored = self.equity_points.setdefault(portfolio_id, [])
+                for point in sorted(portfolio_points, key=lambda point: point["t"]):
+                    # New points almost always go at the end
+                    index = bisect.bisect_left(stored, point["t"], key=lambda point: point["t"])
+                    if index < len(stored) and stored[index]["t"] == point["t"]:
+                        stored[index] = copy.deepcopy(point)
+                    else:
+                        stored.insert(index, copy.deepcopy(point))
+
+    def get_equity_points(
+        self, portfolio_id: str, start: int = 0, end: int | None = None
+    ) -> list[dict]:
+        with self._lock:
+            stored = self.equity_points.get(portfolio_id, [])
+            low = bisect.bisect_left(stored, start, key=lambda point: point["t"])
+            high = (
+                len(stored)
+                if end is None
+                else bisect.bisect_right(stored, end, key=lambda point: point["t"])
+            )
+            return copy.deepcopy(stored[low:high])
+
+    def delete_equity_points(self, portfolio_id: str) -> None:
+        with self._lock:
+            self.equity_points.pop(portfolio_id, None)
+
+    def get_open_orders(self, since: str | None = None) -> list[dict]:
+        with self._lock:
+            return [
+                copy.deepcopy(order)
+                for order in self.orders.values()
+                if order.get("status", "OPEN") == "OPEN"
+                and (since is None or order["created_at"] >= since)
+            ]
+
+    def delete_order(self, order_id: str) -> None:
+        with self._lock:
+            order = self.orders.pop(order_id, None)
+            if order is not None:
+                self._unindex_order(order)
+
+    def get_portfolio_orders(self, portfolio_id: str) -> list[dict]:
+        with self._lock:
+            keys = self.order_keys_by_portfolio.get(portfolio_id, [])
+            return [copy.deepcopy(self.orders[order_id]) for _, order_id in keys]
+
+    def get_recent_orders(self, portfolio_id: str, limit: int) -> list[dict]:
+        with self._lock:
+            keys = self.order_keys_by_portfolio.get(portfolio_id, [])
+            return [copy.deepcopy(self.orders[order_id]) for _, order_id in keys[-limit:]]
+
+    def list_orders(
+        self,
+        portfolio_id: str,
+        limit: int,
+        symbol: str | None = None,
+        side: str | None = None,
+        since: str | None = None,
+        after: tuple[str, str] | None = None,
+    ) -> list[dict]:
+        with self._lock:
+            if symbol is not None:
+                keys = self.order_keys_by_symbol.get((portfolio_id, symbol), [])
+            else:
+                keys = self.order_keys_by_portfolio.get(portfolio_id, [])
+            # Walk the index backwards from just before the cursor
+            index = bisect.bisect_left(keys, after) if after is not None else len(keys)
+            orders = []
+            while index > 0 and len(orders) < limit:
+                index -= 1
+                created_at, order_id = keys[index]
+                if since is not None and created_at < since:
+                    break
+                order = self.orders[order_id]
+                if side is None or order["side"] == side:
+                    orders.append(copy.deepcopy(order))
+            return orders
+
+    def create_password_reset_request(self, token: str, username: str) -> None:
+        request_id = str(uuid.uuid4())
+        with self._lock:
+            self.password_reset_requests[request_id] = {
+                "token": token,
+                "username": username,
+            }
+
+    def get_password_reset_request(self, token: str) -> dict | None:
+        with self._lock:
+            for request_id, request in self.password_reset_requests.items():
+                if request["token"] == token:
+                    return {**request, "id": request_id}
+
+    def delete_password_reset_request(self, request_id: str) -> None:
+        with self._lock:
+            self.password_reset_requests.pop(request_id, None)
+
+    def set_token_revocation(self, user_id: str, username: str, revoked_at: float) -> None:
+        with self._lock:
+            self.token_revocations[user_id] = {
+                "user_id": user_id,
+                "username": username,
+                "revoked_at": revoked_at,
+            }
+
+    def get_token_revocations(self, since: float) -> list[dict]:
+        with self._lock:
+            return [
+                dict(revocation)
+                for revocation in self.token_revocations.values()
+                if revocation["revoked_at"] > since
+            ]
+
+    def get_symbols(self) -> list[dict]:
+        with self._lock:
+            return copy.deepcopy(list(self.symbols.values()))
+
+    def set_symbol(self, symbol: dict) -> None:
+        with self._lock:
+            self.symbols[symbol["symbol"]] = copy.deepcopy(symbol)
+            watchers = list(self.symbol_watchers)
+        for callback in watchers:
+            callback([copy.deepcopy(symbol)], [])
+
+    def delete_symbol(self, ticker: str) -> None:
+        with self._lock:
+            removed = self.symbols.pop(ticker, None)
+            watchers = list(self.symbol_watchers)
+        if removed is not None:
+            for callback in watchers:
+                callback([], [ticker])
+
+    def watch_symbols(self, callback) -> typing.Callable[[], None]:
+        with self._lock:
+            self.symbol_watchers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self.symbol_watchers:
+                    self.symbol_watchers.remove(callback)
+
+        return unsubscribe
+
+    def get_hmds(self, symbol: str) -> dict | None:
+        with self._lock:
+            return copy.deepcopy(self.hmds.get(symbol))
+
+    def set_hmds(self, symbol: str, data: dict) -> None:
+        with self._lock:
+            self.hmds[symbol] = copy.deepcopy(data)
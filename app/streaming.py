@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+import typing
+import fastapi
+
+from app import config, storage, valuation
+from app.equity import equity_curves
+from app.quotes import SnapshotCache, snapshot_cache
+from app.writebehind import portfolio_writes
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    A subscriber's view of the quote feed. Quotes that arrive while the subscriber is busy are
+    coalesced, so a slow subscriber only ever sees the latest quote for each conid.
+    """
+
+    def __init__(self, conids: set[int]):
+        self.conids = conids
+        self.pending: dict[int, dict] = {}
+        self.event = asyncio.Event()
+
+    def publish(self, snapshot: dict) -> None:
+        self.pending[snapshot["conid"]] = snapshot
+        self.event.set()
+
+    def take(self) -> dict[int, dict]:
+        pending, self.pending = self.pending, {}
+        self.event.clear()
+        return pending
+
+
+class QuoteHub:
+    """
+    Fans one upstream quote feed out to every subscriber. While anyone is subscribed, the hub polls
+    the snapshot cache every `interval` seconds for the union of subscribed conids and publishes each
+    quote that changed to the subscribers of its conid.
+    """
+
+    def __init__(self, quotes: SnapshotCache, interval: float):
+        self.quotes = quotes
+        self.interval = interval
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self._last: dict[int, dict] = {}
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, conids: set[int]) -> Subscription:
+        subscription = Subscription(set())
+        self.update(subscription, conids)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def update(self, subscription: Subscription, conids: set[int]) -> None:
+        """
+        Change the conids a subscription follows. Quotes already seen for new conids are published
+        to it straight away.
+        """
+        for conid in subscription.conids - conids:
+            self._remove(subscription, conid)
+        for conid in conids - subscription.conids:
+            self.subscribers.setdefault(conid, set()).add(subscription)
+            if conid in self._last:
+                subscription.publish(self._last[conid])
+        subscription.conids = set(conids)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for conid in subscription.conids:
+            self._remove(subscription, conid)
+        subscription.conids = set()
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _remove(self, subscription: Subscription, conid: int) -> None:
+        subscribers = self.subscribers.get(conid)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[conid]
+            self._last.pop(conid, None)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Failed to poll quotes for streaming")
+            await asyncio.sleep(self.interval)
+
+    async def poll(self) -> None:
+        conids = list(self.subscribers)
+        if not conids:
+            return
+        for snapshot in await self.quotes.get(conids):
+            conid = snapshot["conid"]
+            if self._last.get(conid) == snapshot:
+                continue
+            self._last[conid] = snapshot
+            for subscription in self.subscribers.get(conid, ()):
+                subscription.publish(snapshot)
+
+
+class PortfolioStream:
+    """
+    Streams a portfolio's valuation over a WebSocket. The first message is a "snapshot" with every
+    position; after that "update" messages carry only the positions whose value or PnL changed, and
+    an {"id": ..., "removed": true} entry for each position that was closed or removed, along with
+    the portfolio totals. Positions are re-read every `refresh_interval` seconds so fills and new
+    positions show up, and `authorize` is awaited at the same time so the stream is closed once its
+    access token has expired or been revoked.
+    """
+
+    def __init__(
+        self,
+        websocket: fastapi.WebSocket,
+        portfolio_id: str,
+        hub: QuoteHub,
+        refresh_interval: float,
+        authorize: typing.Callable[[], typing.Awaitable[bool]],
+    ):
+        self.websocket = websocket
+        self.portfolio_id = portfolio_id
+        self.hub = hub
+        self.refresh_interval = refresh_interval
+        self.authorize = authorize
+        self.positions: list[dict] = []
+        self.quotes: dict[int, dict] = {}
+        self.sent: dict[str, tuple[float, float]] = {}
+
+    def _load_positions(self, db: storage.Storage) -> bool:
+        portfolio = db.get_portfolio(self.portfolio_id)
+        if portfolio is None or portfolio.get("deleted"):
+            return False
+        portfolio_writes.overlay(portfolio)
+        self.positions = [p for p in portfolio["positions"] if p["quantity"] != 0]
+        return True
+
+    def _message(self, message_type: str) -> dict | None:
+        result = valuation.value_positions(self.positions, list(self.quotes.values()))
+        current_value = result.current_value.tolist()
+        pnl = result.pnl.tolist()
+        changed = []
+        for index, position in enumerate(self.positions):
+            if not result.priced[index]:
+                continue
+            state = (current_value[index], pnl[index])
+            if message_type == "update" and self.sent.get(position["id"]) == state:
+                continue
+            self.sent[position["id"]] = state
+            changed.append(
+                {
+                    "id": position["id"],
+                    "symbol": position["symbol"],
+                    "conid": position["conid"],
+                    "quantity": position["quantity"],
+                    "side": position["side"],
+                    "current_value": state[0],
+                    "pnl": state[1],
+                }
+            )
+        # Positions that were sent but have since been closed or removed
+        current_ids = {position["id"] for position in self.positions}
+        for position_id in [id for id in self.sent if id not in current_ids]:
+            del self.sent[position_id]
+            changed.append({"id": position_id, "removed": True})
+        equity_curves.record(self.portfolio_id, result.total_value, result.total_pnl)
+        if message_type == "update" and not changed:
+            return None
+        return {
+            "type": message_type,
+            "positions": changed,
+            "total_value": result.total_value,
+            "total_pnl": result.total_pnl,
+        }
+
+    async def run(self, db: storage.Storage) -> None:
+        if not await asyncio.to_thread(self._load_positions, db):
+            await self.websocket.close(code=fastapi.status.WS_1008_POLICY_VIOLATION)
+            return
+        conids = {p["conid"] for p in self.positions}
+        if conids:
+            try:
+                snapshots = await self.hub.quotes.get(list(conids))
+                self.quotes = {snapshot["conid"]: snapshot for snapshot in snapshots}
+            except Exception:
+                logger.exception("Failed to get initial quotes for streaming")
+        subscription = self.hub.subscribe(conids)
+        # Watch for the client going away while we wait for quotes
+        receiver = asyncio.create_task(self._drain())
+        try:
+            await self.websocket.send_json(self._message("snapshot"))
+            next_refresh = time.monotonic() + self.refresh_interval
+            while not receiver.done():
+                waiter = asyncio.create_task(subscription.event.wait())
+                await asyncio.wait(
+                    {waiter, receiver},
+                    timeout=max(0.0, next_refresh - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                waiter.cancel()
+                if receiver.done():
+                    break
+                if time.monotonic() >= next_refresh:
+                    if not await self.authorize():
+                        await self.websocket.close(code=fastapi.status.WS_1008_POLICY_VIOLATION)
+                        break
+                    if not await asyncio.to_thread(self._load_positions, db):
+                        break
+                    self.hub.update(subscription, {p["conid"] for p in self.positions})
+                    next_refresh = time.monotonic() + self.refresh_interval
+                self.quotes.update(subscription.take())
+                message = self._message("update")
+                if message is not None:
+                    await self.websocket.send_json(message)
+        except fastapi.WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+            self.hub.unsubscribe(subscription)
+
+    async def _drain(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+
+quote_hub = QuoteHub(snapshot_cache, interval=config.STREAM_QUOTE_INTERVAL_SECONDS)
@@ -0,0 +1,359 @@
+import asyncio
+import bisect
+import gzip
+import hashlib
+import heapq
+import json
+import logging
+import re
+import threading
+import typing
+
+from app import config, models, storage
+
+logger = logging.getLogger(__name__)
+
+
+def _insert(entries: list, entry) -> None:
+    index = bisect.bisect_left(entries, entry)
+    if index == len(entries) or entries[index] != entry:
+        entries.insert(index, entry)
+
+
+def _remove(entries: list, entry) -> None:
+    index = bisect.bisect_left(entries, entry)
+    if index < len(entries) and entries[index] == entry:
+        del entries[index]
+
+
+class SymbolIndex:
+    """
+    Prefix index over symbol tickers and company names, for typeahead search.
+
+    Lowercased tickers are kept in one sorted array per ticker length, and every word of every company
+    name in one sorted array of (word, ticker length, ticker) entries, so all entries starting with a
+    prefix form contiguous ranges that are found with binary searches. Those ranges are already in
+    rank order, so a search walks them best match first and stops as soon as it has `limit` results,
+    however many symbols match. Changes are applied incrementally to copies of the arrays, which are
+    then swapped in, so searches never see a half-updated index.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+    def __init__(self):
+        self.documents: dict[str, dict] = {}
+        self._tickers: dict[int, list[tuple[str, str]]] = {}
+        self._words: list[tuple[str, int, str]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _tokenize(cls, text: str | None) -> list[str]:
+        return cls.TOKEN_PATTERN.findall(text.lower()) if text else []
+
+    @classmethod
+    def _words_for(cls, symbol: dict) -> set[tuple[str, int, str]]:
+        ticker = symbol["symbol"]
+        return {
+            (token, len(ticker), ticker) for token in cls._tokenize(symbol.get("company_name"))
+        }
+
+    @classmethod
+    def _matches(cls, symbol: dict, tokens: list[str]) -> bool:
+        keys = [symbol["symbol"].lower(), *cls._tokenize(symbol.get("company_name"))]
+        return all(any(key.startswith(token) for key in keys) for token in tokens)
+
+    def rebuild(self, symbols: list[dict]) -> None:
+        documents = {symbol["symbol"]: symbol for symbol in symbols}
+        tickers: dict[int, list[tuple[str, str]]] = {}
+        for ticker in documents:
+            tickers.setdefault(len(ticker), []).append((ticker.lower(), ticker))
+        for entries in tickers.values():
+            entries.sort()
+        words = sorted(set().union(*map(self._words_for, documents.values())))
+        with self._lock:
+            self.documents, self._tickers, self._words = documents, tickers, words
+
+    def apply_changes(self, upserted: list[dict], removed: list[str]) -> None:
+        with self._lock:
+            documents = dict(self.documents)
+            words = list(self._words)
+            # Only the ticker arrays of the lengths that change are copied
+            tickers = dict(self._tickers)
+            copied = set()
+
+            def tickers_of_length(length: int) -> list[tuple[str, str]]:
+                if length not in copied:
+                    tickers[length] = list(tickers.get(length, []))
+                    copied.add(length)
+                return tickers[length]
+
+            stale = [documents.pop(ticker) for ticker in removed if ticker in documents]
+            stale += [documents[s["symbol"]] for s in upserted if s["symbol"] in documents]
+            for symbol in stale:
+                ticker = symbol["symbol"]
+                _remove(tickers_of_length(len(ticker)), (ticker.lower(), ticker))
+                for word in self._words_for(symbol):
+                    _remove(words, word)
+            for symbol in upserted:
+                ticker = symbol["symbol"]
+                documents[ticker] = symbol
+                _insert(tickers_of_length(len(ticker)), (ticker.lower(), ticker))
+                for word in self._words_for(symbol):
+                    _insert(words, word)
+            self.documents, self._tickers, self._words = documents, tickers, words
+
+    def search(self, query: str, limit: int) -> list[dict]:
+        """
+        Find symbols whose ticker or company name words start with every word of the query. An exact
+        ticker match ranks first, then ticker prefix matches, then company name matches, with shorter
+        tickers first and then alphabetical order within each group.
+        """
+        documents, tickers, words = self.documents, self._tickers, self._words
+        tokens = self._tokenize(query)
+        if not tokens:
+            return []
+        first, rest = tokens[0], tokens[1:]
+        results: list[dict] = []
+        seen: set[str] = set()
+
+        def take(ticker: str) -> bool:
+            # Returns whether the results are full
+            if ticker not in seen:
+                seen.add(ticker)
+                if self._matches(documents[ticker], rest):
+                    results.append(documents[ticker])
+            return len(results) >= limit
+
+        # Tickers of the query's own length can only match exactly, and longer ones by prefix
+        for length in sorted(length for length in tickers if length >= len(first)):
+            entries = tickers[length]
+            index = bisect.bisect_left(entries, (first,))
+            while index < len(entries) and entries[index][0].startswith(first):
+                if take(entries[index][1]):
+                    return results
+                index += 1
+        # Each word starting with the query has its own run of entries, sorted by ticker length and
+        # ticker; merging the runs lazily yields company name matches in rank order
+        runs = []
+        index = bisect.bisect_left(words, (first,))
+        while index < len(words) and words[index][0].startswith(first):
+            end = bisect.bisect_left(words, (words[index][0] + "\x00",), index)
+            runs.append(words[position] for position in range(index, end))
+            index = end
+        for _, _, ticker in heapq.merge(*runs, key=lambda entry: entry[1:]):
+            if take(ticker):
+                break
+        return results
+
+
+class SymbolInfo(typing.NamedTuple):
+    symbol: str
+    conid: int
+    company_name: str | None
+    logo: str | None
+
+
+class SymbolDirectory:
+    """
+    Two-way map between tickers and conids, with each symbol's company name and logo.
+
+    Tickers are matched case-insensitively. Like `SymbolIndex`, changes are applied to copies of the
+    maps which are then swapped in, so lookups never take a lock.
+    """
+
+    def __init__(self):
+        self.by_symbol: dict[str, SymbolInfo] = {}
+        self.by_conid: dict[int, SymbolInfo] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _info(symbol: dict) -> SymbolInfo | None:
+        if symbol.get("conid") is None:
+            return None
+        return SymbolInfo(
+            symbol=symbol["symbol"],
+            conid=int(symbol["conid"]),
+            company_name=symbol.get("company_name"),
+            logo=symbol.get("logo"),
+        )
+
+    def rebuild(self, symbols: list[dict]) -> None:
+        infos = [info for info in map(self._info, symbols) if info is not None]
+        with self._lock:
+            self.by_symbol = {info.symbol.upper(): info for info in infos}
+            self.by_conid = {info.conid: info for info in infos}
+
+    def apply_changes(self, upserted: list[dict], removed: list[str]) -> None:
+        with self._lock:
+            by_symbol = dict(self.by_symbol)
+            by_conid = dict(self.by_conid)
+            for ticker in removed + [symbol["symbol"] for symbol in upserted]:
+                stale = by_symbol.pop(ticker.upper(), None)
+                if stale is not None and by_conid.get(stale.conid) == stale:
+                    del by_conid[stale.conid]
+            for info in map(self._info, upserted):
+                if info is not None:
+                    by_symbol[info.symbol.upper()] = info
+                    by_conid[info.conid] = info
+            self.by_symbol, self.by_conid = by_symbol, by_conid
+
+    def resolve(self, symbol: str) -> SymbolInfo | None:
+        return self.by_symbol.get(symbol.upper())
+
+    def lookup_conid(self, conid: int) -> SymbolInfo | None:
+        return self.by_conid.get(conid)
+
+
+class SymbolsSnapshot:
+    """
+    In-memory copy of the symbols collection, kept as a pre-serialised and pre-compressed /symbols
+    response body with an ETag.
+
+    The snapshot is loaded once, updated with the symbol writes the storage backend reports, and
+    fully reloaded every `refresh_interval` seconds as a fallback. Reported writes are queued and
+    applied together every `flush_interval` seconds, so a burst of them, such as a bulk import,
+    costs one rebuild of the body rather than one per symbol.
+    """
+
+    # Batches changing more than this share of the symbols rebuild the listeners from scratch
+    LISTENER_REBUILD_RATIO = 0.1
+
+    def __init__(self, refresh_interval: float, flush_interval: float):
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        self.symbols: dict[str, dict] = {}
+        # (body, gzip_body, etag), swapped as a whole so readers never see a body with the wrong ETag
+        self.payload: tuple[bytes, bytes, str] = (b"[]", gzip.compress(b"[]"), '""')
+        self.loaded = False
+        self._lock = threading.Lock()
+        # The latest reported document of each changed ticker, or None if it was removed
+        self._pending: dict[str, dict | None] = {}
+        self._listeners: list = []
+        self._unwatch: typing.Callable[[], None] | None = None
+        self._refresh_task: asyncio.Task | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    def add_listener(self, listener) -> None:
+        """
+        Keep `listener` in sync with the snapshot. The listener's `rebuild(symbols)` is called after a
+        full load and `apply_changes(upserted, removed)` after each incremental change.
+        """
+        self._listeners.append(listener)
+
+    def load(self, db: storage.Storage) -> None:
+        symbols = {symbol["symbol"]: symbol for symbol in db.get_symbols()}
+        with self._lock:
+            # Queued changes are at least as new as the documents just read
+            pending, self._pending = self._pending, {}
+            self._merge(symbols, pending)
+            self.symbols = symbols
+            self._rebuild()
+            self.loaded = True
+            for listener in self._listeners:
+                listener.rebuild(list(symbols.values()))
+
+    def apply_changes(self, upserted: list[dict], removed: list[str]) -> None:
+        """
+        Queue symbol writes reported by the storage backend, to be applied on the next flush.
+        """
+        with self._lock:
+            for ticker in removed:
+                self._pending[ticker] = None
+            for symbol in upserted:
+                self._pending[symbol["symbol"]] = symbol
+
+    def flush(self) -> None:
+        """
+        Apply the queued changes to the snapshot and its listeners.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._merge(self.symbols, pending)
+            self._rebuild()
+            if len(pending) > len(self.symbols) * self.LISTENER_REBUILD_RATIO:
+                for listener in self._listeners:
+                    listener.rebuild(list(self.symbols.values()))
+                return
+            upserted = [symbol for symbol in pending.values() if symbol is not None]
+            removed = [ticker for ticker, symbol in pending.items() if symbol is None]
+            for listener in self._listeners:
+                listener.apply_changes(upserted, removed)
+
+    @staticmethod
+    def _merge(symbols: dict[str, dict], pending: dict[str, dict | None]) -> None:
+        for ticker, symbol in pending.items():
+            if symbol is None:
+                symbols.pop(ticker, None)
+            else:
+                symbols[ticker] = symbol
+
+    def _rebuild(self) -> None:
+        body = json.dumps(
+            [
+                models.Symbol(
+                    ticker=symbol.get("symbol"), name=symbol.get("company_name")
+                ).dict()
+                for symbol in self.symbols.values()
+            ]
+        ).encode()
+        self.payload = (
+            body,
+            gzip.compress(body),
+            f'"{hashlib.sha1(body).hexdigest()}"',
+        )
+
+    def get(self, db: storage.Storage) -> tuple[bytes, bytes, str]:
+        """
+        Get the (body, gzip_body, etag) payload, loading the snapshot if it hasn't been loaded yet.
+        """
+        if not self.loaded:
+            self.load(db)
+        elif self._flush_task is None:
+            # Without the background flush, for example before start, changes are applied on read
+            self.flush()
+        return self.payload
+
+    async def start(self) -> None:
+        db = storage.get_storage()
+        self.load(db)
+        self._unwatch = db.watch_symbols(self.apply_changes)
+        self._refresh_task = asyncio.create_task(self._refresh_periodically(db))
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def _refresh_periodically(self, db: storage.Storage) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await asyncio.to_thread(self.load, db)
+            except Exception:
+                logger.exception("Failed to refresh symbols")
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Failed to apply symbol changes")
+
+
+symbols_snapshot = SymbolsSnapshot(
+    refresh_interval=config.SYMBOLS_REFRESH_SECONDS, flush_interval=config.SYMBOLS_FLUSH_SECONDS
+)
+symbol_index = SymbolIndex()
+symbols_snapshot.add_listener(symbol_index)
+symbol_directory = SymbolDirectory()
+symbols_snapshot.add_listener(symbol_directory)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import threading
+import time
+import typing
+import cachetools
+
+from app import config, models, storage
+from app.cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+class UserVersions(typing.NamedTuple):
+    """
+    The parts of a user that access tokens carry as claims. `token_version` is bumped to revoke every
+    token issued to the user, and `portfolios_version` whenever their list of portfolios changes.
+    """
+
+    token_version: int
+    portfolios_version: int
+    disabled: bool
+
+    @classmethod
+    def of(cls, user: models.UserInDB | dict) -> "UserVersions":
+        if isinstance(user, dict):
+            return cls(
+                user.get("token_version", 0),
+                user.get("portfolios_version", 0),
+                user.get("disabled", False),
+            )
+        return cls(user.token_version, user.portfolios_version, user.disabled)
+
+
+def access_token_claims(user: models.UserInDB) -> dict:
+    """
+    Claims that let a request be authenticated without reading the user from storage.
+    """
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "email": user.email,
+        "dis": user.disabled,
+        "tv": user.token_version,
+        "pv": user.portfolios_version,
+        "pfs": user.portfolios,
+    }
+
+
+def versions_from_claims(payload: dict) -> UserVersions | None:
+    """
+    The versions a token was issued with, or None for tokens issued without claims.
+    """
+    if "uid" not in payload:
+        return None
+    return UserVersions(payload["tv"], payload["pv"], payload["dis"])
+
+
+def user_from_claims(payload: dict) -> models.User:
+    return models.User(
+        id=payload["uid"],
+        username=payload["sub"],
+        email=payload["email"],
+        disabled=payload["dis"],
+        portfolios=payload["pfs"],
+    )
+
+
+class TokenVersions:
+    """
+    The latest versions of recently seen users, keyed by user id. A token whose claims match the entry
+    for its user is trusted as is; otherwise the user is read again. Changes made by this process are
+    seen straight away, while changes made by other worker processes are picked up once their entries
+    expire after `ttl` seconds.
+
+    Revoking a user's tokens, or changing their portfolios, also records a revocation in storage,
+    which every worker polls for every `poll_interval` seconds, dropping its entries for the user so
+    their old tokens stop being trusted within one poll rather than one `ttl`. Each poll looks back
+    `clock_skew` seconds before the previous one started, so revocations stamped by hosts whose
+    clocks run behind are still seen, and skips the ones it has already applied. Users changed
+    directly in storage, for example disabled by an administrator, are still only picked up once
+    their entries expire.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, poll_interval: float, clock_skew: float):
+        self.poll_interval = poll_interval
+        self.clock_skew = clock_skew
+        self._versions = cachetools.TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # Revocations older than an entry's lifetime can't affect any entry
+        self._polled_at = time.time() - ttl
+        # The revocation times already applied, keyed by user id
+        self._applied: dict[str, float] = {}
+        self._poll_task: asyncio.Task | None = None
+
+    def get(self, user_id: str) -> UserVersions | None:
+        with self._lock:
+            return self._versions.get(user_id)
+
+    def set(self, user_id: str, versions: UserVersions) -> None:
+        with self._lock:
+            self._versions[user_id] = versions
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._versions.clear()
+
+    def revoke(
+        self, db: storage.Storage, user_id: str, username: str, versions: UserVersions
+    ) -> None:
+        """
+        Record that tokens issued before a user's latest `versions` are no longer trusted as is, for
+        this process and the others.
+        """
+        db.set_token_revocation(user_id, username, time.time())
+        user_cache.invalidate(username)
+        self.set(user_id, versions)
+
+    def poll(self, db: storage.Storage) -> None:
+        polled_at = time.time()
+        revocations = db.get_token_revocations(self._polled_at - self.clock_skew)
+        applied = {}
+        for revocation in revocations:
+            user_id = revocation["user_id"]
+            applied[user_id] = revocation["revoked_at"]
+            if self._applied.get(user_id) == revocation["revoked_at"]:
+                continue
+            self.invalidate(user_id)
+            user_cache.invalidate(revocation["username"])
+        # Revocations that have left the window can't be returned again
+        self._applied = applied
+        self._polled_at = polled_at
+
+    async def _poll_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.poll, storage.get_storage())
+            except Exception:
+                logger.exception("Failed to poll token revocations")
+
+    async def start(self) -> None:
+        if config.AUTH_STATELESS_TOKENS:
+            self._poll_task = asyncio.create_task(self._poll_periodically())
+
+    async def stop(self) -> None:
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+
+token_versions = TokenVersions(
+    maxsize=config.TOKEN_VERSIONS_MAXSIZE,
+    ttl=config.TOKEN_VERSIONS_TTL_SECONDS,
+    poll_interval=config.TOKEN_REVOCATIONS_POLL_SECONDS,
+    clock_skew=config.TOKEN_REVOCATIONS_CLOCK_SKEW_SECONDS,
+)
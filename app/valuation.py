@@ -0,0 +1,72 @@
+import typing
+import numpy as np
+
+
+class Valuation(typing.NamedTuple):
+    """
+    Result of valuing a list of positions. Arrays are aligned with the positions that were valued;
+    `priced` marks the positions that had a snapshot and a BUY or SELL side, and `changed`, set by
+    `apply_pnl`, marks the priced positions whose PnL differs from the one they had before.
+    """
+
+    current_value: np.ndarray
+    pnl: np.ndarray
+    priced: np.ndarray
+    changed: np.ndarray | None = None
+
+    @property
+    def total_value(self) -> float:
+        return float(self.current_value[self.priced].sum())
+
+    @property
+    def total_pnl(self) -> float:
+        return float(self.pnl[self.priced].sum())
+
+
+def value_positions(positions: list[dict], snapshots: list[dict]) -> Valuation:
+    """
+    Value positions against market snapshots in one vectorised pass. BUY positions are valued at the
+    ask price and SELL positions at the bid price.
+    """
+    count = len(positions)
+    conids = np.fromiter((p["conid"] for p in positions), dtype=np.int64, count=count)
+    quantity = np.fromiter((p["quantity"] for p in positions), dtype=np.float64, count=count)
+    value = np.fromiter((p["value"] for p in positions), dtype=np.float64, count=count)
+    sides = np.array([p["side"] or "" for p in positions], dtype=object)
+    buy = sides == "BUY"
+    sell = sides == "SELL"
+    # Index snapshots by conid; for duplicate conids the last snapshot wins
+    snapshot_conids = np.fromiter((s["conid"] for s in snapshots), dtype=np.int64)
+    bid = np.fromiter((s["bid_price"] for s in snapshots), dtype=np.float64)
+    ask = np.fromiter((s["ask_price"] for s in snapshots), dtype=np.float64)
+    order = np.argsort(snapshot_conids, kind="stable")[::-1]
+    snapshot_conids, unique_index = np.unique(snapshot_conids[order], return_index=True)
+    bid = bid[order][unique_index]
+    ask = ask[order][unique_index]
+    if len(snapshot_conids):
+        lookup = np.searchsorted(snapshot_conids, conids).clip(max=len(snapshot_conids) - 1)
+        found = snapshot_conids[lookup] == conids
+    else:
+        lookup = np.zeros(count, dtype=np.int64)
+        found = np.zeros(count, dtype=bool)
+        bid = ask = np.zeros(1)
+    priced = found & (buy | sell)
+    current_value = np.where(buy, ask[lookup], bid[lookup]) * quantity
+    pnl = np.where(buy, current_value - value, np.abs(value) - current_value)
+    return Valuation(current_value=current_value, pnl=pnl, priced=priced)
+
+
+def apply_pnl(positions: list[dict], snapshots: list[dict]) -> Valuation:
+    """
+    Value positions against market snapshots and write the PnL back onto each priced position whose
+    PnL has changed.
+    """
+    previous_pnl = np.fromiter(
+        (p.get("pnl", 0.0) for p in positions), dtype=np.float64, count=len(positions)
+    )
+    valuation = value_positions(positions, snapshots)
+    changed = valuation.priced & (valuation.pnl != previous_pnl)
+    pnl = valuation.pnl.tolist()
+    for index in np.flatnonzero(changed).tolist():
+        positions[index]["pnl"] = pnl[index]
+    return valuation._replace(changed=changed)
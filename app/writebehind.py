@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import logging
+import threading
+
+from app import config, storage
+
+logger = logging.getLogger(__name__)
+
+
+def apply_pnl(portfolio: dict, pnl: dict[str, float]) -> dict | None:
+    """
+    Set the PnL of a portfolio's positions from a dict keyed by position id. Returns the fields to
+    write, or None if none of the positions are left or their PnL is already up to date.
+    """
+    changed = False
+    for position in portfolio["positions"]:
+        if position["id"] in pnl and position.get("pnl") != pnl[position["id"]]:
+            position["pnl"] = pnl[position["id"]]
+            changed = True
+    return {"positions": portfolio["positions"]} if changed else None
+
+
+class PortfolioWriteBuffer:
+    """
+    Write-behind buffer for the PnL of portfolio positions.
+
+    PnL values are recorded per portfolio and position id. Repeated updates to a portfolio within
+    the flush window collapse into one, and pending updates are written together every
+    `flush_interval` seconds and on shutdown. Each write reads the portfolio again and only sets the PnL of the
+    positions that are still there and whose stored PnL differs, so it can't undo fills recorded in
+    the meantime and skips PnL another worker has already written. Reads in this process must go
+    through `overlay` so they see pending updates.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._dirty: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self.updates = 0
+        self.skipped = 0
+        self.writes = 0
+
+    def update(self, portfolio_id: str, pnl: dict[str, float]) -> None:
+        """
+        Record the PnL of positions of a portfolio, keyed by position id. Callers pass the PnL that
+        differs from the portfolio they read through `overlay`.
+        """
+        with self._lock:
+            self.updates += 1
+            pending = self._dirty.setdefault(portfolio_id, {})
+            if all(pending.get(position_id) == value for position_id, value in pnl.items()):
+                self.skipped += 1
+                if not pending:
+                    del self._dirty[portfolio_id]
+                return
+            pending.update(pnl)
+
+    def overlay(self, portfolio: dict) -> dict:
+        """
+        Apply any pending updates to a portfolio document that was read from storage.
+        """
+        with self._lock:
+            pending = self._dirty.get(portfolio["id"])
+            if pending:
+                apply_pnl(portfolio, pending)
+        return portfolio
+
+    def discard(self, portfolio_id: str) -> None:
+        """
+        Forget a portfolio, for example because it has been deleted.
+        """
+        with self._lock:
+            self._dirty.pop(portfolio_id, None)
+
+    @staticmethod
+    def _write(dirty: dict[str, dict[str, float]]) -> None:
+        storage.get_storage().modify_portfolios(
+            {
+                portfolio_id: functools.partial(apply_pnl, pnl=pnl)
+                for portfolio_id, pnl in dirty.items()
+            }
+        )
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            try:
+                await asyncio.to_thread(self._write, dirty)
+            except Exception:
+                # Put the updates back, without overwriting anything newer, and retry next flush
+                with self._lock:
+                    for portfolio_id, pnl in dirty.items():
+                        self._dirty[portfolio_id] = {**pnl, **self._dirty.get(portfolio_id, {})}
+                raise
+            self.writes += len(dirty)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush portfolio writes")
+
+    async def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "updates": self.updates,
+                "skipped": self.skipped,
+                "writes": self.writes,
+                "pending": len(self._dirty),
+            }
+
+
+portfolio_writes = PortfolioWriteBuffer(flush_interval=config.PORTFOLIO_FLUSH_SECONDS)
@@ -0,0 +1,79 @@
+"""
+Cold start of the production server: the wall time from launching `python main.py` until every
+worker answers its readiness probe, along with each worker's own import and startup times.
+
+    python -m benchmarks.coldstart --runs 5 --workers 1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import requests
+
+from benchmarks.fake_gateway import free_port
+from benchmarks.stats import summarise
+
+
+def cold_start(workers: int, timeout: float) -> tuple[float, list[dict]]:
+    port = free_port()
+    env = {**os.environ, "SERVER_PORT": str(port), "SERVER_WORKERS": str(workers)}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "main.py"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        workers_ready: dict[int, dict] = {}
+        while time.perf_counter() - start < timeout:
+            try:
+                response = requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=1)
+            except requests.ConnectionError:
+                time.sleep(0.01)
+                continue
+            if response.status_code == 200:
+                body = response.json()
+                workers_ready.setdefault(body["pid"], body["cold_start_seconds"])
+                if len(workers_ready) == workers:
+                    return time.perf_counter() - start, list(workers_ready.values())
+        raise RuntimeError(f"The server was not ready within {timeout} seconds")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    totals = []
+    reported = []
+    for _ in range(args.runs):
+        total, workers = cold_start(args.workers, args.timeout)
+        totals.append(total)
+        reported.extend(workers)
+    print(
+        json.dumps(
+            {
+                "benchmark": "coldstart",
+                "workers": args.workers,
+                "until_ready": summarise(totals, sum(totals)),
+                "worker_imports_ms": round(
+                    1000 * sum(w["imports"] for w in reported) / len(reported), 2
+                ),
+                "worker_startup_ms": round(
+                    1000 * sum(w["startup"] for w in reported) / len(reported), 2
+                ),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Latency and allocations of each endpoint, with the app running in-process on the memory storage
+backend and the stand-in gateway mounted as an ASGI transport, so no network or Firestore is needed.
+
+Every endpoint is first called `--requests` times for latency, then `--alloc-requests` more times
+with tracemalloc on, which is slow, so allocations are measured separately from latency.
+
+    python -m benchmarks.endpoints --requests 500 --positions 10 100 1000 --output results.json
+"""
+import argparse
+import os
+
+# The app reads its configuration on import
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["MATCHING_ENABLED"] = "false"
+
+import asyncio
+import collections
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+import httpx
+
+from app import storage
+from app.gateway import gateway
+from benchmarks.fake_gateway import create_app
+from benchmarks.stats import summarise
+from main import app
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+
+def seed(db: storage.Storage, symbol_count: int) -> list[dict]:
+    symbols = [
+        {"symbol": f"SYM{number}", "company_name": f"Company {number}", "conid": 1000 + number}
+        for number in range(symbol_count)
+    ]
+    db.load({"symbols": symbols})
+    return symbols
+
+
+def positions_for(symbols: list[dict], count: int, rng: random.Random) -> list[dict]:
+    positions = []
+    for number in range(count):
+        symbol = symbols[number % len(symbols)]
+        quantity = rng.randint(1, 500)
+        side = rng.choice(["BUY", "SELL"])
+        value = quantity * rng.uniform(10, 500)
+        positions.append(
+            {
+                "symbol": symbol["symbol"],
+                "quantity": quantity,
+                "side": side,
+                "value": value if side == "BUY" else -value,
+                "conid": symbol["conid"],
+                "pnl": 0.0,
+                "id": str(number),
+            }
+        )
+    return positions
+
+
+async def measure(client: httpx.AsyncClient, request, total: int, alloc_total: int) -> dict:
+    statuses = collections.Counter()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(total):
+        request_start = time.perf_counter()
+        response = await request(client)
+        latencies.append(time.perf_counter() - request_start)
+        statuses[response.status_code] += 1
+    result = summarise(latencies, time.perf_counter() - start)
+    peaks = []
+    retained = 0
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_total):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await request(client)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained += after - before
+    finally:
+        tracemalloc.stop()
+    if alloc_total:
+        result["alloc_peak_kib"] = round(sum(peaks) / alloc_total / 1024, 2)
+        result["alloc_retained_kib"] = round(retained / alloc_total / 1024, 2)
+    result["statuses"] = {str(status): count for status, count in sorted(statuses.items())}
+    return result
+
+
+async def benchmark(args) -> dict:
+    rng = random.Random(args.seed)
+    db = storage.get_storage()
+    symbols = seed(db, args.symbols)
+    gateway.base_url = "http://gateway"
+    gateway.transport = httpx.ASGITransport(app=create_app(hmds_bar_count=args.hmds_bars))
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://app"
+    ) as client:
+        await client.post(
+            "/signup",
+            data={"email": "benchmark@example.com", "username": USERNAME, "password": PASSWORD},
+        )
+        response = await client.post(
+            "/token", data={"username": USERNAME, "password": PASSWORD}
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        portfolio_ids = {}
+        for count in args.positions:
+            response = await client.post(
+                "/portfolio", data={"portfolio_name": f"{count} positions"}, headers=headers
+            )
+            portfolio_ids[count] = response.json()["id"]
+            db.update_portfolio(
+                portfolio_ids[count], {"positions": positions_for(symbols, count, rng)}
+            )
+        order_portfolio_id = portfolio_ids[args.positions[0]]
+        # One point a minute, ending now
+        now = int(time.time() * 1000)
+        db.append_equity_points(
+            {
+                order_portfolio_id: [
+                    {"t": now - minute * 60_000, "value": 10_000 + minute, "pnl": minute}
+                    for minute in range(args.equity_points)
+                ]
+            }
+        )
+
+        endpoints = {
+            "POST /token": lambda c: c.post(
+                "/token", data={"username": USERNAME, "password": PASSWORD}
+            ),
+            "GET /users/me/": lambda c: c.get("/users/me/", headers=headers),
+        }
+        for count, portfolio_id in portfolio_ids.items():
+            endpoints[f"GET /portfolio ({count} positions)"] = (
+                lambda c, portfolio_id=portfolio_id: c.get(
+                    "/portfolio", params={"id": portfolio_id}, headers=headers
+                )
+            )
+        endpoints["GET /portfolio/history"] = lambda c: c.get(
+            "/portfolio/history",
+            params={"id": order_portfolio_id, "points": 500},
+            headers=headers,
+        )
+        endpoints["POST /order"] = lambda c: c.post(
+            "/order",
+            params={"id": order_portfolio_id},
+            data={
+                "symbol": rng.choice(symbols)["symbol"],
+                "quantity": rng.randint(1, 100),
+                "side": rng.choice(["BUY", "SELL"]),
+                "order_type": "MKT",
+            },
+            headers=headers,
+        )
+        endpoints["GET /symbols"] = lambda c: c.get("/symbols")
+        endpoints["GET /symbols/hmds"] = lambda c: c.get(
+            "/symbols/hmds",
+            params={"symbol": rng.choice(symbols[:10])["symbol"]},
+            headers=headers,
+        )
+
+        results = {}
+        for name, request in endpoints.items():
+            # /token is dominated by password hashing, so don't spend the full budget on it
+            total = min(args.requests, 50) if name == "POST /token" else args.requests
+            alloc_total = min(args.alloc_requests, total)
+            await request(client)
+            results[name] = await measure(client, request, total, alloc_total)
+        return results
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--alloc-requests", type=int, default=50)
+    parser.add_argument("--positions", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--hmds-bars", type=int, default=390)
+    parser.add_argument("--equity-points", type=int, default=525_600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(benchmark(args))
+    report = json.dumps(
+        {
+            "benchmark": "endpoints",
+            "commit": current_commit(),
+            "requests": args.requests,
+            "results": results,
+        },
+        indent=2,
+    )
+    print(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
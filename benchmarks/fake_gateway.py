@@ -0,0 +1,126 @@
+"""
+Local stand-in for the CPAPI gateway, serving deterministic /snapshot and /hmds responses.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+HMDS_BAR_SECONDS = 60
+
+
+def snapshot_for(conid: int) -> dict:
+    price = 50 + conid % 450 + random.random()
+    return {
+        "conid": conid,
+        "bid_price": round(price - 0.01, 2),
+        "ask_price": round(price + 0.01, 2),
+    }
+
+
+def hmds_bars(symbol: str, count: int, start: int | None = None) -> list[dict]:
+    now = int(time.time()) // HMDS_BAR_SECONDS * HMDS_BAR_SECONDS
+    first = now - (count - 1) * HMDS_BAR_SECONDS
+    if start is not None:
+        first = max(first, start)
+    base = 50 + sum(map(ord, symbol)) % 450
+    return [
+        {
+            "t": t * 1000,
+            "o": base,
+            "h": base + 1,
+            "l": base - 1,
+            "c": base + 0.5,
+            "v": 1000,
+        }
+        for t in range(first, now + 1, HMDS_BAR_SECONDS)
+    ]
+
+
+def create_app(
+    latency: float = 0.0, error_rate: float = 0.0, hmds_bar_count: int = 390
+) -> Starlette:
+    """
+    Create the gateway app. Every response is delayed by `latency` seconds, and a fraction
+    `error_rate` of requests fail with a 500.
+    """
+    stats = {"snapshot": 0, "hmds": 0}
+
+    async def respond(content) -> JSONResponse:
+        if latency:
+            await asyncio.sleep(latency)
+        if error_rate and random.random() < error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return JSONResponse(content)
+
+    async def snapshot(request: Request):
+        stats["snapshot"] += 1
+        conids = request.query_params.get("conids", "")
+        return await respond(
+            [snapshot_for(int(conid)) for conid in conids.split(",") if conid]
+        )
+
+    async def hmds(request: Request):
+        stats["hmds"] += 1
+        symbol = request.query_params.get("symbol", "")
+        start = request.query_params.get("start")
+        return await respond(
+            hmds_bars(symbol, hmds_bar_count, int(start) // 1000 if start else None)
+        )
+
+    app = Starlette(
+        routes=[Route("/snapshot", snapshot), Route("/hmds", hmds)],
+    )
+    app.state.stats = stats
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeGatewayServer:
+    """
+    Run the stand-in gateway with uvicorn in a background thread for the duration of a `with` block.
+    """
+
+    def __init__(self, port: int | None = None, **app_options):
+        self.app = create_app(**app_options)
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(
+            uvicorn.Config(self.app, port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "FakeGatewayServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(latency=args.latency, error_rate=args.error_rate),
+        port=args.port,
+    )
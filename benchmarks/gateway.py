@@ -0,0 +1,88 @@
+"""
+Compare a fresh `requests.get` per call, which is how the routers used to call CPAPI, with the pooled
+GatewayClient, both against the local stand-in gateway.
+
+    python -m benchmarks.gateway --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import requests
+
+from app.gateway import GatewayClient
+from benchmarks.fake_gateway import FakeGatewayServer
+from benchmarks.stats import summarise
+
+CONIDS = [265598, 272093, 8314, 4815747, 76792991]
+
+
+async def run(call, total: int, concurrency: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_call():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed_call() for _ in range(total)))
+    return summarise(latencies, time.perf_counter() - start)
+
+
+async def benchmark(base_url: str, total: int, concurrency: int) -> dict:
+    params = {"conids": ",".join(str(conid) for conid in CONIDS)}
+
+    def unpooled_snapshot():
+        response = requests.get(f"{base_url}/snapshot", params=params, verify=False)
+        response.raise_for_status()
+        return response.json()
+
+    async def unpooled():
+        # Run in a thread so the baseline isn't also penalised for blocking the loop
+        await asyncio.to_thread(unpooled_snapshot)
+
+    client = GatewayClient(
+        base_url=base_url,
+        timeout=5,
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+    )
+
+    async def pooled():
+        await client.snapshot(CONIDS)
+
+    try:
+        return {
+            "unpooled": await run(unpooled, total, concurrency),
+            "pooled": await run(pooled, total, concurrency),
+        }
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    with FakeGatewayServer(latency=args.latency) as server:
+        results = asyncio.run(benchmark(server.url, args.requests, args.concurrency))
+    print(
+        json.dumps(
+            {
+                "benchmark": "gateway",
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput of the matching engine against a synthetic quote stream. The books are seeded with
+resting limit orders around each symbol's starting price, then quotes random-walk and each tick
+matches a batch of them. Filled orders are replaced so the number of resting orders stays constant.
+
+    python -m benchmarks.matching --orders 200000 --symbols 2000 --ticks 200
+"""
+import argparse
+import json
+import random
+import time
+
+from app.matching import MatchingEngine
+from benchmarks.stats import summarise
+
+
+def make_order(rng: random.Random, number: int, symbol: str, price: float) -> dict:
+    side = rng.choice(["BUY", "SELL"])
+    # Rest limits a little away from the market so only some fill as prices move
+    offset = rng.uniform(0.001, 0.05) * price
+    return {
+        "id": str(number),
+        "portfolio_id": "benchmark",
+        "symbol": symbol,
+        "quantity": rng.randint(1, 100),
+        "side": side,
+        "order_type": "LMT",
+        "limit_price": price - offset if side == "BUY" else price + offset,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--quotes-per-tick", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    prices = {symbol: rng.uniform(10, 500) for symbol in symbols}
+    engine = MatchingEngine()
+    start = time.perf_counter()
+    for number in range(args.orders):
+        symbol = rng.choice(symbols)
+        engine.add(make_order(rng, number, symbol, prices[symbol]))
+    load_seconds = time.perf_counter() - start
+    next_number = args.orders
+    latencies = []
+    quotes_matched = 0
+    fills = 0
+    for _ in range(args.ticks):
+        quotes = {}
+        for symbol in rng.sample(symbols, min(args.quotes_per_tick, len(symbols))):
+            prices[symbol] *= 1 + rng.gauss(0, 0.01)
+            quotes[symbol] = (prices[symbol] * 0.9995, prices[symbol] * 1.0005)
+        tick_start = time.perf_counter()
+        tick_fills = engine.match(quotes)
+        latencies.append(time.perf_counter() - tick_start)
+        quotes_matched += len(quotes)
+        fills += len(tick_fills)
+        for fill in tick_fills:
+            symbol = fill.order["symbol"]
+            engine.add(make_order(rng, next_number, symbol, prices[symbol]))
+            next_number += 1
+    match_seconds = sum(latencies)
+    print(
+        json.dumps(
+            {
+                "benchmark": "matching",
+                "resting_orders": len(engine.orders),
+                "symbols": args.symbols,
+                "load_orders_per_second": round(args.orders / load_seconds),
+                "tick": summarise(latencies, match_seconds),
+                "quotes_per_second": round(quotes_matched / match_seconds),
+                "fills": fills,
+                "fills_per_second": round(fills / match_seconds),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
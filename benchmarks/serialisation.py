@@ -0,0 +1,130 @@
+"""
+Time to serialise a GET /portfolio and a GET /symbols/hmds response, through FastAPI's default path
+(validation against the response model, jsonable_encoder and the standard library's json) and
+through the fast path the endpoints use (orjson, without validating data the app built itself).
+
+    python -m benchmarks.serialisation --positions 100 1000 10000 --bars 390 5000
+"""
+import argparse
+import os
+
+# The app reads its configuration on import
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import asyncio
+import json
+import random
+import time
+import fastapi
+from fastapi.routing import serialize_response
+
+from app import routers
+from benchmarks.endpoints import positions_for
+from benchmarks.fake_gateway import hmds_bars
+from benchmarks.stats import summarise
+from main import app
+
+
+def response_field(path: str):
+    route = next(
+        route
+        for route in app.routes
+        if isinstance(route, fastapi.routing.APIRoute)
+        and route.path == path
+        and "GET" in route.methods
+    )
+    return route.secure_cloned_response_field
+
+
+async def default_path(field, content) -> bytes:
+    serialised = await serialize_response(field=field, response_content=content)
+    return fastapi.responses.JSONResponse(serialised).body
+
+
+async def fast_path(build_response) -> bytes:
+    return build_response().body
+
+
+async def time_path(serialise, runs: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(runs):
+        call_start = time.perf_counter()
+        await serialise()
+        latencies.append(time.perf_counter() - call_start)
+    return summarise(latencies, time.perf_counter() - start)
+
+
+def portfolio_with(positions: int, rng: random.Random) -> dict:
+    symbols = [
+        {"symbol": f"SYM{number}", "conid": 1000 + number} for number in range(max(positions, 1))
+    ]
+    portfolio_id = "benchmark"
+    orders = [
+        {
+            "symbol": "SYM0",
+            "quantity": 1.0,
+            "portfolio_id": portfolio_id,
+            "side": "BUY",
+            "order_type": "MKT",
+            "created_at": "2023-05-01 14:30:00.000000",
+            "id": str(number),
+            "status": "OPEN",
+            "conid": 1000,
+        }
+        for number in range(10)
+    ]
+    return {
+        "name": "benchmark",
+        "owner_id": "benchmark",
+        "id": portfolio_id,
+        "is_public": False,
+        "positions": positions_for(symbols, positions, rng),
+        "orders": orders,
+    }
+
+
+async def benchmark(args) -> dict:
+    rng = random.Random(args.seed)
+    results = {}
+    portfolio_field = response_field("/portfolio")
+    for count in args.positions:
+        portfolio = portfolio_with(count, rng)
+        results[f"GET /portfolio ({count} positions)"] = {
+            "default": await time_path(
+                lambda: default_path(portfolio_field, portfolio), args.runs
+            ),
+            "fast": await time_path(
+                lambda: fast_path(lambda: routers.portfolio_response(portfolio)), args.runs
+            ),
+        }
+    hmds_field = response_field("/symbols/hmds")
+    for count in args.bars:
+        bars = hmds_bars("SYM0", count)
+        results[f"GET /symbols/hmds ({count} bars)"] = {
+            "default": await time_path(lambda: default_path(hmds_field, bars), args.runs),
+            "fast": await time_path(
+                lambda: fast_path(lambda: fastapi.responses.ORJSONResponse(bars)), args.runs
+            ),
+        }
+    for result in results.values():
+        result["speedup"] = round(result["default"]["p50_ms"] / result["fast"]["p50_ms"], 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--positions", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--bars", type=int, nargs="+", default=[390, 5000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = asyncio.run(benchmark(args))
+    print(json.dumps({"benchmark": "serialisation", "runs": args.runs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
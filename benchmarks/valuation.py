@@ -0,0 +1,92 @@
+"""
+Compare the vectorised valuation engine with the nested loop get_portfolio used to run, at several
+portfolio sizes.
+
+    python -m benchmarks.valuation --sizes 10 1000 100000
+"""
+import argparse
+import copy
+import json
+import random
+import time
+
+from app import valuation
+from benchmarks.stats import summarise
+
+# The nested loop is O(positions x snapshots), so skip it where it would take minutes
+MAX_LEGACY_COMPARISONS = 20_000_000
+
+
+def legacy_apply_pnl(positions: list[dict], snapshots: list[dict]) -> None:
+    for position in positions:
+        for snapshot in snapshots:
+            if not position["conid"] == snapshot["conid"]:
+                continue
+            side = position["side"]
+            value = position["value"]
+            if side == "BUY":
+                current_value = snapshot["ask_price"] * position["quantity"]
+                position["pnl"] = current_value - value
+            elif side == "SELL":
+                current_value = snapshot["bid_price"] * position["quantity"]
+                position["pnl"] = abs(value) - current_value
+
+
+def generate(size: int, seed: int = 0) -> tuple[list[dict], list[dict]]:
+    rng = random.Random(seed)
+    universe = list(range(1, min(size, 5000) + 1))
+    positions = []
+    for _ in range(size):
+        quantity = rng.randint(1, 500)
+        price = rng.uniform(10, 500)
+        side = rng.choice(["BUY", "SELL"])
+        positions.append(
+            {
+                "symbol": "SYM",
+                "quantity": quantity,
+                "side": side,
+                "value": price * quantity * (1 if side == "BUY" else -1),
+                "conid": rng.choice(universe),
+                "pnl": 0.0,
+            }
+        )
+    snapshots = []
+    for conid in sorted({position["conid"] for position in positions}):
+        price = rng.uniform(10, 500)
+        snapshots.append({"conid": conid, "bid_price": price - 0.01, "ask_price": price + 0.01})
+    return positions, snapshots
+
+
+def time_runs(function, positions: list[dict], snapshots: list[dict], repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        batch = copy.deepcopy(positions)
+        start = time.perf_counter()
+        function(batch, snapshots)
+        latencies.append(time.perf_counter() - start)
+    return summarise(latencies, sum(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    results = {}
+    for size in args.sizes:
+        positions, snapshots = generate(size)
+        result = {
+            "snapshots": len(snapshots),
+            "vectorised": time_runs(valuation.apply_pnl, positions, snapshots, args.repeat),
+            "nested_loop": None,
+        }
+        if size * len(snapshots) <= MAX_LEGACY_COMPARISONS:
+            result["nested_loop"] = time_runs(
+                legacy_apply_pnl, positions, snapshots, args.repeat
+            )
+        results[str(size)] = result
+    print(json.dumps({"benchmark": "valuation", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Weighted load-test scenarios against users seeded by `loadtests.seed`:
+
+- ChurnUser signs up new users and logs in with them
+- PortfolioReader logs in once and keeps reading its portfolio
+- OrderTrader places bursts of orders, lists them and cancels some
+- ChartViewer searches symbols and loads historical market data charts
+
+Run it through `python -m loadtests.run`, which also starts the app and the stand-in gateway, or
+directly against a running app:
+
+    locust -f loadtests/locustfile.py --headless -u 200 -r 50 -t 60s -H http://localhost:8000
+"""
+import json
+import random
+import uuid
+from locust import HttpUser, between, events, task
+
+from loadtests.seed import PASSWORD, username
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    parser.add_argument("--seed-users", type=int, default=1000, help="Number of seeded users")
+    parser.add_argument("--seed-symbols", type=int, default=500, help="Number of seeded symbols")
+    parser.add_argument("--order-burst", type=int, default=10, help="Orders per burst")
+    parser.add_argument("--report-path", default=None, help="Write a JSON report to this file")
+
+
+def report(environment) -> dict:
+    """
+    Latency percentiles and throughput for each endpoint and for all requests together.
+    """
+
+    def summarise(entry) -> dict:
+        return {
+            "count": entry.num_requests,
+            "failures": entry.num_failures,
+            "mean_ms": round(entry.avg_response_time, 2),
+            "p50_ms": entry.get_response_time_percentile(0.50),
+            "p95_ms": entry.get_response_time_percentile(0.95),
+            "p99_ms": entry.get_response_time_percentile(0.99),
+            "throughput_rps": round(entry.total_rps, 2),
+        }
+
+    stats = environment.stats
+    return {
+        "benchmark": "load",
+        "endpoints": {
+            f"{method} {name}": summarise(entry)
+            for (name, method), entry in sorted(stats.entries.items())
+        },
+        "total": summarise(stats.total),
+    }
+
+
+@events.quitting.add_listener
+def write_report(environment, **kwargs):
+    if environment.parsed_options is None or not environment.parsed_options.report_path:
+        return
+    with open(environment.parsed_options.report_path, "w") as report_file:
+        json.dump(report(environment), report_file, indent=2)
+
+
+class SeededUser(HttpUser):
+    abstract = True
+    wait_time = between(0.5, 2)
+
+    def on_start(self):
+        options = self.environment.parsed_options
+        self.username = username(random.randrange(options.seed_users))
+        self.symbols = [f"SYM{number}" for number in range(options.seed_symbols)]
+        self.portfolio_id = None
+        self.login()
+
+    def login(self):
+        response = self.client.post(
+            "/token", data={"username": self.username, "password": PASSWORD}
+        )
+        if response.status_code != 200:
+            return
+        token = response.json()["access_token"]
+        self.client.headers.update({"Authorization": f"Bearer {token}"})
+        user = self.client.get("/users/me/").json()
+        if user.get("portfolios"):
+            self.portfolio_id = user["portfolios"][0]["id"]
+
+
+class ChurnUser(HttpUser):
+    weight = 1
+    wait_time = between(1, 3)
+
+    @task
+    def signup_and_login(self):
+        new_username = f"churn-{uuid.uuid4().hex}"
+        password = uuid.uuid4().hex
+        self.client.post(
+            "/signup",
+            data={
+                "email": f"{new_username}@example.com",
+                "username": new_username,
+                "password": password,
+            },
+        )
+        response = self.client.post(
+            "/token", data={"username": new_username, "password": password}
+        )
+        if response.status_code == 200:
+            token = response.json()["access_token"]
+            self.client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+
+
+class PortfolioReader(SeededUser):
+    weight = 5
+
+    @task(5)
+    def read_portfolio(self):
+        if self.portfolio_id is not None:
+            self.client.get("/portfolio", params={"id": self.portfolio_id}, name="/portfolio")
+
+    @task(2)
+    def read_user(self):
+        self.client.get("/users/me/")
+
+    @task(1)
+    def read_symbols(self):
+        self.client.get("/symbols")
+
+
+class OrderTrader(SeededUser):
+    weight = 2
+
+    @task(3)
+    def order_burst(self):
+        if self.portfolio_id is None:
+            return
+        order_ids = []
+        for _ in range(self.environment.parsed_options.order_burst):
+            order = {
+                "symbol": random.choice(self.symbols),
+                "quantity": random.randint(1, 100),
+                "side": random.choice(["BUY", "SELL"]),
+                "order_type": random.choice(["MKT", "LMT"]),
+                "limit_price": random.uniform(10, 500),
+            }
+            response = self.client.post(
+                "/order", params={"id": self.portfolio_id}, data=order, name="/order"
+            )
+            if response.status_code == 200:
+                order_ids.append(response.json()["id"])
+        # Cancel a few, as traders do; filled orders can't be cancelled
+        for order_id in random.sample(order_ids, len(order_ids) // 4):
+            with self.client.delete(
+                "/order", params={"id": order_id}, name="/order", catch_response=True
+            ) as response:
+                if response.status_code in (204, 400):
+                    response.success()
+
+    @task(1)
+    def list_orders(self):
+        if self.portfolio_id is not None:
+            self.client.get(
+                "/orders", params={"portfolio_id": self.portfolio_id, "limit": 50}, name="/orders"
+            )
+
+
+class ChartViewer(SeededUser):
+    weight = 2
+
+    @task(3)
+    def view_chart(self):
+        self.client.get(
+            "/symbols/hmds", params={"symbol": random.choice(self.symbols)}, name="/symbols/hmds"
+        )
+
+    @task(1)
+    def search_symbols(self):
+        self.client.get(
+            "/symbols/search",
+            params={"q": random.choice(self.symbols)[:4]},
+            name="/symbols/search",
+        )
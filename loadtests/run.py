@@ -0,0 +1,110 @@
+"""
+Run the load test end to end: seed the memory storage backend with synthetic users, start the
+stand-in CPAPI gateway with the requested latency and error rate, serve the app against both with
+uvicorn, then drive it with the Locust scenarios in `loadtests/locustfile.py` and print a JSON
+report of p50/p95/p99 latency and throughput per endpoint.
+
+    python -m loadtests.run --users 200 --spawn-rate 50 --run-time 60s --gateway-latency 0.05
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+from benchmarks.fake_gateway import FakeGatewayServer, free_port
+from loadtests.seed import build_seed
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The app exited before it was ready")
+        try:
+            if requests.get(f"{url}/health/ready", timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The app did not start within {timeout} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100, help="Concurrent Locust users")
+    parser.add_argument("--spawn-rate", type=float, default=20)
+    parser.add_argument("--run-time", default="60s")
+    parser.add_argument("--seed-users", type=int, default=1000)
+    parser.add_argument("--seed-symbols", type=int, default=500)
+    parser.add_argument("--positions", type=int, default=20)
+    parser.add_argument("--order-burst", type=int, default=10)
+    parser.add_argument("--gateway-latency", type=float, default=0.0)
+    parser.add_argument("--gateway-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        seed_path = os.path.join(directory, "seed.json")
+        report_path = args.output or os.path.join(directory, "report.json")
+        with open(seed_path, "w") as seed_file:
+            json.dump(
+                build_seed(args.seed_users, args.seed_symbols, args.positions), seed_file
+            )
+        with FakeGatewayServer(
+            latency=args.gateway_latency, error_rate=args.gateway_error_rate
+        ) as gateway:
+            port = free_port()
+            app_url = f"http://127.0.0.1:{port}"
+            env = {
+                **os.environ,
+                "STORAGE_BACKEND": "memory",
+                "STORAGE_SEED_PATH": seed_path,
+                "CPAPI_BASE_URL": gateway.url,
+            }
+            app = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "main:app",
+                    "--port", str(port), "--log-level", "warning", "--no-access-log",
+                ],
+                env=env,
+            )
+            try:
+                wait_until_ready(app_url, app)
+                subprocess.run(
+                    [
+                        sys.executable, "-m", "locust",
+                        "-f", os.path.join(os.path.dirname(__file__), "locustfile.py"),
+                        "--headless", "--only-summary",
+                        "--users", str(args.users),
+                        "--spawn-rate", str(args.spawn_rate),
+                        "--run-time", args.run_time,
+                        "--host", app_url,
+                        "--seed-users", str(args.seed_users),
+                        "--seed-symbols", str(args.seed_symbols),
+                        "--order-burst", str(args.order_burst),
+                        "--report-path", report_path,
+                    ],
+                    check=False,
+                )
+            finally:
+                app.terminate()
+                app.wait()
+            gateway_calls = dict(gateway.app.state.stats)
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+    report["gateway"] = {
+        "latency": args.gateway_latency,
+        "error_rate": args.gateway_error_rate,
+        "calls": gateway_calls,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Generate a seed file for the memory storage backend with many synthetic users, each owning one
+portfolio with some open positions. Every user has the same password, so it is only hashed once.
+
+    python -m loadtests.seed --users 1000 --output seed.json
+"""
+import argparse
+import json
+import random
+
+from app import models
+from app.hashing import get_password_hash
+
+USERNAME_PREFIX = "loaduser"
+PASSWORD = "loadtest"
+
+
+def username(number: int) -> str:
+    return f"{USERNAME_PREFIX}{number}"
+
+
+def symbols(count: int) -> list[dict]:
+    return [
+        {"symbol": f"SYM{number}", "company_name": f"Company {number}", "conid": 1000 + number}
+        for number in range(count)
+    ]
+
+
+def build_seed(
+    user_count: int, symbol_count: int, positions_per_portfolio: int, seed: int = 0
+) -> dict[str, list[dict]]:
+    rng = random.Random(seed)
+    hashed_password = get_password_hash(PASSWORD)
+    seed_symbols = symbols(symbol_count)
+    users = []
+    portfolios = []
+    for number in range(user_count):
+        user = models.UserInDB(
+            username=username(number),
+            email=f"{username(number)}@example.com",
+            hashed_password=hashed_password,
+        )
+        positions = []
+        for symbol in rng.sample(seed_symbols, min(positions_per_portfolio, symbol_count)):
+            quantity = rng.randint(1, 500)
+            side = rng.choice(["BUY", "SELL"])
+            value = quantity * rng.uniform(10, 500)
+            positions.append(
+                models.Position(
+                    symbol=symbol["symbol"],
+                    quantity=quantity,
+                    side=side,
+                    value=value if side == "BUY" else -value,
+                    conid=symbol["conid"],
+                ).dict()
+            )
+        portfolio = models.Portfolio(name="Main", owner_id=user.id, positions=positions)
+        user.portfolios = [{"id": portfolio.id, "name": portfolio.name}]
+        users.append(user.dict())
+        portfolios.append(portfolio.dict())
+    return {"users": users, "portfolios": portfolios, "symbols": seed_symbols}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--positions", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="seed.json")
+    args = parser.parse_args()
+    with open(args.output, "w") as seed_file:
+        json.dump(build_seed(args.users, args.symbols, args.positions, args.seed), seed_file)
+
+
+if __name__ == "__main__":
+    main()
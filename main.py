@@ -1,15 +1,154 @@
+import time
+
+# Taken before the app is imported so cold starts include import time
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import contextlib
+import copy
+import importlib.util
+import logging
+import logging.config
+import os
 import fastapi
 import uvicorn
-from app import routers
+import uvicorn.supervisors
+from app import config, metrics, profiling, routers, storage
+from app.deletion import portfolio_deleter
+from app.equity import equity_curves
+from app.gateway import gateway
+from app.hashing import password_hasher
+from app.health import DrainingServer, readiness
+from app.matching import matching_service
+from app.symbols import symbols_snapshot
+from app.tokens import token_versions
+from app.writebehind import portfolio_writes
 from fastapi.middleware import cors
 
-app = fastapi.FastAPI()
+logger = logging.getLogger(__name__)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    """
+    Start the background components in each worker process, after it has been forked, and stop them
+    once the server has finished the requests in flight.
+    """
+    startup_started = time.perf_counter()
+    async with contextlib.AsyncExitStack() as stack:
+        # Components are stopped in the reverse order they were started, including when a later
+        # one fails to start
+        stack.callback(metrics.mark_process_dead)
+        stack.callback(password_hasher.shutdown)
+        stack.push_async_callback(gateway.close)
+        # Create the storage client here rather than at import, so it is never shared across a fork
+        await asyncio.to_thread(storage.get_storage)
+        # The write buffers start first so they stop last, flushing what the others left behind
+        # before the clients they need are closed
+        for component in (
+            token_versions,
+            portfolio_writes,
+            equity_curves,
+            symbols_snapshot,
+            matching_service,
+            portfolio_deleter,
+        ):
+            await component.start()
+            stack.push_async_callback(component.stop)
+        readiness.mark_ready(
+            imports=startup_started - IMPORT_STARTED,
+            startup=time.perf_counter() - startup_started,
+        )
+        yield
+
+
+# orjson serialises responses several times faster than the standard library's json
+app = fastapi.FastAPI(lifespan=lifespan, default_response_class=fastapi.responses.ORJSONResponse)
 app.add_middleware(cors.CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+if config.PROFILING_DIR:
+    app.add_middleware(
+        profiling.ProfilingMiddleware,
+        directory=config.PROFILING_DIR,
+        token=config.PROFILING_TOKEN,
+        sample_rate=config.PROFILING_SAMPLE_RATE,
+    )
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 app.include_router(routers.user_router)
 app.include_router(routers.portfolio_router)
 app.include_router(routers.orders_router)
 app.include_router(routers.symbols_router)
 
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    if not config.METRICS_ENABLED:
+        raise fastapi.HTTPException(status_code=404)
+    body, content_type = metrics.render()
+    return fastapi.Response(content=body, media_type=content_type)
+
+
+@app.get("/health/live", include_in_schema=False)
+def liveness():
+    return {"status": "live"}
+
+
+@app.get("/health/ready", include_in_schema=False)
+def readiness_probe():
+    """
+    200 while this worker is serving, 503 once it has been asked to exit and is draining.
+    """
+    if readiness.draining:
+        return fastapi.responses.JSONResponse({"status": "draining"}, status_code=503)
+    return {"status": "ready", "pid": os.getpid(), "cold_start_seconds": readiness.cold_start}
+
+
+if config.PROFILING_DIR:
+    profiling.instrument_routes(app)
+
+
+def serve() -> None:
+    """
+    Run the app in production: one worker process per CPU unless SERVER_WORKERS says otherwise, with
+    uvloop and httptools when they are installed. On SIGTERM each worker fails its readiness checks
+    for SERVER_DRAIN_SECONDS while still serving, then stops accepting connections, finishes the
+    requests in flight and runs its shutdown.
+    """
+    # Send the app's own logs, such as each worker's cold start time, through uvicorn's handler
+    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    for name in ("app", "main", "__main__"):
+        log_config["loggers"][name] = {"handlers": ["default"], "level": "INFO"}
+    logging.config.dictConfig(log_config)
+    workers = config.SERVER_WORKERS or os.cpu_count() or 1
+    if config.STORAGE_BACKEND == "memory" and workers > 1:
+        # Each worker would get its own copy of the data
+        logger.warning("The memory storage backend only supports one worker")
+        workers = 1
+    if workers > 1 and config.METRICS_ENABLED:
+        # Workers are spawned afresh, so they pick up the shared directory when they import
+        # prometheus_client and /metrics covers all of them rather than whichever one is scraped
+        metrics.prepare_multiprocess(config.METRICS_MULTIPROC_DIR)
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info("Starting %d worker(s) with the %s loop and %s parser", workers, loop, http)
+    server_config = uvicorn.Config(
+        # Several workers each import the app themselves; a single one can reuse this process's
+        "main:app" if workers > 1 else app,
+        host=config.SERVER_HOST,
+        port=config.SERVER_PORT,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=config.SERVER_KEEPALIVE_SECONDS,
+        log_config=log_config,
+    )
+    # As uvicorn.run, but with a server that drains before it shuts down
+    server = DrainingServer(server_config, drain_seconds=config.SERVER_DRAIN_SECONDS)
+    if workers > 1:
+        sock = server_config.bind_socket()
+        uvicorn.supervisors.Multiprocess(server_config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
-    
\ No newline at end of file
+    serve()
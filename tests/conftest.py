@@ -0,0 +1,62 @@
+import os
+
+# The app reads its configuration on import
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["MATCHING_ENABLED"] = "false"
+
+import fastapi.testclient
+import pytest
+
+import main
+from app import storage
+from app.storage.memory import MemoryStorage
+
+
+@pytest.fixture(params=["memory", "firestore"])
+def any_storage(request) -> storage.Storage:
+    """
+    A fresh storage backend of each kind. Firestore runs against the emulator, when there is one.
+    """
+    if request.param == "memory":
+        return MemoryStorage()
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        pytest.skip("FIRESTORE_EMULATOR_HOST is not set")
+    import google.cloud.firestore as firestore
+    from app.storage.firestore import FirestoreStorage
+
+    return FirestoreStorage(firestore.Client(project="paperhands-test"))
+
+
+@pytest.fixture
+def db(monkeypatch) -> MemoryStorage:
+    """
+    A fresh in-memory backend used by the app and the background services.
+    """
+    db = MemoryStorage()
+    monkeypatch.setitem(main.app.dependency_overrides, storage.get_storage, lambda: db)
+    monkeypatch.setattr(storage, "get_storage", lambda: db)
+    return db
+
+
+@pytest.fixture
+def client(db) -> fastapi.testclient.TestClient:
+    with fastapi.testclient.TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def sign_up(client):
+    def sign_up(username: str) -> dict:
+        """
+        Create a user and return the headers that authenticate as them.
+        """
+        client.post(
+            "/signup", data={"username": username, "password": "pw", "email": f"{username}@x.com"}
+        )
+        token = client.post("/token", data={"username": username, "password": "pw"}).json()
+        return {"Authorization": f"Bearer {token['access_token']}"}
+
+    return sign_up
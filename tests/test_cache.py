@@ -0,0 +1,49 @@
+from app import models
+from app.cache import UserCache, user_cache
+from app.routers import load_user
+
+
+def user() -> models.UserInDB:
+    return models.UserInDB(
+        id="u1",
+        username="alice",
+        email="a",
+        hashed_password="x",
+        portfolios=[{"id": "p1", "name": "P"}],
+    )
+
+
+class TestUserCache:
+    def test_changing_a_returned_user_leaves_the_cached_one_alone(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        cache.set(user())
+        cached = cache.get("alice")
+        cached.disabled = True
+        cached.portfolios.append({"id": "p2", "name": "Q"})
+        assert cache.get("alice") == user()
+
+    def test_changing_a_cached_user_after_setting_it_leaves_the_cache_alone(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        original = user()
+        cache.set(original)
+        original.portfolios.clear()
+        assert cache.get("alice").portfolios == [{"id": "p1", "name": "P"}]
+
+
+class TestUserUpdates:
+    def test_portfolio_changes_invalidate_the_cached_user(self, client, db, sign_up):
+        headers = sign_up("alice")
+        load_user(db, "alice")
+        assert user_cache.get("alice") is not None
+        client.post("/portfolio", data={"portfolio_name": "P"}, headers=headers)
+        assert user_cache.get("alice") is None
+        assert len(load_user(db, "alice").portfolios) == 1
+
+    def test_password_resets_invalidate_the_cached_user(self, client, db, sign_up):
+        sign_up("alice")
+        load_user(db, "alice")
+        client.post("/request-password-reset", data={"username": "alice"})
+        (reset_request,) = db.password_reset_requests.values()
+        client.post("/reset-password", data={"token": reset_request["token"], "password": "new"})
+        assert user_cache.get("alice") is None
+        assert load_user(db, "alice").token_version == 1
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app import models, storage
+from app.deletion import PortfolioDeleter
+
+
+def portfolio_with_orders(db: storage.Storage, count: int) -> dict:
+    portfolio = models.Portfolio(name="P", owner_id="u1").dict()
+    db.set_portfolio(portfolio)
+    db.set_orders(
+        [
+            models.Order(
+                symbol="AAPL",
+                quantity=1,
+                portfolio_id=portfolio["id"],
+                side="BUY",
+                order_type="MKT",
+            ).dict()
+            for _ in range(count)
+        ]
+    )
+    return portfolio
+
+
+async def start_and_finish(*deleters: PortfolioDeleter) -> None:
+    await asyncio.gather(*(deleter.start() for deleter in deleters))
+    await asyncio.gather(*(task for deleter in deleters for task in deleter._tasks.values()))
+
+
+def test_an_interrupted_deletion_is_resumed(db, monkeypatch):
+    portfolio = portfolio_with_orders(db, 10)
+    worker = PortfolioDeleter(chunk_size=3, lease=60)
+    job = models.PortfolioDeletion(
+        portfolio_id=portfolio["id"], owner_id="u1", claimed_by=worker.worker_id
+    ).dict()
+    db.set_deletion_job(job)
+    # The worker dies after deleting its first chunk of orders
+    delete_orders = db.delete_orders
+    chunks = []
+
+    def die_on_second_chunk(order_ids):
+        if chunks:
+            raise SystemExit
+        chunks.append(order_ids)
+        delete_orders(order_ids)
+
+    monkeypatch.setattr(db, "delete_orders", die_on_second_chunk)
+    with pytest.raises(SystemExit):
+        worker.delete(db, job)
+    monkeypatch.setattr(db, "delete_orders", delete_orders)
+    assert db.get_deletion_job(portfolio["id"])["status"] == "RUNNING"
+    # Its claim lapses, and the next worker to start finishes the job
+    db.update_deletion_job(portfolio["id"], {"claimed_until": time.time() - 1})
+    asyncio.run(start_and_finish(PortfolioDeleter(chunk_size=3, lease=60)))
+    job = db.get_deletion_job(portfolio["id"])
+    assert job["status"] == "DONE"
+    assert job["deleted_orders"] == 10
+    assert db.get_portfolio(portfolio["id"]) is None
+    assert db.list_orders(portfolio["id"], limit=10) == []
+
+
+def test_a_job_claimed_by_two_workers_runs_once(db, monkeypatch):
+    portfolio = portfolio_with_orders(db, 5)
+    db.set_deletion_job(
+        models.PortfolioDeletion(portfolio_id=portfolio["id"], owner_id="u1").dict()
+    )
+    runs = []
+    delete = PortfolioDeleter.delete
+
+    def record_run(self, db, job):
+        runs.append(self.worker_id)
+        delete(self, db, job)
+
+    monkeypatch.setattr(PortfolioDeleter, "delete", record_run)
+    asyncio.run(
+        start_and_finish(
+            PortfolioDeleter(chunk_size=2, lease=60), PortfolioDeleter(chunk_size=2, lease=60)
+        )
+    )
+    assert len(runs) == 1
+    assert db.get_deletion_job(portfolio["id"])["status"] == "DONE"
+
+
+def test_claims_are_exclusive_until_they_lapse(any_storage):
+    portfolio_id = str(uuid.uuid4())
+    any_storage.set_deletion_job(
+        models.PortfolioDeletion(portfolio_id=portfolio_id, owner_id="u1").dict()
+    )
+    now = time.time()
+    assert any_storage.claim_deletion_job(portfolio_id, "a", now + 60, now) is not None
+    assert any_storage.claim_deletion_job(portfolio_id, "b", now + 60, now) is None
+    assert any_storage.claim_deletion_job(portfolio_id, "b", now + 120, now + 61) is not None
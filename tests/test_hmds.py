@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+
+from app.hmds import HistoricalDataStore
+from app.storage.memory import MemoryStorage
+
+
+class FakeGateway:
+    def __init__(self, payload):
+        self.payload = payload
+        self.requests = []
+
+    async def hmds(self, symbol: str, **params) -> httpx.Response:
+        self.requests.append((symbol, params))
+        return httpx.Response(200, json=self.payload)
+
+
+def store_for(gateway: FakeGateway) -> HistoricalDataStore:
+    return HistoricalDataStore(gateway=gateway, maxsize=10, refresh_interval=60, max_bars=100)
+
+
+def test_bars_under_a_data_key_are_unwrapped_and_stored():
+    db = MemoryStorage()
+    gateway = FakeGateway({"symbol": "AAPL", "data": [{"t": 2, "c": 11.0}, {"t": 1, "c": 10.0}]})
+    store = store_for(gateway)
+    bars = asyncio.run(store.get(db, "AAPL"))
+    assert bars == [{"t": 1, "c": 10.0}, {"t": 2, "c": 11.0}]
+    assert db.get_hmds("AAPL")["bars"] == bars
+
+
+def test_unknown_payloads_are_passed_through_without_being_stored():
+    db = MemoryStorage()
+    payload = {"error": None, "points": [[1, 10.0]]}
+    gateway = FakeGateway(payload)
+    store = store_for(gateway)
+    assert asyncio.run(store.get(db, "AAPL")) == payload
+    assert db.get_hmds("AAPL") is None
+    asyncio.run(store.get(db, "AAPL"))
+    assert len(gateway.requests) == 2
+
+
+def test_stored_bars_are_served_when_the_gateway_payload_is_unknown():
+    db = MemoryStorage()
+    db.set_hmds("AAPL", {"symbol": "AAPL", "bars": [{"t": 1, "c": 10.0}], "updated_at": 0})
+    gateway = FakeGateway({"unexpected": True})
+    store = store_for(gateway)
+    assert asyncio.run(store.get(db, "AAPL")) == [{"t": 1, "c": 10.0}]
+    assert gateway.requests == [("AAPL", {"start": 1})]
@@ -0,0 +1,171 @@
+import pytest
+
+from app.matching import Fill, MatchingEngine, MatchingService, apply_fill
+from app.storage.memory import MemoryStorage
+
+
+def order(id, side="BUY", order_type="LMT", limit_price=100.0, quantity=10, symbol="AAPL"):
+    return {
+        "id": id,
+        "symbol": symbol,
+        "side": side,
+        "order_type": order_type,
+        "limit_price": limit_price,
+        "quantity": quantity,
+        "portfolio_id": "p1",
+        "status": "OPEN",
+        "created_at": f"2023-05-01 00:00:{id}",
+    }
+
+
+def position(quantity, side="BUY", value=1000.0):
+    return {
+        "symbol": "AAPL",
+        "quantity": quantity,
+        "side": side,
+        "value": value,
+        "conid": 1,
+        "pnl": 0.0,
+        "id": "pos",
+    }
+
+
+class TestApplyFill:
+    def test_opens_a_new_position(self):
+        positions = []
+        apply_fill(positions, order("1", quantity=5), conid=1, price=20.0)
+        assert len(positions) == 1
+        assert positions[0]["quantity"] == 5
+        assert positions[0]["side"] == "BUY"
+        assert positions[0]["value"] == 100.0
+
+    def test_adds_to_a_position_on_the_same_side(self):
+        positions = [position(10)]
+        apply_fill(positions, order("1", quantity=5), conid=1, price=20.0)
+        assert positions[0]["quantity"] == 15
+        assert positions[0]["value"] == 1100.0
+
+    def test_reduces_a_position_on_the_opposite_side(self):
+        positions = [position(10)]
+        apply_fill(positions, order("1", side="SELL", quantity=4), conid=1, price=20.0)
+        assert positions[0]["quantity"] == 6
+        assert positions[0]["side"] == "BUY"
+        assert positions[0]["value"] == pytest.approx(600.0)
+
+    def test_flips_a_position_when_the_fill_is_larger(self):
+        positions = [position(10)]
+        apply_fill(positions, order("1", side="SELL", quantity=15), conid=1, price=20.0)
+        assert positions[0]["quantity"] == 5
+        assert positions[0]["side"] == "SELL"
+        assert positions[0]["value"] == -100.0
+
+    def test_reopens_a_position_from_zero(self):
+        positions = [position(0, side="SELL", value=0.0)]
+        apply_fill(positions, order("1", quantity=3), conid=1, price=20.0)
+        assert positions[0]["quantity"] == 3
+        assert positions[0]["side"] == "BUY"
+        assert positions[0]["value"] == 60.0
+
+
+class TestMatchingEngine:
+    def test_fills_by_price_then_time(self):
+        engine = MatchingEngine()
+        engine.add(order("1", limit_price=100.0))
+        engine.add(order("2", limit_price=101.0))
+        engine.add(order("3", limit_price=101.0))
+        engine.add(order("4", limit_price=99.0))
+        fills = engine.match({"AAPL": (99.0, 100.0)})
+        assert [fill.order["id"] for fill in fills] == ["2", "3", "1"]
+        assert all(fill.price == 100.0 for fill in fills)
+        assert list(engine.orders) == ["4"]
+
+    def test_sells_fill_at_the_bid_and_market_orders_at_either(self):
+        engine = MatchingEngine()
+        engine.add(order("1", side="SELL", limit_price=98.0))
+        engine.add(order("2", side="SELL", order_type="MKT", limit_price=None))
+        engine.add(order("3", order_type="MKT", limit_price=None))
+        fills = engine.match({"AAPL": (99.0, 100.0)})
+        assert [(fill.order["id"], fill.price) for fill in fills] == [
+            ("2", 99.0),
+            ("3", 100.0),
+            ("1", 99.0),
+        ]
+
+    def test_cancelled_orders_do_not_fill(self):
+        engine = MatchingEngine()
+        engine.add(order("1"))
+        engine.add(order("2"))
+        engine.cancel("1")
+        fills = engine.match({"AAPL": (99.0, 100.0)})
+        assert [fill.order["id"] for fill in fills] == ["2"]
+
+    def test_compacts_books_with_many_cancelled_orders(self):
+        engine = MatchingEngine(compact_ratio=0.5, compact_min=2)
+        for number in range(10):
+            engine.add(order(str(number), limit_price=50.0))
+        for number in range(6):
+            engine.cancel(str(number))
+        book = engine.books["AAPL"]
+        assert len(book.buys) < 10
+        assert {entry[2] for entry in book.buys} >= {"6", "7", "8", "9"}
+        fills = engine.match({"AAPL": (49.0, 50.0)})
+        assert sorted(fill.order["id"] for fill in fills) == ["6", "7", "8", "9"]
+
+    def test_restored_orders_fill_again(self):
+        engine = MatchingEngine()
+        engine.add(order("1"))
+        fills = engine.match({"AAPL": (99.0, 100.0)})
+        engine.restore([fill.order for fill in fills])
+        assert [fill.order["id"] for fill in engine.match({"AAPL": (99.0, 100.0)})] == ["1"]
+
+
+class FailingStorage(MemoryStorage):
+    def update_orders(self, updates, if_status=None):
+        raise RuntimeError("storage unavailable")
+
+
+def service(engine: MatchingEngine) -> MatchingService:
+    return MatchingService(engine, interval=1, sync_interval=1, lock_path="unused")
+
+
+def portfolio_with_position(db: MemoryStorage) -> None:
+    db.set_portfolio(
+        {"id": "p1", "name": "P", "owner_id": "u", "positions": [position(10)], "orders": []}
+    )
+
+
+class TestRecordFills:
+    def test_fills_are_applied_once_even_when_matched_twice(self):
+        db = MemoryStorage()
+        portfolio_with_position(db)
+        db.set_order(order("1", quantity=5))
+        fill = Fill(order("1", quantity=5), 20.0)
+        service(MatchingEngine()).record_fills(db, [fill], {"AAPL": 1})
+        # A second matcher that loaded the same open order
+        service(MatchingEngine()).record_fills(db, [fill], {"AAPL": 1})
+        assert db.get_portfolio("p1")["positions"][0]["quantity"] == 15
+        assert db.get_order("1")["status"] == "FILLED"
+
+    def test_orders_go_back_into_the_engine_when_storage_fails(self):
+        engine = MatchingEngine()
+        engine.add(order("1"))
+        fills = engine.match({"AAPL": (99.0, 100.0)})
+        with pytest.raises(RuntimeError):
+            service(engine).record_fills(FailingStorage(), fills, {"AAPL": 1})
+        assert list(engine.orders) == ["1"]
+
+    def test_pnl_written_later_does_not_undo_a_fill(self):
+        from app.writebehind import apply_pnl
+
+        db = MemoryStorage()
+        portfolio_with_position(db)
+        db.set_order(order("1", quantity=5))
+        # A valuation reads the portfolio before the fill and writes its PnL after it
+        stale_position_id = db.get_portfolio("p1")["positions"][0]["id"]
+        service(MatchingEngine()).record_fills(
+            db, [Fill(order("1", quantity=5), 20.0)], {"AAPL": 1}
+        )
+        db.modify_portfolio("p1", lambda portfolio: apply_pnl(portfolio, {stale_position_id: 42.0}))
+        stored = db.get_portfolio("p1")["positions"][0]
+        assert stored["quantity"] == 15
+        assert stored["pnl"] == 42.0
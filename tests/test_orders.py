@@ -0,0 +1,222 @@
+import base64
+import datetime
+import importlib
+import json
+import uuid
+
+import pytest
+
+from app import config, models, storage
+from app.storage.firestore import FIRESTORE_BATCH_LIMIT
+
+
+def make_orders(portfolio_id: str, count: int) -> list[dict]:
+    """
+    Orders across two symbols and both sides, with every third one sharing the previous one's
+    timestamp so that pages have to be ordered by id as well.
+    """
+    start = datetime.datetime(2024, 1, 1)
+    orders = []
+    for n in range(count):
+        created_at = start + datetime.timedelta(minutes=n - n % 3)
+        orders.append(
+            models.Order(
+                symbol=["AAPL", "MSFT"][n % 2],
+                quantity=1,
+                portfolio_id=portfolio_id,
+                side=["BUY", "SELL"][n % 3 == 0],
+                order_type="MKT",
+                created_at=str(created_at),
+            ).dict()
+        )
+    return orders
+
+
+def newest_first(orders: list[dict]) -> list[str]:
+    return [
+        order["id"]
+        for order in sorted(orders, key=lambda o: (o["created_at"], o["id"]), reverse=True)
+    ]
+
+
+def all_pages(db: storage.Storage, portfolio_id: str, limit: int, **filters) -> list[str]:
+    ids = []
+    after = None
+    while True:
+        page = db.list_orders(portfolio_id, limit=limit, after=after, **filters)
+        ids += [order["id"] for order in page]
+        if len(page) < limit:
+            return ids
+        after = (page[-1]["created_at"], page[-1]["id"])
+
+
+class TestListOrders:
+    @pytest.fixture
+    def portfolio_id(self, any_storage) -> str:
+        portfolio_id = str(uuid.uuid4())
+        self.orders = make_orders(portfolio_id, 25)
+        any_storage.set_orders(self.orders)
+        # Orders of another portfolio never show up
+        any_storage.set_orders(make_orders(str(uuid.uuid4()), 5))
+        return portfolio_id
+
+    def test_pages_cover_every_order_once(self, any_storage, portfolio_id):
+        assert all_pages(any_storage, portfolio_id, limit=4) == newest_first(self.orders)
+
+    def test_filters_by_symbol(self, any_storage, portfolio_id):
+        expected = newest_first([o for o in self.orders if o["symbol"] == "MSFT"])
+        assert all_pages(any_storage, portfolio_id, limit=4, symbol="MSFT") == expected
+
+    def test_filters_by_side(self, any_storage, portfolio_id):
+        expected = newest_first([o for o in self.orders if o["side"] == "SELL"])
+        assert all_pages(any_storage, portfolio_id, limit=4, side="SELL") == expected
+
+    def test_filters_by_since(self, any_storage, portfolio_id):
+        since = self.orders[10]["created_at"]
+        expected = newest_first([o for o in self.orders if o["created_at"] >= since])
+        assert all_pages(any_storage, portfolio_id, limit=4, since=since) == expected
+
+
+class TestListOrdersRoute:
+    @pytest.fixture
+    def headers(self, client, sign_up) -> dict:
+        return sign_up("alice")
+
+    @pytest.fixture
+    def portfolio_id(self, client, db, headers) -> str:
+        response = client.post("/portfolio", data={"portfolio_name": "P"}, headers=headers)
+        portfolio_id = response.json()["id"]
+        self.orders = make_orders(portfolio_id, 12)
+        db.set_orders(self.orders)
+        return portfolio_id
+
+    def pages(self, client, headers, **params) -> list[str]:
+        ids = []
+        cursor = None
+        while True:
+            query = {**params, "limit": 5, **({"cursor": cursor} if cursor else {})}
+            page = client.get("/orders", params=query, headers=headers).json()
+            ids += [order["id"] for order in page["orders"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def test_cursors_page_through_every_order_once(self, client, headers, portfolio_id):
+        ids = self.pages(client, headers, portfolio_id=portfolio_id)
+        assert ids == newest_first(self.orders)
+
+    def test_filters(self, client, headers, portfolio_id):
+        since = self.orders[6]["created_at"]
+        ids = self.pages(
+            client, headers, portfolio_id=portfolio_id, symbol="AAPL", side="BUY", since=since
+        )
+        expected = [
+            o
+            for o in self.orders
+            if o["symbol"] == "AAPL" and o["side"] == "BUY" and o["created_at"] >= since
+        ]
+        assert ids == newest_first(expected)
+
+    def test_other_users_portfolios_are_forbidden(self, client, sign_up, portfolio_id):
+        response = client.get(
+            "/orders", params={"portfolio_id": portfolio_id}, headers=sign_up("mallory")
+        )
+        assert response.status_code == 403
+
+    @pytest.mark.parametrize(
+        "cursor",
+        [
+            "not a cursor",
+            base64.urlsafe_b64encode(b"not json").decode(),
+            base64.urlsafe_b64encode(json.dumps(["only one part"]).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps({"created_at": "t"}).encode()).decode(),
+        ],
+    )
+    def test_malformed_cursors_are_rejected(self, client, headers, portfolio_id, cursor):
+        response = client.get(
+            "/orders", params={"portfolio_id": portfolio_id, "cursor": cursor}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+class TestCreateOrdersBatch:
+    @pytest.fixture
+    def db(self, db):
+        db.load({"symbols": [{"symbol": "AAPL", "company_name": "Apple Inc", "conid": 265598}]})
+        return db
+
+    @pytest.fixture
+    def headers(self, client, sign_up) -> dict:
+        return sign_up("alice")
+
+    @pytest.fixture
+    def portfolio_id(self, client, headers) -> str:
+        response = client.post("/portfolio", data={"portfolio_name": "P"}, headers=headers)
+        return response.json()["id"]
+
+    def order(self, **fields) -> dict:
+        return {"symbol": "AAPL", "quantity": 1, "side": "BUY", "order_type": "MKT", **fields}
+
+    def submit(self, client, headers, portfolio_id, orders: list[dict]):
+        return client.post(
+            "/orders/batch", params={"id": portfolio_id}, json=orders, headers=headers
+        )
+
+    def test_results_are_reported_per_order(self, client, db, headers, portfolio_id):
+        orders = [
+            self.order(),
+            self.order(quantity=-1),
+            self.order(symbol="NOPE"),
+            self.order(side="SELL"),
+        ]
+        results = self.submit(client, headers, portfolio_id, orders).json()
+        assert [result["index"] for result in results] == [0, 1, 2, 3]
+        assert [result["accepted"] for result in results] == [True, False, False, True]
+        assert "quantity" in results[1]["error"]
+        assert results[2]["error"] == "symbol: unknown symbol"
+        accepted_ids = {results[0]["order"]["id"], results[3]["order"]["id"]}
+        assert {order["id"] for order in db.list_orders(portfolio_id, limit=10)} == accepted_ids
+        recent = db.get_portfolio(portfolio_id)["orders"]
+        assert {order["id"] for order in recent} == accepted_ids
+
+    def test_accepted_orders_are_written_together(
+        self, client, db, headers, portfolio_id, monkeypatch
+    ):
+        writes = []
+        set_orders = db.set_orders
+
+        def record_write(orders):
+            writes.append([order["id"] for order in orders])
+            set_orders(orders)
+
+        monkeypatch.setattr(db, "set_orders", record_write)
+        results = self.submit(
+            client, headers, portfolio_id, [self.order(), self.order(quantity=0), self.order()]
+        ).json()
+        assert writes == [[results[0]["order"]["id"], results[2]["order"]["id"]]]
+
+    def test_a_failed_write_stores_no_orders(self, client, db, headers, portfolio_id, monkeypatch):
+        def fail(orders):
+            raise RuntimeError("write failed")
+
+        monkeypatch.setattr(db, "set_orders", fail)
+        with pytest.raises(RuntimeError):
+            self.submit(client, headers, portfolio_id, [self.order(), self.order()])
+        assert db.list_orders(portfolio_id, limit=10) == []
+        assert db.get_portfolio(portfolio_id)["orders"] == []
+
+    def test_batches_over_the_cap_are_rejected(
+        self, client, db, headers, portfolio_id, monkeypatch
+    ):
+        monkeypatch.setattr(config, "ORDER_BATCH_MAX", 2)
+        response = self.submit(client, headers, portfolio_id, [self.order()] * 3)
+        assert response.status_code == 400
+        assert db.list_orders(portfolio_id, limit=10) == []
+
+    def test_the_cap_fits_in_one_firestore_batch(self, monkeypatch):
+        monkeypatch.setenv("ORDER_BATCH_MAX", str(FIRESTORE_BATCH_LIMIT * 2))
+        try:
+            assert importlib.reload(config).ORDER_BATCH_MAX == FIRESTORE_BATCH_LIMIT
+        finally:
+            monkeypatch.undo()
+            importlib.reload(config)
@@ -0,0 +1,50 @@
+from app.streaming import PortfolioStream, QuoteHub
+
+
+def position(position_id: str, conid: int, quantity: float = 1) -> dict:
+    return {
+        "id": position_id,
+        "symbol": f"S{conid}",
+        "conid": conid,
+        "quantity": quantity,
+        "side": "BUY",
+        "value": 100.0,
+    }
+
+
+def quote(conid: int, price: float) -> dict:
+    return {"conid": conid, "bid_price": price, "ask_price": price}
+
+
+def stream_of(*positions: dict) -> PortfolioStream:
+    stream = PortfolioStream(
+        websocket=None,
+        portfolio_id="p1",
+        hub=QuoteHub(quotes=None, interval=1),
+        refresh_interval=1,
+        authorize=None,
+    )
+    stream.positions = list(positions)
+    stream.quotes = {1: quote(1, 110.0), 2: quote(2, 90.0)}
+    return stream
+
+
+def test_closed_positions_are_sent_as_removed():
+    stream = stream_of(position("a", 1), position("b", 2))
+    stream._message("snapshot")
+    # Position b is closed, so it is no longer among the positions read from storage
+    stream.positions = [position("a", 1)]
+    message = stream._message("update")
+    assert message["positions"] == [{"id": "b", "removed": True}]
+    assert message["total_value"] == 110.0
+    # The removal is only sent once
+    assert stream._message("update") is None
+
+
+def test_reopened_positions_are_sent_again():
+    stream = stream_of(position("a", 1))
+    stream._message("snapshot")
+    stream.positions = []
+    stream._message("update")
+    stream.positions = [position("a", 1)]
+    assert [p["id"] for p in stream._message("update")["positions"]] == ["a"]
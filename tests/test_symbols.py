@@ -0,0 +1,128 @@
+import json
+
+from app.storage.memory import MemoryStorage
+from app.symbols import SymbolIndex, SymbolsSnapshot
+
+
+def symbol(ticker: str, name: str) -> dict:
+    return {"symbol": ticker, "company_name": name}
+
+
+def tickers(index: SymbolIndex, query: str, limit: int = 10) -> list[str]:
+    return [match["symbol"] for match in index.search(query, limit)]
+
+
+def index_of(*symbols: dict) -> SymbolIndex:
+    index = SymbolIndex()
+    index.rebuild(list(symbols))
+    return index
+
+
+class TestSearch:
+    def test_ranks_exact_ticker_then_ticker_prefix_then_company_name(self):
+        index = index_of(
+            symbol("APLE", "Apple Hospitality REIT"),
+            symbol("APPLX", "Applied Things"),
+            symbol("APP", "AppLovin"),
+            symbol("AAPL", "Apple Inc"),
+            symbol("APPL", "Appleseed"),
+        )
+        assert tickers(index, "app") == ["APP", "APPL", "APPLX", "AAPL", "APLE"]
+
+    def test_shorter_tickers_come_first_within_a_group(self):
+        index = index_of(
+            symbol("ZZZZ", "Alpha Four"),
+            symbol("Z", "Alpha One"),
+            symbol("YY", "Alpha Two"),
+            symbol("ZZ", "Alpha Two Too"),
+        )
+        assert tickers(index, "alpha") == ["Z", "YY", "ZZ", "ZZZZ"]
+
+    def test_every_query_word_must_match(self):
+        index = index_of(
+            symbol("AAPL", "Apple Inc"),
+            symbol("APLE", "Apple Hospitality REIT"),
+        )
+        assert tickers(index, "apple hos") == ["APLE"]
+        assert tickers(index, "aapl inc") == ["AAPL"]
+
+    def test_stops_at_the_limit(self):
+        index = index_of(*(symbol(f"T{number}", "Widget Inc") for number in range(100)))
+        assert len(tickers(index, "inc", limit=5)) == 5
+        assert tickers(index, "t", limit=3) == ["T0", "T1", "T2"]
+
+    def test_queries_without_words_match_nothing(self):
+        assert tickers(index_of(symbol("AAPL", "Apple Inc")), " .,") == []
+
+
+class TestApplyChanges:
+    def test_matches_a_full_rebuild(self):
+        index = index_of(
+            symbol("AAPL", "Apple Inc"),
+            symbol("MSFT", "Microsoft Corp"),
+            symbol("IBM", "International Business Machines"),
+        )
+        index.apply_changes(
+            [symbol("AAPL", "Banana Inc"), symbol("NVDA", "Nvidia Corp")], ["MSFT"]
+        )
+        rebuilt = index_of(
+            symbol("AAPL", "Banana Inc"),
+            symbol("IBM", "International Business Machines"),
+            symbol("NVDA", "Nvidia Corp"),
+        )
+        assert index._tickers == rebuilt._tickers
+        assert index._words == rebuilt._words
+        assert tickers(index, "apple") == []
+        assert tickers(index, "banana") == ["AAPL"]
+        assert tickers(index, "msft") == []
+        assert tickers(index, "corp") == ["NVDA"]
+
+    def test_searches_in_progress_keep_the_index_they_started_with(self):
+        index = index_of(symbol("AAPL", "Apple Inc"))
+        words = index._words
+        index.apply_changes([symbol("AMZN", "Amazon Inc")], [])
+        assert words == [("apple", 4, "AAPL"), ("inc", 4, "AAPL")]
+        assert tickers(index, "inc") == ["AAPL", "AMZN"]
+
+
+class TestSymbolsSnapshot:
+    def snapshot_of(self, db: MemoryStorage) -> tuple[SymbolsSnapshot, SymbolIndex]:
+        snapshot = SymbolsSnapshot(refresh_interval=60, flush_interval=1)
+        index = SymbolIndex()
+        snapshot.add_listener(index)
+        snapshot.load(db)
+        db.watch_symbols(snapshot.apply_changes)
+        return snapshot, index
+
+    def test_writes_are_applied_together_on_flush(self, monkeypatch):
+        db = MemoryStorage()
+        db.load({"symbols": [symbol(f"S{n}", "Something") for n in range(100)]})
+        snapshot, index = self.snapshot_of(db)
+        rebuilds = []
+        original_rebuild = snapshot._rebuild
+        monkeypatch.setattr(snapshot, "_rebuild", lambda: rebuilds.append(original_rebuild()))
+        db.set_symbol(symbol("AAPL", "Apple"))
+        db.set_symbol(symbol("AAPL", "Apple Inc"))
+        db.set_symbol(symbol("MSFT", "Microsoft"))
+        assert tickers(index, "aapl") == []
+        snapshot.flush()
+        assert len(rebuilds) == 1
+        assert tickers(index, "apple inc") == ["AAPL"]
+        body = json.loads(snapshot.payload[0])
+        assert {"ticker": "AAPL", "name": "Apple Inc", "logo": None} in body
+        assert len(body) == 102
+
+    def test_bulk_writes_rebuild_the_listeners(self):
+        db = MemoryStorage()
+        snapshot, index = self.snapshot_of(db)
+        for n in range(50):
+            db.set_symbol(symbol(f"S{n}", "Something"))
+        snapshot.flush()
+        assert len(tickers(index, "something", limit=100)) == 50
+
+    def test_load_keeps_queued_writes(self):
+        db = MemoryStorage()
+        snapshot, index = self.snapshot_of(db)
+        snapshot.apply_changes([symbol("AAPL", "Apple")], [])
+        snapshot.load(db)
+        assert tickers(index, "aapl") == ["AAPL"]
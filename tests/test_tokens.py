@@ -0,0 +1,63 @@
+import time
+
+import fastapi.testclient
+
+import main
+from app import models, storage
+from app.cache import user_cache
+from app.storage.memory import MemoryStorage
+from app.tokens import TokenVersions, UserVersions, token_versions
+
+
+def user() -> models.UserInDB:
+    return models.UserInDB(id="u1", username="alice", email="a", hashed_password="x")
+
+
+def test_revocations_by_other_workers_drop_cached_versions():
+    db = MemoryStorage()
+    worker = TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30)
+    other_worker = TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30)
+    worker.set("u1", UserVersions(0, 0, False))
+    user_cache.set(user())
+    other_worker.revoke(db, "u1", "alice", UserVersions(1, 0, False))
+    worker.poll(db)
+    assert worker.get("u1") is None
+    assert user_cache.get("alice") is None
+
+
+def test_revocations_are_only_seen_once():
+    db = MemoryStorage()
+    worker = TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30)
+    TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30).revoke(db, "u1", "alice", UserVersions(1, 0, False))
+    worker.poll(db)
+    worker.set("u1", UserVersions(1, 0, False))
+    worker.poll(db)
+    assert worker.get("u1") == UserVersions(1, 0, False)
+
+
+def test_revocations_stamped_by_slower_clocks_are_seen():
+    db = MemoryStorage()
+    worker = TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30)
+    db.set_token_revocation("u2", "bob", time.time())
+    worker.poll(db)
+    worker.set("u1", UserVersions(0, 0, False))
+    # Recorded after the poll by a host whose clock is ten seconds behind
+    db.set_token_revocation("u1", "alice", time.time() - 10)
+    worker.poll(db)
+    assert worker.get("u1") is None
+
+
+def test_portfolio_changes_are_seen_by_other_workers(monkeypatch):
+    db = MemoryStorage()
+    monkeypatch.setitem(main.app.dependency_overrides, storage.get_storage, lambda: db)
+    monkeypatch.setattr(storage, "get_storage", lambda: db)
+    other_worker = TokenVersions(maxsize=10, ttl=60, poll_interval=1, clock_skew=30)
+    with fastapi.testclient.TestClient(main.app) as client:
+        client.post("/signup", data={"username": "alice", "password": "pw", "email": "a@b.c"})
+        token = client.post("/token", data={"username": "alice", "password": "pw"}).json()
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+        user_id = db.get_user_by_username("alice")["id"]
+        other_worker.set(user_id, token_versions.get(user_id))
+        client.post("/portfolio", data={"portfolio_name": "p"}, headers=headers)
+    other_worker.poll(db)
+    assert other_worker.get(user_id) is None
@@ -0,0 +1,72 @@
+import asyncio
+
+from app import storage
+from app.storage.memory import MemoryStorage
+from app.writebehind import PortfolioWriteBuffer
+
+
+def stored_pnl(db: MemoryStorage) -> float:
+    return db.get_portfolio("p1")["positions"][0]["pnl"]
+
+
+def test_pnl_is_rewritten_after_another_worker_changed_it(monkeypatch):
+    db = MemoryStorage()
+    db.set_portfolio(
+        {
+            "id": "p1",
+            "name": "P",
+            "owner_id": "u",
+            "orders": [],
+            "positions": [{"id": "pos", "symbol": "AAPL", "quantity": 1, "pnl": 0.0}],
+        }
+    )
+    monkeypatch.setattr(storage, "get_storage", lambda: db)
+    worker = PortfolioWriteBuffer(flush_interval=1)
+    other_worker = PortfolioWriteBuffer(flush_interval=1)
+    worker.update("p1", {"pos": 5.0})
+    asyncio.run(worker.flush())
+    other_worker.update("p1", {"pos": 7.0})
+    asyncio.run(other_worker.flush())
+    assert stored_pnl(db) == 7.0
+    # The first worker values the portfolio at 5 again after reading 7
+    worker.update("p1", {"pos": 5.0})
+    asyncio.run(worker.flush())
+    assert stored_pnl(db) == 5.0
+
+
+def test_repeated_updates_within_a_flush_window_are_skipped():
+    buffer = PortfolioWriteBuffer(flush_interval=1)
+    buffer.update("p1", {"pos": 5.0})
+    buffer.update("p1", {"pos": 5.0})
+    assert buffer.stats()["skipped"] == 1
+    assert buffer.stats()["pending"] == 1
+
+
+def test_pending_updates_are_written_in_one_batch(monkeypatch):
+    db = MemoryStorage()
+    for portfolio_id in ["p1", "p2"]:
+        db.set_portfolio(
+            {
+                "id": portfolio_id,
+                "name": "P",
+                "owner_id": "u",
+                "orders": [],
+                "positions": [{"id": "pos", "symbol": "AAPL", "quantity": 1, "pnl": 0.0}],
+            }
+        )
+    monkeypatch.setattr(storage, "get_storage", lambda: db)
+    batches = []
+    modify_portfolios = db.modify_portfolios
+
+    def record_batch(modifications):
+        batches.append(modify_portfolios(modifications))
+
+    monkeypatch.setattr(db, "modify_portfolios", record_batch)
+    buffer = PortfolioWriteBuffer(flush_interval=1)
+    buffer.update("p1", {"pos": 5.0})
+    buffer.update("p2", {"pos": 6.0})
+    buffer.update("missing", {"pos": 7.0})
+    asyncio.run(buffer.flush())
+    assert len(batches) == 1
+    assert set(batches[0]) == {"p1", "p2"}
+    assert db.get_portfolio("p2")["positions"][0]["pnl"] == 6.0